@@ -19,6 +19,8 @@
     const [editingTypeForm, setEditingTypeForm] = useState({ name: '', default_interval_km: 10000, default_interval_months: 12, description: '' });
     const [loadingCreate, setLoadingCreate] = useState(false);
     const [showAddVehicle, setShowAddVehicle] = useState(false);
+    const [duplicateClusters, setDuplicateClusters] = useState(null);
+    const [loadingDuplicates, setLoadingDuplicates] = useState(false);
 
     const fetchData = async () => {
       try {
@@ -39,6 +41,33 @@
       }
     }, [token]);
 
+    const findDuplicates = async (useAi) => {
+      setLoadingDuplicates(true);
+      try {
+        const res = await axios.get('maintenance-types/duplicates', { params: { use_ai: useAi }, headers: { Authorization: `Bearer ${token}` } });
+        setDuplicateClusters(res.data.clusters || []);
+      } catch (err) {
+        alert(err?.response?.data?.detail || 'Erro ao procurar tipos duplicados');
+      } finally {
+        setLoadingDuplicates(false);
+      }
+    };
+
+    const mergeCluster = async (cluster) => {
+      if (!confirm(`Mesclar ${cluster.names.length} tipos em '${cluster.suggested_name}'? Os registros serão movidos para este tipo.`)) return;
+      try {
+        await axios.post('maintenance-types/merge', {
+          target_id: cluster.target_id,
+          source_ids: cluster.type_ids.filter(typeId => typeId !== cluster.target_id),
+          name: cluster.suggested_name
+        }, { headers: { Authorization: `Bearer ${token}` } });
+        setDuplicateClusters(duplicateClusters.filter(c => c !== cluster));
+        fetchData();
+      } catch (err) {
+        alert(err?.response?.data?.detail || 'Erro ao mesclar tipos');
+      }
+    };
+
     // detecta rota /admin/vehicle/{id} ou se deve abrir formulário de adição
     useEffect(() => {
       const path = window.location.pathname;
@@ -243,6 +272,43 @@
           )
         ),
 
+        // Tipos duplicados (mesmo serviço com nomes diferentes)
+        React.createElement('div', { className: 'mb-8 p-4 bg-gray-50 dark:bg-gray-700/50 rounded-lg' },
+          React.createElement('div', { className: 'flex flex-wrap justify-between items-center gap-2' },
+            React.createElement('h4', { className: 'text-sm font-semibold' }, 'Tipos Duplicados'),
+            React.createElement('div', { className: 'flex gap-2' },
+              React.createElement('button', {
+                onClick: () => findDuplicates(false),
+                disabled: loadingDuplicates,
+                className: 'bg-blue-600 text-white px-3 py-2 rounded hover:bg-blue-700 text-sm disabled:opacity-50'
+              }, loadingDuplicates ? 'Procurando...' : 'Procurar Duplicados'),
+              React.createElement('button', {
+                onClick: () => findDuplicates(true),
+                disabled: loadingDuplicates,
+                title: 'Os grupos ambíguos são confirmados pela IA configurada no seu Perfil',
+                className: 'bg-indigo-600 text-white px-3 py-2 rounded hover:bg-indigo-700 text-sm disabled:opacity-50'
+              }, 'Revisar com IA')
+            )
+          ),
+          duplicateClusters && (duplicateClusters.length === 0
+            ? React.createElement('p', { className: 'text-sm text-gray-500 mt-3' }, 'Nenhum tipo duplicado encontrado.')
+            : React.createElement('div', { className: 'space-y-2 mt-3' },
+              duplicateClusters.map(cluster =>
+                React.createElement('div', { key: cluster.type_ids.join('-'), className: 'p-3 border dark:border-gray-600 rounded flex flex-wrap justify-between items-center gap-2' },
+                  React.createElement('div', null,
+                    React.createElement('div', { className: 'text-sm' }, cluster.names.join(' · ')),
+                    React.createElement('div', { className: 'text-xs text-gray-500' },
+                      cluster.confidence === 'ambiguous' ? 'Semelhança incerta — confira antes de mesclar' : 'Provável duplicata')
+                  ),
+                  React.createElement('button', {
+                    onClick: () => mergeCluster(cluster),
+                    className: 'text-sm px-3 py-1 bg-green-600 text-white rounded hover:bg-green-700'
+                  }, `Mesclar em '${cluster.suggested_name}'`)
+                )
+              )
+            ))
+        ),
+
         React.createElement('div', { className: 'space-y-2' },
           (Array.isArray(maintenanceTypes) ? maintenanceTypes : []).sort((a, b) => a.name.localeCompare(b.name, 'pt-BR', { sensitivity: 'base' })).map(type =>
             React.createElement('div', { key: type.id, className: 'p-4 border dark:border-gray-700 rounded-lg flex justify-between items-center' },
@@ -301,7 +367,7 @@
                 onClick: async () => {
                   try {
                     const res = await axios.put(`maintenance-types/${editingTypeId}`, editingTypeForm, { headers: { Authorization: `Bearer ${token}` } });
-                    setMaintenanceTypes(maintenanceTypes.map(t => t.id === res.data.id ? res.data : t));
+                    setMaintenanceTypes(maintenanceTypes.map(t => t.id === editingTypeId ? res.data : t));
                     setEditingTypeId(null);
                   } catch (err) {
                     alert(err?.response?.data?.detail || 'Erro ao atualizar tipo');
@@ -1,5 +1,5 @@
 (function () {
-  const { useEffect, useState, useContext } = React;
+  const { useEffect, useState, useContext, useRef } = React;
 
   function History() {
     const { token } = useContext(window.AuthContext);
@@ -13,7 +13,9 @@
     }
     const navigate = useNavigate ? useNavigate() : (path => { window.location.href = path; });
     const [vehicle, setVehicle] = useState(null);
-    const [maintenanceHistory, setMaintenanceHistory] = useState([]);
+    const [pageItems, setPageItems] = useState([]);
+    const [pageCursors, setPageCursors] = useState([null]);
+    const [nextCursor, setNextCursor] = useState(null);
     const [maintenanceTypes, setMaintenanceTypes] = useState([]);
     const [analysis, setAnalysis] = useState({});
     const [editingLogId, setEditingLogId] = useState(null);
@@ -26,6 +28,7 @@
     const [aiInsights, setAiInsights] = useState(null);
     const [aiLoading, setAiLoading] = useState(false);
     const [aiError, setAiError] = useState('');
+    const mountedRef = useRef(true);
 
     useEffect(() => {
       const style = document.createElement('style');
@@ -49,114 +52,160 @@
       };
     }, []);
 
+    // Percorre todas as páginas do histórico (paginação por cursor no servidor)
+    const fetchAllHistory = async (filters = {}) => {
+      const items = [];
+      let cursor = null;
+      do {
+        const res = await axios.get(`vehicles/${id}/history`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { ...filters, limit: 500, ...(cursor ? { cursor } : {}) }
+        });
+        items.push(...(res.data.items || []));
+        cursor = res.data.next_cursor;
+      } while (cursor);
+      return items;
+    };
+
+    // Busca apenas a página exibida, com o filtro de categoria aplicado no servidor
+    const fetchHistoryPage = async (page) => {
+      const filters = categoryFilter !== 'todas' ? { category: categoryFilter } : {};
+      try {
+        if (historyLimit === 'tudo') {
+          setPageItems(await fetchAllHistory(filters));
+          setNextCursor(null);
+          return;
+        }
+        const cursor = pageCursors[page - 1];
+        const res = await axios.get(`vehicles/${id}/history`, {
+          headers: { Authorization: `Bearer ${token}` },
+          params: { ...filters, limit: historyLimit, ...(cursor ? { cursor } : {}) }
+        });
+        setPageItems(res.data.items || []);
+        setNextCursor(res.data.next_cursor);
+        const cursors = pageCursors.slice(0, page);
+        cursors[page] = res.data.next_cursor;
+        setPageCursors(cursors);
+      } catch (error) {
+        console.error("Erro ao buscar histórico", error);
+      }
+    };
+
     const fetchData = async () => {
       try {
-        const [historyRes, vehiclesRes, typesRes, insightsRes] = await Promise.all([
-          axios.get(`vehicles/${id}/history`, { headers: { Authorization: `Bearer ${token}` } }),
-          axios.get('vehicles', { headers: { Authorization: `Bearer ${token}` } }),
+        // Análises calculadas no servidor: não é mais preciso baixar a frota inteira nem todo o histórico
+        const [vehicleRes, analysisRes, typesRes, insightsRes] = await Promise.all([
+          axios.get(`vehicles/${id}`, { headers: { Authorization: `Bearer ${token}` } }),
+          axios.get(`vehicles/${id}/analysis`, { headers: { Authorization: `Bearer ${token}` } }),
           axios.get('maintenance-types', { headers: { Authorization: `Bearer ${token}` } }),
           axios.get(`vehicles/${id}/insights`, { headers: { Authorization: `Bearer ${token}` } }).catch(() => ({ data: null }))
         ]);
-        const vid = parseInt(id, 10);
-        const found = (vehiclesRes.data || []).find(v => v.id === vid);
-        setVehicle(found || null);
-        const history = historyRes.data || [];
-        const mTypes = typesRes.data || [];
-        setMaintenanceHistory(history);
-        setMaintenanceTypes(mTypes);
+        setVehicle(vehicleRes.data || null);
+        setMaintenanceTypes(typesRes.data || []);
 
         if (insightsRes && insightsRes.data && insightsRes.data.generated_at) {
           setAiInsights(insightsRes.data);
         }
-
-        // Calcular análises
-        const now = new Date();
-        const oneYearAgo = new Date(now.getFullYear() - 1, now.getMonth(), now.getDate());
-        const sixMonthsAgo = new Date(now.getFullYear(), now.getMonth() - 6, now.getDate());
-        const threeMonthsAgo = new Date(now.getFullYear(), now.getMonth() - 3, now.getDate());
-
-        const last12MonthsLogs = history.filter(log => new Date(log.date_performed) >= oneYearAgo);
-        const last6MonthsLogs = history.filter(log => new Date(log.date_performed) >= sixMonthsAgo);
-        const last3MonthsLogs = history.filter(log => new Date(log.date_performed) >= threeMonthsAgo);
-
-        // KM rodados nos últimos 12 meses
-        let kmDriven = 0;
-        if (last12MonthsLogs.length > 0) {
-          const sortedLogs = last12MonthsLogs.sort((a, b) => a.km_performed - b.km_performed);
-          kmDriven = sortedLogs[sortedLogs.length - 1].km_performed - sortedLogs[0].km_performed;
+        // Geração já em andamento (ex.: página recarregada): continua acompanhando
+        if (insightsRes && insightsRes.data && insightsRes.data.job) {
+          waitForJob(insightsRes.data.job.id);
         }
 
-        // Média mensal
-        const monthlyKm = kmDriven / 12;
-
-        // Custos por categoria
-        const costsByCategory = { preventiva: 0, desgaste: 0, corretiva: 0 };
-        last12MonthsLogs.forEach(log => {
-          const total = (log.service_cost || 0) + (log.product_cost || 0);
-          costsByCategory[log.category] = (costsByCategory[log.category] || 0) + total;
+        const a = analysisRes.data || {};
+        setAnalysis({
+          logCount: a.log_count || 0,
+          kmDriven: a.km_driven || 0,
+          monthlyKm: a.monthly_km || 0,
+          costsByCategory: a.costs_by_category || {},
+          avgCosts: a.avg_costs || {},
+          categoryTotals: a.category_totals || {},
+          futureProjections: (a.future_projections || []).map(p => ({
+            type: p.type,
+            nextKm: p.next_km || 0,
+            nextDate: p.next_date,
+            estimatedCost: p.estimated_cost || 0
+          })),
+          monthlyProjection: (a.monthly_projection || []).map(m => {
+            const [year, month] = m.month.split('-').map(Number);
+            return {
+              month: new Date(year, month - 1, 1).toLocaleDateString('pt-BR', { month: 'long', year: 'numeric' }),
+              maintenances: (m.maintenances || []).map(type => ({ type })),
+              totalCost: m.total_cost || 0
+            };
+          }),
+          totalSpent: a.total_spent || 0,
+          totalSpent6Months: a.total_spent_6_months || 0,
+          totalSpent3Months: a.total_spent_3_months || 0
         });
+      } catch (error) {
+        console.error("Erro ao buscar dados", error);
+      }
+    };
 
-        // Estimativas de custos médios
-        const avgCosts = {};
-        ['preventiva', 'desgaste', 'corretiva'].forEach(cat => {
-          const catLogs = last12MonthsLogs.filter(log => log.category === cat);
-          if (catLogs.length > 0) {
-            const totalCost = catLogs.reduce((sum, log) => sum + (log.service_cost || 0) + (log.product_cost || 0), 0);
-            avgCosts[cat] = totalCost / catLogs.length;
-          } else {
-            avgCosts[cat] = 0;
-          }
-        });
+    const reloadAll = () => {
+      fetchData();
+      fetchHistoryPage(currentPage);
+    };
 
-        // Projeção futura usando intervalos reais
-        const futureProjections = [];
-        maintenanceTypes.forEach(mt => {
-          const lastLog = history.filter(log => log.maintenance_type === mt.name).sort((a, b) => new Date(b.date_performed) - new Date(a.date_performed))[0];
-          if (lastLog) {
-            const nextKm = lastLog.km_performed + (mt.default_interval_km || 10000);
-            const nextDate = new Date(lastLog.date_performed);
-            nextDate.setMonth(nextDate.getMonth() + (mt.default_interval_months || 12));
-
-            futureProjections.push({
-              type: mt.name,
-              nextKm,
-              nextDate: nextDate.toISOString().split('T')[0],
-              estimatedCost: avgCosts[lastLog.category] || 0
-            });
+    const waitForJob = async (jobId) => {
+      // A geração roda em segundo plano no servidor: consulta o job até terminar
+      setAiLoading(true);
+      setAiError('');
+      try {
+        while (mountedRef.current) {
+          const res = await axios.get(`jobs/${jobId}`, { headers: { Authorization: `Bearer ${token}` } });
+          const job = res.data;
+          if (job.status === 'done') {
+            setAiInsights(job.result);
+            break;
           }
-        });
-
-        // Projeção mensal dos próximos 12 meses
-        const monthlyProjection = [];
-        for (let i = 0; i < 12; i++) {
-          const monthDate = new Date(now.getFullYear(), now.getMonth() + i, 1);
-          const monthKey = monthDate.toLocaleDateString('pt-BR', { month: 'long', year: 'numeric' });
-          const dueMaintenances = futureProjections.filter(proj => {
-            const projDate = new Date(proj.nextDate);
-            return projDate.getFullYear() === monthDate.getFullYear() && projDate.getMonth() === monthDate.getMonth();
-          });
-          const totalCost = dueMaintenances.reduce((sum, m) => sum + m.estimatedCost, 0);
-
-          monthlyProjection.push({
-            month: monthKey,
-            maintenances: dueMaintenances,
-            totalCost
-          });
+          if (job.status === 'failed') {
+            setAiError(job.error || 'Erro ao gerar insights.');
+            break;
+          }
+          await new Promise(resolve => setTimeout(resolve, 2000));
         }
+      } catch (err) {
+        setAiError(err?.response?.data?.detail || 'Erro ao gerar insights.');
+      } finally {
+        if (mountedRef.current) setAiLoading(false);
+      }
+    };
 
-        setAnalysis({
-          kmDriven,
-          monthlyKm,
-          costsByCategory,
-          avgCosts,
-          futureProjections,
-          monthlyProjection,
-          totalSpent: Object.values(costsByCategory).reduce((a, b) => a + b, 0),
-          totalSpent6Months: last6MonthsLogs.reduce((sum, log) => sum + (log.service_cost || 0) + (log.product_cost || 0), 0),
-          totalSpent3Months: last3MonthsLogs.reduce((sum, log) => sum + (log.service_cost || 0) + (log.product_cost || 0), 0)
-        });
-      } catch (error) {
-        console.error("Erro ao buscar dados", error);
+    const streamInsights = async () => {
+      // Recebe os insights via Server-Sent Events, exibindo cada item assim que a IA o produz
+      const res = await fetch(`${axios.defaults.baseURL || ''}/vehicles/${id}/insights/stream`, {
+        method: 'POST',
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      if (!res.ok) {
+        const body = await res.json().catch(() => ({}));
+        throw { response: { data: body } };
+      }
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      const partial = { chronic_issues: [], suggested_maintenance: [] };
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const raw of events) {
+          const lines = raw.split('\n');
+          const event = (lines.find(l => l.startsWith('event: ')) || '').slice(7);
+          const data = JSON.parse((lines.find(l => l.startsWith('data: ')) || 'data: null').slice(6));
+          if (!mountedRef.current) return;
+          if (event === 'partial') {
+            partial[data.field] = [...partial[data.field], data.item];
+            setAiInsights({ ...partial });
+          } else if (event === 'final') {
+            setAiInsights(data);
+          } else if (event === 'error') {
+            setAiError(data.detail || 'Erro ao gerar insights.');
+          }
+        }
       }
     };
 
@@ -164,28 +213,62 @@
       setAiLoading(true);
       setAiError('');
       try {
-        const res = await axios.post(`vehicles/${id}/insights`, {}, { headers: { Authorization: `Bearer ${token}` } });
-        setAiInsights(res.data);
+        if (window.ReadableStream && window.TextDecoder) {
+          await streamInsights();
+          if (mountedRef.current) setAiLoading(false);
+        } else {
+          // Navegadores sem streaming: gera em segundo plano e acompanha o job
+          const res = await axios.post(`vehicles/${id}/insights`, {}, { headers: { Authorization: `Bearer ${token}` } });
+          await waitForJob(res.data.id);
+        }
       } catch (err) {
         setAiError(err?.response?.data?.detail || 'Erro ao gerar insights.');
-      } finally {
         setAiLoading(false);
       }
     };
 
+    useEffect(() => {
+      mountedRef.current = true;
+      return () => { mountedRef.current = false; };
+    }, []);
+
     useEffect(() => {
       if (token && id) {
         fetchData();
       }
     }, [token, id]);
 
+    useEffect(() => {
+      if (token && id) {
+        fetchHistoryPage(currentPage);
+      }
+    }, [token, id, categoryFilter, historyLimit, currentPage]);
+
     if (!vehicle) {
       return React.createElement('div', { className: 'flex justify-center items-center h-64' },
         React.createElement('div', { className: 'text-gray-600 dark:text-gray-400' }, 'Carregando...')
       );
     }
 
-    const exportCsv = () => {
+    const importFile = async (e) => {
+      const file = e.target.files && e.target.files[0];
+      e.target.value = '';
+      if (!file) return;
+      const form = new FormData();
+      form.append('file', file);
+      try {
+        const res = await axios.post(`maintenance-logs/import?vehicle_id=${id}`, form, { headers: { Authorization: `Bearer ${token}` } });
+        const { imported, failed, errors } = res.data;
+        const details = (errors || []).slice(0, 10).map(err => `Linha ${err.line}: ${err.error}`).join('\n');
+        alert(`${imported} manutenções importadas${failed ? `, ${failed} com erro:\n${details}` : ''}`);
+        fetchData();
+      } catch (err) {
+        alert(err?.response?.data?.detail || 'Erro ao importar arquivo');
+      }
+    };
+
+    const exportCsv = async () => {
+      const maintenanceHistory = await fetchAllHistory();
       if (!maintenanceHistory || maintenanceHistory.length === 0) {
         alert('Nenhuma manutenção para exportar');
         return;
@@ -232,8 +315,13 @@
           }, 'Imprimir Histórico'),
           React.createElement('button', {
             onClick: exportCsv,
-            className: 'bg-green-600 hover:bg-green-700 text-white px-4 py-2 rounded font-medium'
-          }, 'Exportar CSV')
+            className: 'bg-green-600 hover:bg-green-700 text-white px-4 py-2 rounded font-medium mr-2'
+          }, 'Exportar CSV'),
+          React.createElement('label', {
+            className: 'bg-teal-600 hover:bg-teal-700 text-white px-4 py-2 rounded font-medium cursor-pointer'
+          }, 'Importar CSV',
+            React.createElement('input', { type: 'file', accept: '.csv,.ndjson,.jsonl', onChange: importFile, className: 'hidden' })
+          )
         )
       ),
 
@@ -255,7 +343,7 @@
         ),
 
         React.createElement('h3', { className: 'text-xl font-semibold text-gray-900 dark:text-white mb-4' }, 'Histórico de Manutenções'),
-        maintenanceHistory.length === 0
+        (analysis.logCount || 0) === 0
           ? React.createElement('p', { className: 'text-gray-600 dark:text-gray-400' }, 'Nenhuma manutenção registrada ainda.')
           : React.createElement('div', { className: 'space-y-6' },
             // Filtros de Categoria e Exibição
@@ -293,18 +381,14 @@
               )
             ),
 
-            // Lista Única Ordenada e Paginada
+            // Lista Única Ordenada e Paginada (página atual vem do servidor)
             (() => {
-              const filteredHistory = maintenanceHistory
-                .filter(log => categoryFilter === 'todas' || log.category === categoryFilter)
-                .sort((a, b) => new Date(b.date_performed) - new Date(a.date_performed));
-
-              const totalItems = filteredHistory.length;
-              const totalPages = historyLimit === 'tudo' ? 1 : Math.ceil(totalItems / historyLimit);
+              const totalItems = categoryFilter === 'todas'
+                ? (analysis.logCount || 0)
+                : ((analysis.categoryTotals || {})[categoryFilter]?.count || 0);
+              const totalPages = historyLimit === 'tudo' ? 1 : Math.max(1, Math.ceil(totalItems / historyLimit));
 
-              const paginatedHistory = historyLimit === 'tudo'
-                ? filteredHistory
-                : filteredHistory.slice((currentPage - 1) * historyLimit, currentPage * historyLimit);
+              const paginatedHistory = pageItems;
 
               return React.createElement(React.Fragment, null,
                 React.createElement('div', { className: 'space-y-3' },
@@ -329,10 +413,9 @@
                           ),
                           React.createElement('button', {
                             onClick: () => {
-                              const type = maintenanceTypes.find(t => t.name === item.maintenance_type);
                               setEditingLogId(item.id);
                               setEditingLogForm({
-                                maintenance_type_id: type ? type.id : '',
+                                maintenance_type_id: item.maintenance_type_id || '',
                                 km_performed: item.km_performed,
                                 date_performed: item.date_performed.split('T')[0],
                                 notes: item.notes || '',
@@ -348,7 +431,7 @@
                               if (!confirm('Deseja realmente excluir este registro de manutenção?')) return;
                               try {
                                 await axios.delete(`maintenance-logs/${item.id}`, { headers: { Authorization: `Bearer ${token}` } });
-                                fetchData();
+                                reloadAll();
                               } catch (err) {
                                 alert('Erro ao excluir registro');
                               }
@@ -395,8 +478,8 @@
                   React.createElement('span', { className: 'text-sm font-medium text-gray-700 dark:text-gray-300' }, `Página ${currentPage} de ${totalPages}`),
                   React.createElement('button', {
                     onClick: () => setCurrentPage(p => Math.min(totalPages, p + 1)),
-                    disabled: currentPage === totalPages,
-                    className: 'px-4 py-2 rounded font-medium text-sm transition-colors ' + (currentPage === totalPages ? 'bg-gray-100 text-gray-400 dark:bg-gray-800 dark:text-gray-600 cursor-not-allowed' : 'bg-gray-200 text-gray-700 hover:bg-gray-300 dark:bg-gray-700 dark:text-gray-300 dark:hover:bg-gray-600')
+                    disabled: currentPage === totalPages || !nextCursor,
+                    className: 'px-4 py-2 rounded font-medium text-sm transition-colors ' + (currentPage === totalPages || !nextCursor ? 'bg-gray-100 text-gray-400 dark:bg-gray-800 dark:text-gray-600 cursor-not-allowed' : 'bg-gray-200 text-gray-700 hover:bg-gray-300 dark:bg-gray-700 dark:text-gray-300 dark:hover:bg-gray-600')
                   }, 'Próxima')
                 )
               );
@@ -407,9 +490,9 @@
               React.createElement('h4', { className: 'text-xl font-bold text-gray-900 dark:text-white mb-4' }, 'Consolidado por Categoria'),
               React.createElement('div', { className: 'grid grid-cols-1 md:grid-cols-3 gap-4' },
                 ['preventiva', 'desgaste', 'corretiva'].map(cat => {
-                  const filtered = maintenanceHistory.filter(log => log.category === cat);
-                  const total = filtered.reduce((sum, log) => sum + (log.service_cost || 0) + (log.product_cost || 0), 0);
-                  const count = filtered.length;
+                  const totals = (analysis.categoryTotals || {})[cat] || {};
+                  const total = totals.total || 0;
+                  const count = totals.count || 0;
                   const names = { preventiva: 'Preventiva', desgaste: 'Desgaste', corretiva: 'Corretiva' };
                   const colors = { preventiva: 'text-green-600', desgaste: 'text-yellow-600', corretiva: 'text-red-600' };
 
@@ -510,7 +593,7 @@
                       try {
                         await axios.put(`maintenance-logs/${editingLogId}`, editingLogForm, { headers: { Authorization: `Bearer ${token}` } });
                         setEditingLogId(null);
-                        fetchData();
+                        reloadAll();
                       } catch (err) {
                         alert(err?.response?.data?.detail || 'Erro ao atualizar registro');
                       }
@@ -38,7 +38,7 @@
         const [vehiclesRes, typesRes, historyRes] = await Promise.all([
           axios.get('vehicles', { headers: { Authorization: `Bearer ${token}` } }),
           axios.get('maintenance-types', { headers: { Authorization: `Bearer ${token}` } }),
-          axios.get(`vehicles/${id}/history`, { headers: { Authorization: `Bearer ${token}` } })
+          axios.get(`vehicles/${id}/history`, { headers: { Authorization: `Bearer ${token}` }, params: { limit: 10 } })
         ]);
 
         const vid = parseInt(id, 10);
@@ -46,9 +46,8 @@
         setVehicle(found || null);
         setMaintenanceTypes(typesRes.data || []);
 
-        // Pega apenas as últimas 10
-        const history = historyRes.data || [];
-        setLastLogs(history.slice(0, 10));
+        // Pega apenas as últimas 10 (primeira página do histórico)
+        setLastLogs(historyRes.data.items || []);
 
         // Define KM default se o veículo foi encontrado
         if (found) {
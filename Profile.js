@@ -86,14 +86,9 @@
 
         setMessage('Perfil atualizado com sucesso!');
 
-        // Se email mudou, pode precisar relogar, mas por enquanto assumimos que não
-        // Atualizar user no contexto
-        if (updateData.name !== null || updateData.email !== null) {
-          // Buscar user atualizado
-          const userRes = await axios.get('me', { headers: { Authorization: `Bearer ${token}` } });
-          // Como login atualiza user, podemos chamar login com mesmo token
-          login(token);
-        }
+        // Troca de e-mail/senha invalida o token anterior: o backend devolve um novo
+        // Como login atualiza user, usamos o novo token (ou o mesmo, se não mudou)
+        login(res.data.access_token || token);
 
         // Limpar senha
         setFormData(prev => ({ ...prev, password: '', confirmPassword: '' }));
@@ -1,11 +1,20 @@
 import os
 import json
+import asyncio
+import contextlib
+import hashlib
+import random
+import weakref
 from cryptography.fernet import Fernet
 from fastapi import HTTPException
 import openai
-import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
 import anthropic
 
+import metrics
+from cache import TTLCache
+
 # Configuration for Encryption
 # In production, ensure ENCRYPTION_KEY is set in the .env file
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
@@ -30,11 +39,32 @@ def encrypt_token(token: str) -> str:
     f = get_fernet()
     return f.encrypt(token.encode()).decode()
 
+# Decrypted keys are cached (keyed by a hash of the ciphertext) so Fernet isn't paid on every request
+_decrypted_keys = TTLCache(
+    maxsize=int(os.getenv("LLM_KEY_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("LLM_KEY_CACHE_TTL", "900"))
+)
+
+def _fingerprint(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
 def decrypt_token(encrypted_token: str) -> str:
     if not encrypted_token:
         return None
-    f = get_fernet()
-    return f.decrypt(encrypted_token.encode()).decode()
+    cache_key = _fingerprint(encrypted_token)
+    decrypted = _decrypted_keys.get(cache_key)
+    if decrypted is None:
+        f = get_fernet()
+        decrypted = f.decrypt(encrypted_token.encode()).decode()
+        _decrypted_keys.set(cache_key, decrypted)
+    return decrypted
+
+def _format_date(dp) -> str:
+    if isinstance(dp, str):
+        return dp.split('T')[0]
+    elif hasattr(dp, 'strftime'):
+        return dp.strftime('%Y-%m-%d')
+    return str(dp) or "Data desconhecida"
 
 def get_insights_prompt(make: str, model: str, year: int, current_km: int, history: list) -> str:
     if not history:
@@ -42,13 +72,7 @@ def get_insights_prompt(make: str, model: str, year: int, current_km: int, histo
     else:
         history_text_lines = []
         for h in history:
-            dp = h['date_performed']
-            if isinstance(dp, str):
-                dp_str = dp.split('T')[0]
-            elif hasattr(dp, 'strftime'):
-                dp_str = dp.strftime('%Y-%m-%d')
-            else:
-                dp_str = str(dp) or "Data desconhecida"
+            dp_str = _format_date(h['date_performed'])
             km = h.get('km_performed', 0)
             m_type = h.get('maintenance_type', 'Desconhecido')
             history_text_lines.append(f"- {dp_str} ({km}km): {m_type}")
@@ -80,6 +104,21 @@ Você DEVE retornar APENAS um objeto JSON válido, sem nenhum texto adicional fo
   "normalized_name": "Nome Padronizado Único"
 }}"""
 
+def get_cluster_review_prompt(clusters: list) -> str:
+    groups = "\n".join(f"{i}: " + " | ".join(f"'{name}'" for name in cluster["names"]) for i, cluster in enumerate(clusters))
+    return f"""Você é um sistema de normalização de dados automotivos.
+Cada grupo abaixo reúne nomes de serviços de manutenção que parecem ser o mesmo serviço digitado de formas diferentes:
+{groups}
+
+Para cada grupo, diga se TODOS os nomes representam o mesmo serviço e, se sim, um único nome padronizado ideal, claro e conciso (ex: "Troca do Óleo do Motor" ao invés de "trocar oleo").
+
+Você DEVE retornar APENAS um objeto JSON válido, sem nenhum texto adicional fora do JSON, no formato:
+{{
+  "groups": [
+    {{"index": 0, "same_service": true, "normalized_name": "Nome Padronizado Único"}}
+  ]
+}}"""
+
 import re
 
 def clean_json_response(content: str) -> dict:
@@ -92,58 +131,405 @@ def clean_json_response(content: str) -> dict:
     except Exception:
         raise ValueError("Resposta não é um JSON válido.")
 
-def call_llm(prompt: str, provider: str, api_key: str) -> dict:
-    if provider == "openai":
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
+# Limits for remote model calls. A slow provider must not pin the server: every attempt has a timeout,
+# the number of in-flight calls is bounded globally and per user, and transient failures are retried.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONCURRENCY_PER_USER = int(os.getenv("LLM_MAX_CONCURRENCY_PER_USER", "2"))
+
+class TransientLLMError(Exception):
+    # Raised by adapters for failures worth retrying (rate limits, overload, dropped connections)
+    pass
+
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    TransientLLMError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    anthropic.APIConnectionError,
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+# --- Provider adapters ---
+# Each adapter wraps one async client and exposes `async complete(prompt) -> str`.
+# SDK-level retries are disabled so retry/timeout policy lives in one place (call_llm).
+
+class OpenAIProvider:
+    def __init__(self, api_key: str):
+        self.client = openai.AsyncOpenAI(api_key=api_key, max_retries=0)
+
+    async def complete(self, prompt: str) -> str:
+        response = await self.client.chat.completions.create(
             model="gpt-4o-mini", # using a fast model
             messages=[{"role": "user", "content": prompt}],
             response_format={ "type": "json_object" }
         )
-        return clean_json_response(response.choices[0].message.content)
-        
-    elif provider == "gemini":
-        genai.configure(api_key=api_key)
+        return response.choices[0].message.content
+
+    async def stream(self, prompt: str):
+        response = await self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            response_format={ "type": "json_object" },
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+class GeminiProvider:
+    def __init__(self, api_key: str):
+        self.client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+
+    @staticmethod
+    def _request(prompt: str):
         # using the latest solid model
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-            )
+        return glm.GenerateContentRequest(
+            model="models/gemini-2.5-flash",
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            generation_config=glm.GenerationConfig(response_mime_type="application/json")
         )
-        return clean_json_response(response.text)
-        
-    elif provider == "claude":
-        client = anthropic.Anthropic(api_key=api_key)
-        response = client.messages.create(
+
+    @staticmethod
+    def _text(response) -> str:
+        return "".join(part.text for candidate in response.candidates[:1] for part in candidate.content.parts)
+
+    async def complete(self, prompt: str) -> str:
+        response = await self.client.generate_content(request=self._request(prompt))
+        return self._text(response)
+
+    async def stream(self, prompt: str):
+        responses = await self.client.stream_generate_content(request=self._request(prompt))
+        async for response in responses:
+            yield self._text(response)
+
+class ClaudeProvider:
+    def __init__(self, api_key: str):
+        self.client = anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
+
+    async def complete(self, prompt: str) -> str:
+        response = await self.client.messages.create(
             model="claude-3-haiku-20240307",
             max_tokens=1000,
             messages=[
                 {"role": "user", "content": prompt}
             ]
         )
-        return clean_json_response(response.content[0].text)
-        
-    else:
+        return response.content[0].text
+
+    async def stream(self, prompt: str):
+        async with self.client.messages.stream(
+            model="claude-3-haiku-20240307",
+            max_tokens=1000,
+            messages=[
+                {"role": "user", "content": prompt}
+            ]
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+class FakeProvider:
+    # Local provider for load/latency tests: sleeps LLM_FAKE_LATENCY seconds and answers with valid JSON.
+    # Only registered when LLM_FAKE_PROVIDER=1.
+    def __init__(self, api_key: str):
+        self.latency = float(os.getenv("LLM_FAKE_LATENCY", "1"))
+        self.failure_rate = float(os.getenv("LLM_FAKE_FAILURE_RATE", "0"))
+
+    def _answer(self, prompt: str) -> str:
+        if random.random() < self.failure_rate:
+            raise TransientLLMError("fake provider overloaded")
+        if '"groups"' in prompt:
+            groups = re.findall(r"^(\d+): '([^']*)'", prompt, re.M)
+            return json.dumps({"groups": [
+                {"index": int(index), "same_service": True, "normalized_name": name} for index, name in groups
+            ]}, ensure_ascii=False)
+        if '"normalized_name"' in prompt:
+            return json.dumps({"normalized_name": "Serviço Normalizado"}, ensure_ascii=False)
+        return json.dumps({
+            "chronic_issues": ["Problema crônico simulado", "Outro problema crônico simulado"],
+            "suggested_maintenance": ["Manutenção simulada", "Outra manutenção simulada"]
+        }, ensure_ascii=False)
+
+    async def complete(self, prompt: str) -> str:
+        await asyncio.sleep(self.latency)
+        return self._answer(prompt)
+
+    async def stream(self, prompt: str):
+        # Same answer split in chunks, spreading the latency between them
+        content = self._answer(prompt)
+        size = max(len(content) // 8, 1)
+        for start in range(0, len(content), size):
+            await asyncio.sleep(self.latency / 8)
+            yield content[start:start + size]
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "gemini": GeminiProvider,
+    "claude": ClaudeProvider,
+}
+
+def register_provider(name: str, factory):
+    # factory(api_key) -> object with `async complete(prompt) -> str` and `stream(prompt)` (async iterator of text)
+    PROVIDERS[name] = factory
+    _clients.clear()
+
+if os.getenv("LLM_FAKE_PROVIDER") == "1":
+    PROVIDERS["fake"] = FakeProvider
+
+# Provider clients are reused per (provider, key hash): keep-alive connections and TLS sessions
+# survive between calls, and each user's key gets its own client (no process-global configure).
+# Entries idle for longer than LLM_CLIENT_IDLE_TTL seconds are dropped, as are the least recently used.
+_clients = TTLCache(
+    maxsize=int(os.getenv("LLM_CLIENT_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("LLM_CLIENT_IDLE_TTL", "600"))
+)
+
+def get_client(provider: str, api_key: str):
+    factory = PROVIDERS.get(provider)
+    if factory is None:
         raise HTTPException(status_code=400, detail="Provedor de IA inválido ou não suportado.")
+    key = (provider, _fingerprint(api_key))
+    client = _clients.get(key)
+    if client is None:
+        client = factory(api_key)
+    # Re-inserting refreshes the idle timer and the LRU position
+    _clients.set(key, client)
+    return client
+
+# --- Concurrency limits ---
+_global_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+# Weak values: a user's semaphore lives exactly as long as some call holds or waits on it, so it is
+# never evicted while in use (which would let that user exceed the limit) and idle users cost nothing
+_user_slots = weakref.WeakValueDictionary()
+
+def _user_semaphore(user_id) -> asyncio.Semaphore:
+    slots = _user_slots.get(user_id)
+    if slots is None:
+        slots = _user_slots[user_id] = asyncio.Semaphore(LLM_MAX_CONCURRENCY_PER_USER)
+    return slots
+
+@contextlib.asynccontextmanager
+async def _call_slots(user_id=None):
+    if user_id is None:
+        async with _global_slots:
+            yield
+    else:
+        async with _user_semaphore(user_id), _global_slots:
+            yield
+
+async def _backoff(attempt: int):
+    # Exponential backoff with jitter, outside the concurrency slots
+    await asyncio.sleep(LLM_BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random()))
+
+async def call_llm(prompt: str, provider: str, api_key: str, user_id=None) -> dict:
+    client = get_client(provider, api_key)
+    attempt = 0
+    # Latency and outcome per provider (GET /metrics), retries included
+    with metrics.llm_timer(provider, "call"):
+        while True:
+            try:
+                async with _call_slots(user_id):
+                    content = await asyncio.wait_for(client.complete(prompt), LLM_TIMEOUT)
+                return clean_json_response(content)
+            except TRANSIENT_ERRORS:
+                if attempt >= LLM_MAX_RETRIES:
+                    raise
+                await _backoff(attempt)
+                attempt += 1
 
-def generate_vehicle_insights(make: str, model: str, year: int, current_km: int, history: list, provider: str, encrypted_key: str):
+async def stream_llm(prompt: str, provider: str, api_key: str, user_id=None):
+    # Yields text chunks as the provider produces them. Each chunk must arrive within LLM_TIMEOUT;
+    # transient failures are retried only while nothing has been yielded yet.
+    client = get_client(provider, api_key)
+    attempt = 0
+    with metrics.llm_timer(provider, "stream"):
+        while True:
+            started = False
+            try:
+                async with _call_slots(user_id):
+                    chunks = client.stream(prompt).__aiter__()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), LLM_TIMEOUT)
+                            except StopAsyncIteration:
+                                return
+                            if chunk:
+                                started = True
+                                yield chunk
+                    finally:
+                        if hasattr(chunks, "aclose"):
+                            await chunks.aclose()
+            except TRANSIENT_ERRORS:
+                if started or attempt >= LLM_MAX_RETRIES:
+                    raise
+                await _backoff(attempt)
+                attempt += 1
+
+def _provider_error(e: Exception, provider: str) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, asyncio.TimeoutError):
+        return HTTPException(status_code=504, detail=f"A IA ({provider}) demorou demais para responder. Tente novamente.")
+    if isinstance(e, TRANSIENT_ERRORS):
+        return HTTPException(status_code=503, detail=f"IA ({provider}) indisponível no momento: {str(e)}")
+    return HTTPException(status_code=400, detail=f"Erro ao se comunicar com a IA ({provider}): {str(e)}")
+
+def _api_key(encrypted_key: str) -> str:
     decrypted_key = decrypt_token(encrypted_key)
     if not decrypted_key:
         raise HTTPException(status_code=400, detail="Chave de API não configurada.")
-    prompt = get_insights_prompt(make, model, year, current_km, history)
+    return decrypted_key
+
+async def _run_llm(prompt: str, provider: str, encrypted_key: str, user_id=None) -> dict:
+    decrypted_key = _api_key(encrypted_key)
     try:
-        return call_llm(prompt, provider, decrypted_key)
+        return await call_llm(prompt, provider, decrypted_key, user_id=user_id)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao se comunicar com a IA ({provider}): {str(e)}")
+        raise _provider_error(e, provider)
 
-def normalize_maintenance_name(input_names: list, provider: str, encrypted_key: str):
-    decrypted_key = decrypt_token(encrypted_key)
-    if not decrypted_key:
-        raise HTTPException(status_code=400, detail="Chave de API não configurada.")
-    prompt = get_normalization_prompt(input_names)
+# Insights depend only on the prompt inputs, so a user's identical vehicles (same make/model/year,
+# mileage in the same bucket and equivalent history) share one answer instead of paying one call each.
+# Entries are keyed by (user_id, fingerprint): one user's answer is never served to another.
+INSIGHTS_KM_BUCKET = int(os.getenv("INSIGHTS_KM_BUCKET", "5000"))
+_insights_cache = TTLCache(
+    maxsize=int(os.getenv("INSIGHTS_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("INSIGHTS_CACHE_TTL", str(7 * 24 * 3600)))
+)
+_insights_cache_counters = {"hits": 0, "misses": 0}
+
+def _normalize_text(value) -> str:
+    return " ".join(str(value or "").casefold().split())
+
+def insights_fingerprint(make: str, model: str, year: int, current_km: int, history: list, provider: str) -> str:
+    bucket = max(INSIGHTS_KM_BUCKET, 1)
+    canonical_history = sorted(
+        [_normalize_text(h.get('maintenance_type')), _format_date(h['date_performed']), (h.get('km_performed') or 0) // bucket]
+        for h in history
+    )
+    canonical = {
+        "provider": provider,
+        "make": _normalize_text(make),
+        "model": _normalize_text(model),
+        "year": year,
+        "km_bucket": (current_km or 0) // bucket,
+        "history": canonical_history
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+def insights_cache_stats() -> dict:
+    return {**_insights_cache_counters, "size": len(_insights_cache)}
+
+# Single-flight: identical requests (same user, operation and input fingerprint) that arrive while a
+# call is in flight await that call instead of starting another one.
+_inflight = {}
+
+async def _single_flight(key, factory):
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _inflight.pop(key, None) if _inflight.get(key) is done else None)
+    # shield: a waiter that disconnects must not cancel the call the others are sharing
+    return await asyncio.shield(task)
+
+async def generate_vehicle_insights(make: str, model: str, year: int, current_km: int, history: list, provider: str, encrypted_key: str, user_id=None):
+    cache_key = (user_id, insights_fingerprint(make, model, year, current_km, history, provider))
+    cached = _insights_cache.get(cache_key)
+    if cached is not None:
+        _insights_cache_counters["hits"] += 1
+        return cached
+    _insights_cache_counters["misses"] += 1
+
+    async def generate():
+        prompt = get_insights_prompt(make, model, year, current_km, history)
+        result = await _run_llm(prompt, provider, encrypted_key, user_id=user_id)
+        if isinstance(result, dict):
+            _insights_cache.set(cache_key, result)
+        return result
+
+    return await _single_flight(("insights",) + cache_key, generate)
+
+INSIGHT_FIELDS = ("chronic_issues", "suggested_maintenance")
+_string_separator = re.compile(r"\s*,?\s*")
+
+def partial_list_items(buffer: str, key: str) -> list:
+    # Complete string items already received for `"key": [...]` in a JSON document still being streamed
+    match = re.search(r'"%s"\s*:\s*\[' % re.escape(key), buffer)
+    if not match:
+        return []
+    decoder = json.JSONDecoder()
+    items, pos = [], match.end()
+    while True:
+        pos = _string_separator.match(buffer, pos).end()
+        if pos >= len(buffer) or buffer[pos] != '"':
+            return items
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            return items
+        items.append(item)
+
+def validate_insights(result) -> dict:
+    if not isinstance(result, dict):
+        raise ValueError("Resposta da IA fora do formato esperado.")
+    return {field: [str(item) for item in (result.get(field) or [])] for field in INSIGHT_FIELDS}
+
+async def stream_vehicle_insights(make: str, model: str, year: int, current_km: int, history: list, provider: str, encrypted_key: str, user_id=None):
+    # Yields ("partial", {"field", "item"}) as each list item completes, then ("final", validated result).
+    # Errors are raised as HTTPException, like the non-streaming path.
+    cache_key = (user_id, insights_fingerprint(make, model, year, current_km, history, provider))
+    cached = _insights_cache.get(cache_key)
+    if cached is not None:
+        _insights_cache_counters["hits"] += 1
+        yield ("final", cached)
+        return
+    _insights_cache_counters["misses"] += 1
+
+    decrypted_key = _api_key(encrypted_key)
+    prompt = get_insights_prompt(make, model, year, current_km, history)
+    buffer = ""
+    sent = {field: 0 for field in INSIGHT_FIELDS}
     try:
-        return call_llm(prompt, provider, decrypted_key)
+        async for chunk in stream_llm(prompt, provider, decrypted_key, user_id=user_id):
+            buffer += chunk
+            for field in INSIGHT_FIELDS:
+                items = partial_list_items(buffer, field)
+                for item in items[sent[field]:]:
+                    yield ("partial", {"field": field, "item": item})
+                sent[field] = len(items)
+        result = validate_insights(clean_json_response(buffer))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao se comunicar com a IA ({provider}): {str(e)}")
+        raise _provider_error(e, provider)
+
+    _insights_cache.set(cache_key, result)
+    yield ("final", result)
+
+def normalization_fingerprint(input_names: list, provider: str) -> str:
+    canonical = {"provider": provider, "names": sorted(_normalize_text(name) for name in input_names)}
+    return hashlib.sha256(json.dumps(canonical, ensure_ascii=False).encode()).hexdigest()
+
+async def normalize_maintenance_name(input_names: list, provider: str, encrypted_key: str, user_id=None):
+    prompt = get_normalization_prompt(input_names)
+    return await _single_flight(
+        ("normalize", user_id, normalization_fingerprint(input_names, provider)),
+        lambda: _run_llm(prompt, provider, encrypted_key, user_id=user_id)
+    )
+
+async def review_name_clusters(clusters: list, provider: str, encrypted_key: str, user_id=None) -> list:
+    # One batched call for every ambiguous cluster; returns [{"index", "same_service", "normalized_name"}]
+    if not clusters:
+        return []
+    result = await _run_llm(get_cluster_review_prompt(clusters), provider, encrypted_key, user_id=user_id)
+    groups = result.get("groups") if isinstance(result, dict) else None
+    if not isinstance(groups, list):
+        raise HTTPException(status_code=400, detail=f"Resposta inesperada da IA ({provider}).")
+    return [g for g in groups if isinstance(g, dict) and isinstance(g.get("index"), int) and 0 <= g["index"] < len(clusters)]
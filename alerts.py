@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import catalog
+import models
+
+
+def next_due(last_date: datetime, last_km: int, mt) -> tuple:
+    # Próximo vencimento (KM e data) a partir da última manutenção e dos intervalos do tipo
+    next_km = (last_km or 0) + (mt.default_interval_km or 0)
+    # Garantir que temos um intervalo de meses válido
+    interval_months = mt.default_interval_months if mt.default_interval_months is not None else 12
+    next_date = last_date + timedelta(days=interval_months * 30) if last_date else None
+    return next_km, next_date
+
+
+def latest_logs_query(owner_id: int = None, vehicle_ids=None):
+    # SELECT da última manutenção de cada (veículo, tipo) (todos os usuários se owner_id for None)
+    log = models.MaintenanceLog
+    rank = func.row_number().over(
+        partition_by=(log.vehicle_id, log.maintenance_type_id),
+        order_by=(log.date_performed.desc(), log.id.desc())
+    ).label("rn")
+    query = select(
+        log.id,
+        log.vehicle_id,
+        log.maintenance_type_id,
+        log.date_performed,
+        log.km_performed,
+        rank
+    )
+    if owner_id is not None:
+        query = query.join(models.Vehicle, models.Vehicle.id == log.vehicle_id)\
+            .where(models.Vehicle.owner_id == owner_id)
+    if vehicle_ids is not None:
+        query = query.where(log.vehicle_id.in_(vehicle_ids))
+    ranked = query.subquery()
+    return select(ranked).where(ranked.c.rn == 1)
+
+
+def latest_logs_by_vehicle_and_type(db: Session, owner_id: int = None, vehicle_ids=None) -> dict:
+    # Última manutenção de cada (veículo, tipo) em UMA consulta
+    rows = db.execute(latest_logs_query(owner_id, vehicle_ids)).all()
+    return {(r.vehicle_id, r.maintenance_type_id): r for r in rows}
+
+
+def last_services_query(owner_id: int, vehicle_id: int = None):
+    # Projeção last_service de toda a frota do usuário (consulta indexada, sem varrer o histórico)
+    query = select(models.LastService)\
+        .join(models.Vehicle, models.Vehicle.id == models.LastService.vehicle_id)\
+        .where(models.Vehicle.owner_id == owner_id)
+    if vehicle_id is not None:
+        query = query.where(models.LastService.vehicle_id == vehicle_id)
+    return query
+
+
+def last_services_by_vehicle(db: Session, owner_id: int, vehicle_id: int = None) -> dict:
+    by_vehicle = {}
+    for row in db.scalars(last_services_query(owner_id, vehicle_id)):
+        by_vehicle.setdefault(row.vehicle_id, {})[row.maintenance_type_id] = row
+    return by_vehicle
+
+
+def summaries_query(owner_id: int, vehicle_id: int = None):
+    # Consolidados de custo da frota do usuário (sem carregar os logs)
+    query = select(models.VehicleSummary)\
+        .join(models.Vehicle, models.Vehicle.id == models.VehicleSummary.vehicle_id)\
+        .where(models.Vehicle.owner_id == owner_id)
+    if vehicle_id is not None:
+        query = query.where(models.VehicleSummary.vehicle_id == vehicle_id)
+    return query
+
+
+def summaries_by_vehicle(db: Session, owner_id: int, vehicle_id: int = None) -> dict:
+    return {row.vehicle_id: row for row in db.scalars(summaries_query(owner_id, vehicle_id))}
+
+
+def vehicles_query(owner_id: int, vehicle_id: int = None):
+    query = select(models.Vehicle).where(models.Vehicle.owner_id == owner_id)
+    if vehicle_id is not None:
+        query = query.where(models.Vehicle.id == vehicle_id)
+    return query
+
+
+def evaluate_alerts(current_km: int, m_types: list, last_by_type: dict, now: datetime) -> list:
+    # Aplica as regras de vencimento por KM/tempo usando os vencimentos da projeção
+    alerts = []
+    for mt in m_types:
+        last = last_by_type.get(mt.id)
+        if not last:
+            # Nunca registrado: não gera alerta
+            continue
+
+        if (current_km or 0) >= (last.next_due_km or 0):
+            alerts.append({"type": mt.name, "msg": f"Vencido por KM (Próx: {last.next_due_km}km)"})
+        elif last.next_due_date and now >= last.next_due_date:
+            alerts.append({"type": mt.name, "msg": f"Vencido por Tempo (Próx: {last.next_due_date.date()})"})
+    return alerts
+
+
+def vehicles_with_alerts(db: Session, owner_id: int, vehicle_id: int = None) -> list:
+    # Número fixo de consultas, independente da quantidade de veículos e tipos
+    vehicles = db.scalars(vehicles_query(owner_id, vehicle_id)).all()
+    if not vehicles:
+        return []
+
+    m_types = db.scalars(catalog.visible_types(owner_id).order_by(models.MaintenanceType.id)).all()
+    last_services = last_services_by_vehicle(db, owner_id, vehicle_id)
+    summaries = summaries_by_vehicle(db, owner_id, vehicle_id)
+
+    # Forçar comparação com datetime naive (SQLite armazena sem fuso)
+    now = datetime.utcnow()
+    results = []
+    for v in vehicles:
+        summary = summaries.get(v.id)
+        total_cost = (summary.total_service_cost or 0.0) + (summary.total_product_cost or 0.0) if summary else 0.0
+        results.append({
+            "id": v.id,
+            "make": v.make,
+            "model": v.model,
+            "year": v.year,
+            "current_km": v.current_km,
+            "license_plate": v.license_plate,
+            "total_maintenance_cost": total_cost,
+            "alerts": evaluate_alerts(v.current_km, m_types, last_services.get(v.id, {}), now)
+        })
+    return results
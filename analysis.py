@@ -0,0 +1,111 @@
+from datetime import datetime
+from sqlalchemy import func, case
+from sqlalchemy.orm import Session
+
+import models
+import rollups
+
+CATEGORIES = ["preventiva", "desgaste", "corretiva"]
+
+
+def _months_ago(now: datetime, months: int) -> datetime:
+    # Mesmo dia N meses atrás (limitado ao último dia do mês de destino)
+    start = rollups.add_months(now, -months)
+    next_start = rollups.add_months(start, 1)
+    last_day = (next_start - start).days
+    return now.replace(year=start.year, month=start.month, day=min(now.day, last_day), hour=0, minute=0, second=0, microsecond=0)
+
+
+def vehicle_analysis(db: Session, vehicle_id: int, now: datetime = None) -> dict:
+    # Gastos, médias, última manutenção por tipo e projeção de 12 meses de um veículo (duas consultas)
+    now = now or datetime.utcnow()
+    one_year_ago = _months_ago(now, 12)
+    six_months_ago = _months_ago(now, 6)
+    three_months_ago = _months_ago(now, 3)
+
+    log = models.MaintenanceLog
+    total = func.coalesce(log.service_cost, 0.0) + func.coalesce(log.product_cost, 0.0)
+    in_12 = log.date_performed >= one_year_ago
+
+    # 1. Agregados por categoria (todo o histórico e janelas de 12/6/3 meses) em um único GROUP BY
+    rows = db.query(
+        log.category,
+        func.count(log.id),
+        func.sum(total),
+        func.sum(case((in_12, 1), else_=0)),
+        func.sum(case((in_12, total), else_=0.0)),
+        func.sum(case((log.date_performed >= six_months_ago, total), else_=0.0)),
+        func.sum(case((log.date_performed >= three_months_ago, total), else_=0.0)),
+        func.min(case((in_12, log.km_performed), else_=None)),
+        func.max(case((in_12, log.km_performed), else_=None))
+    ).filter(log.vehicle_id == vehicle_id).group_by(log.category).all()
+
+    category_totals = {cat: {"total": 0.0, "count": 0} for cat in CATEGORIES}
+    costs_by_category = {cat: 0.0 for cat in CATEGORIES}
+    avg_costs = {cat: 0.0 for cat in CATEGORIES}
+    total_6, total_3, log_count = 0.0, 0.0, 0
+    km_min, km_max = None, None
+    for category, count, all_total, count_12, total_12, total_6m, total_3m, min_km, max_km in rows:
+        category = category or "preventiva"
+        category_totals[category] = {"total": float(all_total or 0.0), "count": count}
+        costs_by_category[category] = float(total_12 or 0.0)
+        avg_costs[category] = float(total_12 or 0.0) / count_12 if count_12 else 0.0
+        total_6 += float(total_6m or 0.0)
+        total_3 += float(total_3m or 0.0)
+        log_count += count
+        if min_km is not None:
+            km_min = min_km if km_min is None else min(km_min, min_km)
+        if max_km is not None:
+            km_max = max_km if km_max is None else max(km_max, max_km)
+    km_driven = (km_max - km_min) if km_min is not None else 0
+
+    # 2. Última manutenção por tipo direto da projeção last_service
+    last_rows = db.query(models.LastService, models.MaintenanceType.name, log.category)\
+        .join(models.MaintenanceType, models.MaintenanceType.id == models.LastService.maintenance_type_id)\
+        .outerjoin(log, log.id == models.LastService.last_log_id)\
+        .filter(models.LastService.vehicle_id == vehicle_id)\
+        .order_by(models.MaintenanceType.name)\
+        .all()
+
+    last_services, projections = [], []
+    for row, type_name, last_category in last_rows:
+        last_services.append({
+            "maintenance_type_id": row.maintenance_type_id,
+            "maintenance_type": type_name,
+            "last_date": row.last_date,
+            "last_km": row.last_km,
+            "next_due_km": row.next_due_km,
+            "next_due_date": row.next_due_date
+        })
+        projections.append({
+            "type": type_name,
+            "next_km": row.next_due_km,
+            "next_date": row.next_due_date,
+            "estimated_cost": avg_costs.get(last_category or "preventiva", 0.0)
+        })
+
+    # Projeção mensal dos próximos 12 meses
+    monthly_projection = []
+    for i in range(12):
+        key = rollups.month_key(rollups.add_months(now, i))
+        due = [p for p in projections if p["next_date"] and rollups.month_key(p["next_date"]) == key]
+        monthly_projection.append({
+            "month": key,
+            "maintenances": [p["type"] for p in due],
+            "total_cost": sum(p["estimated_cost"] for p in due)
+        })
+
+    return {
+        "log_count": log_count,
+        "km_driven": km_driven,
+        "monthly_km": km_driven / 12,
+        "costs_by_category": costs_by_category,
+        "avg_costs": avg_costs,
+        "category_totals": category_totals,
+        "total_spent": sum(costs_by_category.values()),
+        "total_spent_6_months": total_6,
+        "total_spent_3_months": total_3,
+        "last_services": last_services,
+        "future_projections": projections,
+        "monthly_projection": monthly_projection
+    }
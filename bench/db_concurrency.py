@@ -0,0 +1,183 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Leitores e escritores simultâneos no SQLite: modo rollback journal (padrão do SQLite) x pragmas do database.py (WAL).
+#   python bench/db_concurrency.py --readers 8 --writers 2 --seconds 10
+# Cada modo roda num banco temporário próprio, com a mesma carga: leitores fazendo a consulta de GET /vehicles
+# (alerts.vehicles_with_alerts) e de uma página do histórico; escritores gravando um registro de manutenção com as
+# projeções atualizadas na mesma transação, como em POST /vehicles/{id}/maintenance.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import alerts
+import catalog
+import database
+import history
+import migrations
+import models
+import rollups
+
+MODES = {
+    # Padrão do SQLite: escritor bloqueia leitores durante o commit; só busy_timeout em comum com o WAL
+    "rollback": {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": database.SQLITE_PRAGMAS["busy_timeout"],
+                 "foreign_keys": "ON"},
+    "wal": database.SQLITE_PRAGMAS,
+}
+
+
+def build_engine(path: str, pragmas: dict):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+    event.listen(engine, "connect", set_pragmas)
+    return engine
+
+
+def seed(Session, vehicles: int, logs_per_vehicle: int) -> tuple:
+    db = Session()
+    user = models.User(email="bench@teste.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    fleet = [
+        models.Vehicle(owner_id=user.id, make="VW", model="Gol", year=2015, current_km=0, license_plate=f"BEN{i:04d}")
+        for i in range(vehicles)
+    ]
+    db.add_all(fleet)
+    db.flush()
+    type_ids = [mt.id for mt in db.scalars(catalog.visible_types(user.id))]
+    rnd = random.Random(1)
+    start = datetime(2015, 1, 1)
+    db.add_all(
+        models.MaintenanceLog(
+            vehicle_id=v.id, maintenance_type_id=rnd.choice(type_ids), km_performed=i * 500,
+            date_performed=start + timedelta(days=i * 3), service_cost=rnd.random() * 300, category="preventiva"
+        )
+        for v in fleet for i in range(logs_per_vehicle)
+    )
+    db.flush()
+    rollups.rebuild_all(db, [v.id for v in fleet])
+    user_id, vehicle_ids = user.id, [v.id for v in fleet]
+    db.commit()
+    db.close()
+    return user_id, vehicle_ids, type_ids
+
+
+def percentile(samples: list, p: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run_mode(mode: str, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix=f"bench-{mode}-"), "bench.db")
+    engine = build_engine(path, MODES[mode])
+    Session = sessionmaker(bind=engine, autoflush=False)
+    migrations.upgrade(engine)
+    user_id, vehicle_ids, type_ids = seed(Session, args.vehicles, args.logs)
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = {"read": [], "write": [], "errors": 0}
+
+    def reader(seed_value: int):
+        rnd = random.Random(seed_value)
+        db = Session()
+        latencies = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                alerts.vehicles_with_alerts(db, user_id)
+                db.execute(history.history_query(rnd.choice(vehicle_ids)).limit(50)).all()
+                db.rollback()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    results["errors"] += 1
+        db.close()
+        with lock:
+            results["read"].extend(latencies)
+
+    def writer(seed_value: int):
+        rnd = random.Random(seed_value)
+        db = Session()
+        latencies = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                log = models.MaintenanceLog(
+                    vehicle_id=rnd.choice(vehicle_ids), maintenance_type_id=rnd.choice(type_ids),
+                    km_performed=rnd.randint(0, 200000), date_performed=datetime(2024, 1, 1) + timedelta(minutes=rnd.randint(0, 500000)),
+                    service_cost=100.0, category="preventiva"
+                )
+                db.add(log)
+                rollups.refresh_for_logs(db, [rollups.log_key(log)])
+                db.commit()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    results["errors"] += 1
+        db.close()
+        with lock:
+            results["write"].extend(latencies)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(1000 + i,)) for i in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    return {
+        "mode": mode,
+        "reads_per_s": len(results["read"]) / args.seconds,
+        "read_p50_ms": percentile(results["read"], 0.50) * 1000,
+        "read_p99_ms": percentile(results["read"], 0.99) * 1000,
+        "writes_per_s": len(results["write"]) / args.seconds,
+        "write_p50_ms": percentile(results["write"], 0.50) * 1000,
+        "write_p99_ms": percentile(results["write"], 0.99) * 1000,
+        "errors": results["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Leitores e escritores simultâneos: rollback journal x WAL")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--logs", type=int, default=500, help="registros por veículo")
+    args = parser.parse_args()
+
+    print(f"{args.readers} leitores, {args.writers} escritores, {args.seconds:g}s por modo, "
+          f"{args.vehicles} veículos x {args.logs} registros")
+    header = f"{'modo':<9} {'leituras/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'escritas/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'erros':>6}"
+    print(header)
+    for mode in MODES:
+        r = run_mode(mode, args)
+        print(f"{r['mode']:<9} {r['reads_per_s']:>10.1f} {r['read_p50_ms']:>8.1f} {r['read_p99_ms']:>8.1f} "
+              f"{r['writes_per_s']:>10.1f} {r['write_p50_ms']:>8.1f} {r['write_p99_ms']:>8.1f} {r['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Vazão e memória da exportação em streaming (exporter.stream_export) num banco SQLite temporário.
+#   python bench/export_bench.py --rows 1000000
+# O banco é populado uma vez; cada formato (csv, ndjson, csv+gzip) roda num processo próprio, para que o
+# pico de RSS de um não contamine o do outro. O gerador é consumido como pelo StreamingResponse,
+# sem guardar a saída. SQLITE_CACHE_SIZE_KB/SQLITE_MMAP_SIZE entram no RSS até os valores configurados.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FORMATS = {"csv": ("csv", False), "ndjson": ("ndjson", False), "csv+gzip": ("csv", True)}
+
+
+def peak_rss_mb() -> float:
+    # VmHWM (Linux) é do processo atual; ru_maxrss herdaria o pico do processo pai através do exec
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(rows: int, vehicles: int) -> int:
+    import catalog
+    import database
+    import migrations
+    import models
+    from sqlalchemy import insert
+
+    migrations.upgrade()
+    db = database.SessionLocal()
+    user = models.User(email="export@teste.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    fleet = [
+        models.Vehicle(owner_id=user.id, make="VW", model="Gol", year=2010, current_km=0, license_plate=f"EXP{i:04d}")
+        for i in range(vehicles)
+    ]
+    db.add_all(fleet)
+    db.flush()
+    type_ids = [mt.id for mt in db.scalars(catalog.visible_types(user.id))]
+    vehicle_ids = [v.id for v in fleet]
+    user_id = user.id
+    db.commit()
+
+    rnd = random.Random(1)
+    start = datetime(2000, 1, 1)
+    batch = []
+    for i in range(rows):
+        batch.append({
+            "vehicle_id": vehicle_ids[i % vehicles], "maintenance_type_id": type_ids[i % len(type_ids)],
+            "date_performed": start + timedelta(hours=i), "km_performed": i * 3,
+            "service_cost": round(rnd.random() * 100, 2), "product_cost": round(rnd.random() * 100, 2),
+            "category": "preventiva", "notes": f"linha {i}",
+        })
+        if len(batch) == 10000:
+            db.execute(insert(models.MaintenanceLog), batch)
+            batch = []
+    if batch:
+        db.execute(insert(models.MaintenanceLog), batch)
+    db.commit()
+    db.close()
+    return user_id
+
+
+def run_format(name: str, user_id: int, rows: int):
+    import exporter
+
+    fmt, gzip = FORMATS[name]
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    size = 0
+    for chunk in exporter.stream_export(user_id, fmt, gzip=gzip):
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<9} {elapsed:>7.2f}s {rows / elapsed:>10.0f} {size / 1e6:>9.1f} {rss_before:>10.0f} {peak_rss_mb():>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão e pico de memória da exportação em streaming")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--vehicles", type=int, default=5)
+    parser.add_argument("--run", choices=list(FORMATS), help=argparse.SUPPRESS)
+    parser.add_argument("--user-id", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_format(args.run, args.user_id, args.rows)
+        return
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='manutencar-export-'), 'export.db')}"
+    user_id = seed(args.rows, args.vehicles)
+    print(f"{args.rows} registros, {args.vehicles} veículos")
+    print(f"{'formato':<9} {'tempo':>8} {'linhas/s':>10} {'MB saída':>9} {'RSS antes':>10} {'RSS pico':>10}")
+    sys.stdout.flush()
+    for name in FORMATS:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", name, "--user-id", str(user_id), "--rows", str(args.rows)],
+            check=True
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Vazão da importação em lote (importer.import_logs) num banco SQLite temporário.
+#   python bench/import_bench.py --rows 100000
+# Mede o caminho inteiro: leitura do CSV, validação de cada linha, INSERT em lotes de IMPORT_BATCH_SIZE
+# e o recálculo final das projeções. Com --profile, imprime as funções mais caras (cProfile).
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def build_csv(plates: list, type_names: list, rows: int, months: int) -> io.StringIO:
+    rnd = random.Random(1)
+    buf = io.StringIO()
+    buf.write("license_plate,maintenance_type,date_performed,km_performed,service_cost,product_cost,category,notes\n")
+    for i in range(rows):
+        month = i * months // rows
+        buf.write(
+            f"{plates[i % len(plates)]},{type_names[i % len(type_names)]},"
+            f"{2000 + month // 12}-{1 + month % 12:02d}-{1 + i % 28:02d},{i * 3},"
+            f"{rnd.random() * 100:.2f},{rnd.random() * 100:.2f},preventiva,linha {i}\n"
+        )
+    buf.seek(0)
+    return buf
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão da importação em lote")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--vehicles", type=int, default=5)
+    parser.add_argument("--months", type=int, default=240, help="meses cobertos pelo histórico")
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='manutencar-import-'), 'import.db')}"
+    import catalog
+    import database
+    import importer
+    import main as api
+    import migrations
+    import models
+
+    migrations.upgrade()
+    db = database.SessionLocal()
+    user = models.User(email="import@teste.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    plates = [f"IMP{i:04d}" for i in range(args.vehicles)]
+    db.add_all(models.Vehicle(owner_id=user.id, make="VW", model="Gol", year=2010, current_km=0, license_plate=p) for p in plates)
+    db.commit()
+    type_names = [mt.name for mt in db.scalars(catalog.visible_types(user.id))]
+    text = build_csv(plates, type_names, args.rows, args.months)
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    started = time.perf_counter()
+    report = importer.import_logs(db, user.id, text, "csv", api.MaintenanceLogCreate)
+    elapsed = time.perf_counter() - started
+    if profiler is not None:
+        import pstats
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+    print(f"{report['imported']} linhas importadas, {report['failed']} com erro, lotes de {importer.IMPORT_BATCH_SIZE}: "
+          f"{elapsed:.2f}s, {args.rows / elapsed:.0f} linhas/s")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
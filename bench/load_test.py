@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+# Teste de carga das rotas de leitura: caminho assíncrono (AsyncSession, rotas async def de main.py) x caminho
+# síncrono (rotas def com SessionLocal no threadpool), com N clientes simultâneos (httpx.AsyncClient).
+#   python bench/load_test.py --clients 64 --seconds 10
+# Sobe o main.app num processo uvicorn separado (banco SQLite temporário com dados de exemplo). As variantes
+# síncronas ficam em /bench-sync/... e chamam as mesmas funções de carga que as rotas assíncronas.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROUTES = ("/vehicles", "/vehicles/{vehicle_id}/history", "/stats", "/maintenance-types")
+SYNC_PREFIX = "/bench-sync"
+
+
+def sync_router():
+    # Mesmo corpo das rotas async de main.py, mas em def + Session (cada requisição ocupa uma thread do pool)
+    from fastapi import APIRouter, Depends, Request, Response
+    from sqlalchemy.orm import Session
+
+    import alerts
+    import catalog
+    import main
+    import models
+    import rollups
+    import versions
+
+    router = APIRouter(prefix=SYNC_PREFIX)
+
+    @router.get("/vehicles", response_model=List[main.VehicleWithAlertsResponse])
+    def get_vehicles(request: Request, response: Response, user: main.Principal = Depends(main.get_current_user), db: Session = Depends(main.get_db)):
+        not_modified = versions.conditional(request, response, versions.user_etag(db, user.id, True))
+        if not_modified:
+            return not_modified
+        return alerts.vehicles_with_alerts(db, user.id)
+
+    @router.get("/vehicles/{vehicle_id}/history", response_model=main.HistoryPageResponse)
+    def get_vehicle_history(vehicle_id: int, request: Request, response: Response, limit: int = 50, cursor: Optional[str] = None,
+                            user: main.Principal = Depends(main.get_current_user), db: Session = Depends(main.get_db)):
+        not_modified = versions.conditional(request, response, versions.vehicle_etag(db, user.id, vehicle_id))
+        if not_modified:
+            return not_modified
+        return main.load_history_page(db, user.id, vehicle_id, limit, cursor, None, None, None, None, None, None)
+
+    @router.get("/stats", response_model=List[main.MonthlyStatsItem], response_model_exclude_unset=True)
+    def get_stats(request: Request, response: Response, months: int = 12,
+                  user: main.Principal = Depends(main.get_current_user), db: Session = Depends(main.get_db)):
+        not_modified = versions.conditional(request, response, versions.user_etag(db, user.id, True))
+        if not_modified:
+            return not_modified
+        return rollups.monthly_stats(db, user.id, months=months)
+
+    @router.get("/maintenance-types", response_model=List[main.MaintenanceTypeResponse])
+    def get_maintenance_types(request: Request, response: Response, user: main.Principal = Depends(main.get_current_user), db: Session = Depends(main.get_db)):
+        not_modified = versions.conditional(request, response, versions.user_etag(db, user.id))
+        if not_modified:
+            return not_modified
+        return db.scalars(catalog.visible_types(user.id).order_by(models.MaintenanceType.name)).all()
+
+    return router
+
+
+def serve(port: int):
+    import uvicorn
+
+    import main
+
+    main.app.include_router(sync_router())
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def seed(vehicles: int, logs_per_vehicle: int) -> tuple:
+    # (token, ids dos veículos) de um usuário com frota e histórico
+    import catalog
+    import database
+    import main
+    import migrations
+    import models
+    import rollups
+
+    migrations.upgrade()
+    db = database.SessionLocal()
+    user = models.User(email="carga@teste.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    fleet = [
+        models.Vehicle(owner_id=user.id, make="VW", model="Gol", year=2015, current_km=150000, license_plate=f"CAR{i:04d}")
+        for i in range(vehicles)
+    ]
+    db.add_all(fleet)
+    db.flush()
+    type_ids = [mt.id for mt in db.scalars(catalog.visible_types(user.id))]
+    rnd = random.Random(1)
+    start = datetime.utcnow() - timedelta(days=logs_per_vehicle * 3)
+    db.add_all(
+        models.MaintenanceLog(
+            vehicle_id=v.id, maintenance_type_id=rnd.choice(type_ids), km_performed=i * 300,
+            date_performed=start + timedelta(days=i * 3), service_cost=rnd.random() * 300,
+            product_cost=rnd.random() * 200, category="preventiva"
+        )
+        for v in fleet for i in range(logs_per_vehicle)
+    )
+    db.flush()
+    rollups.rebuild_all(db, [v.id for v in fleet])
+    token, vehicle_ids = main.create_user_token(user), [v.id for v in fleet]
+    db.commit()
+    db.close()
+    return token, vehicle_ids
+
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+
+
+async def load(base_url: str, token: str, path: str, vehicle_ids: list, clients: int, seconds: float) -> dict:
+    import httpx
+
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {token}"}, limits=limits, timeout=60) as client:
+
+        async def user_loop(seed_value: int):
+            nonlocal errors
+            rnd = random.Random(seed_value)
+            while time.perf_counter() < deadline:
+                url = path.format(vehicle_id=rnd.choice(vehicle_ids))
+                started = time.perf_counter()
+                response = await client.get(url)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(user_loop(i) for i in range(clients)))
+    return {
+        "rps": len(latencies) / seconds,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+
+async def wait_ready(base_url: str):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        for _ in range(100):
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("O servidor não subiu")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga nas rotas de leitura: caminho síncrono x assíncrono")
+    parser.add_argument("--clients", type=int, default=64, help="clientes simultâneos")
+    parser.add_argument("--seconds", type=float, default=10, help="duração por rota e caminho")
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--logs", type=int, default=200, help="registros por veículo")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    # Banco temporário compartilhado com o processo do servidor (as duas variantes leem os mesmos dados)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='manutencar-load-'), 'load.db')}"
+    os.environ["SERVER_TIMING"] = "0"
+    token, vehicle_ids = seed(args.vehicles, args.logs)
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port)], cwd=ROOT)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_ready(base_url))
+        print(f"{args.clients} clientes simultâneos, {args.seconds:g}s por rota, {args.vehicles} veículos x {args.logs} registros")
+        print(f"{'rota':<32} {'caminho':<7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'erros':>6}")
+        for path in ROUTES:
+            for stack, prefix in (("sync", SYNC_PREFIX), ("async", "")):
+                r = asyncio.run(load(base_url, token, prefix + path, vehicle_ids, args.clients, args.seconds))
+                print(f"{path:<32} {stack:<7} {r['rps']:>8.1f} {r['p50']:>8.1f} {r['p99']:>8.1f} {r['errors']:>6}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
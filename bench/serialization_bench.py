@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+from typing import List
+
+# Custo de serialização por página de N registros: encoder padrão (jsonable_encoder + JSONResponse)
+# contra o caminho atual (response_model validado pelo pydantic-core + ORJSONResponse).
+#   python bench/serialization_bench.py --rows 1000
+# Mede só a serialização, sem banco nem HTTP, para objetos ORM (MaintenanceLog) e dicionários (histórico).
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialização: encoder padrão x orjson")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='manutencar-serial-'), 'serial.db')}"
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from pydantic import TypeAdapter
+
+    import main as api
+    import models
+
+    now = datetime(2024, 1, 1)
+    logs = [
+        models.MaintenanceLog(
+            id=i, vehicle_id=1, maintenance_type_id=3, date_performed=now - timedelta(days=i), km_performed=i * 10,
+            notes="troca", service_cost=10.0, product_cost=5.5, category="preventiva", sync_version=1, updated_at=now
+        )
+        for i in range(args.rows)
+    ]
+    items = [
+        {
+            "id": i, "maintenance_type_id": 3, "maintenance_type": "Óleo", "date_performed": now - timedelta(days=i),
+            "km_performed": i * 10, "notes": "troca", "service_cost": 10.0, "product_cost": 5.5, "category": "preventiva",
+        }
+        for i in range(args.rows)
+    ]
+
+    def default_encoder(content, adapter):
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def orjson_encoder(content, adapter):
+        return ORJSONResponse(adapter.dump_python(adapter.validate_python(content, from_attributes=True), mode="json")).body
+
+    cases = [
+        ("ORM MaintenanceLog", logs, TypeAdapter(List[api.MaintenanceLogResponse])),
+        ("dicts do histórico", items, TypeAdapter(List[api.HistoryItem])),
+    ]
+    print(f"{args.rows} registros por página")
+    print(f"{'conteúdo':<20} {'padrão':>10} {'orjson':>10} {'ganho':>6} {'KB padrão':>10} {'KB orjson':>10}")
+    for label, content, adapter in cases:
+        timings = []
+        for encode in (default_encoder, orjson_encoder):
+            best = min(timeit.repeat(lambda: encode(content, adapter), number=args.repeat, repeat=5))
+            timings.append(best / args.repeat * 1000)
+        sizes = [len(encode(content, adapter)) / 1000 for encode in (default_encoder, orjson_encoder)]
+        print(f"{label:<20} {timings[0]:>8.1f}ms {timings[1]:>8.1f}ms {timings[0] / timings[1]:>5.1f}x {sizes[0]:>10.0f} {sizes[1]:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session, aliased
+
+import models
+import sync
+
+# Catálogo global de tipos de manutenção (linhas com user_id NULL), visível a todos os usuários.
+# Cada usuário só ganha linhas próprias quando cria um tipo ou personaliza um do catálogo:
+#   - personalização: cópia com catalog_id apontando para a linha do catálogo (copy-on-write);
+#   - remoção de um tipo do catálogo: "lápide" com catalog_id e hidden=True, que apenas o esconde.
+
+DEFAULT_TYPES = [
+    {"name": "Troca de Óleo do Motor", "km": 10000, "months": 12},
+    {"name": "Filtro de Óleo", "km": 10000, "months": 12},
+    {"name": "Filtro de Ar", "km": 20000, "months": 24},
+    {"name": "Filtro de Combustível", "km": 20000, "months": 24},
+    {"name": "Pastilhas de Freio", "km": 30000, "months": 36},
+    {"name": "Fluido de Freio", "km": 40000, "months": 24},
+    {"name": "Líquido de Arrefecimento", "km": 40000, "months": 24},
+    {"name": "Óleo de Câmbio (Manual)", "km": 100000, "months": 60},
+    {"name": "Correia Dentada", "km": 60000, "months": 48},
+    {"name": "Velas de Ignição", "km": 50000, "months": 48},
+]
+
+
+def visible_types(user_id: int):
+    # SELECT dos tipos que o usuário enxerga: os próprios (não ocultos) + os do catálogo sem personalização
+    mt = models.MaintenanceType
+    override = aliased(mt)
+    return select(mt)\
+        .outerjoin(override, and_(override.catalog_id == mt.id, override.user_id == user_id))\
+        .where(or_(
+            and_(mt.user_id == user_id, mt.hidden == False),
+            and_(mt.user_id.is_(None), override.id.is_(None))
+        ))
+
+
+def get_visible_type(db: Session, user_id: int, type_id: int):
+    return db.scalars(visible_types(user_id).where(models.MaintenanceType.id == type_id)).first()
+
+
+def resolve_type_id(db: Session, user_id: int, type_id: int) -> int:
+    # Um id do catálogo que o usuário já personalizou passa a valer como o id da personalização
+    override_id = db.query(models.MaintenanceType.id).filter(
+        models.MaintenanceType.catalog_id == type_id,
+        models.MaintenanceType.user_id == user_id,
+        models.MaintenanceType.hidden == False
+    ).scalar()
+    return override_id or type_id
+
+
+def _user_vehicle_ids(user_id: int):
+    return select(models.Vehicle.id).where(models.Vehicle.owner_id == user_id)
+
+
+def repoint_user_logs(db: Session, user_id: int, from_type_id: int, to_type_id: int) -> int:
+    # Move os registros (e a projeção last_service) do usuário de um tipo para outro
+    moved = db.query(models.MaintenanceLog).filter(
+        models.MaintenanceLog.maintenance_type_id == from_type_id,
+        models.MaintenanceLog.vehicle_id.in_(_user_vehicle_ids(user_id))
+    ).update({models.MaintenanceLog.maintenance_type_id: to_type_id}, synchronize_session=False)
+    db.query(models.LastService).filter(
+        models.LastService.maintenance_type_id == from_type_id,
+        models.LastService.vehicle_id.in_(_user_vehicle_ids(user_id))
+    ).update({models.LastService.maintenance_type_id: to_type_id}, synchronize_session=False)
+    return moved
+
+
+def materialize(db: Session, user_id: int, mt: models.MaintenanceType) -> models.MaintenanceType:
+    # Copy-on-write: devolve uma linha do próprio usuário para o tipo (cria a cópia se for do catálogo)
+    if mt.user_id == user_id:
+        return mt
+    own = models.MaintenanceType(
+        name=mt.name,
+        default_interval_km=mt.default_interval_km,
+        default_interval_months=mt.default_interval_months,
+        description=mt.description,
+        user_id=user_id,
+        catalog_id=mt.id,
+        hidden=False
+    )
+    db.add(own)
+    db.flush()
+    repoint_user_logs(db, user_id, mt.id, own.id)
+    return own
+
+
+def hide(db: Session, user_id: int, mt: models.MaintenanceType):
+    # Remove o tipo da visão do usuário sem afetar o catálogo nem os demais usuários
+    if mt.user_id is None:
+        db.add(models.MaintenanceType(user_id=user_id, catalog_id=mt.id, hidden=True))
+    elif mt.catalog_id is not None:
+        # Personalização vira lápide, senão o tipo original do catálogo reapareceria
+        mt.name = None
+        mt.hidden = True
+    else:
+        db.delete(mt)
+        sync.record_deletions(db, user_id, "maintenance_type", [mt.id])
+
+
+def seed_catalog(db: Session) -> dict:
+    # Insere os tipos padrão que ainda não estão no catálogo; retorna {nome: linha}
+    existing = {mt.name: mt for mt in db.query(models.MaintenanceType).filter(models.MaintenanceType.user_id.is_(None))}
+    for item in DEFAULT_TYPES:
+        if item["name"] not in existing:
+            mt = models.MaintenanceType(
+                name=item["name"],
+                default_interval_km=item["km"],
+                default_interval_months=item["months"],
+                user_id=None,
+                hidden=False
+            )
+            db.add(mt)
+            existing[item["name"]] = mt
+    db.flush()
+    return existing
+
+
+def collapse_user_defaults(db: Session):
+    # Bancos antigos têm uma cópia dos tipos padrão por usuário:
+    #   - cópia intacta: registros passam para o catálogo e a cópia é apagada;
+    #   - cópia com intervalos/descrição alterados: vira personalização (catalog_id);
+    #   - padrão ausente (removido ou renomeado pelo usuário): ganha lápide para continuar oculto.
+    catalog = seed_catalog(db)
+    user_ids = [row[0] for row in db.query(models.User.id).all()]
+    rows = db.query(models.MaintenanceType).filter(
+        models.MaintenanceType.user_id.isnot(None),
+        models.MaintenanceType.catalog_id.is_(None)
+    ).all()
+    own_by_user = {}
+    for mt in rows:
+        own_by_user.setdefault(mt.user_id, {})[mt.name] = mt
+
+    for user_id in user_ids:
+        own = own_by_user.get(user_id, {})
+        for name, catalog_mt in catalog.items():
+            mt = own.get(name)
+            if mt is None:
+                db.add(models.MaintenanceType(user_id=user_id, catalog_id=catalog_mt.id, hidden=True))
+                continue
+            untouched = (
+                mt.default_interval_km == catalog_mt.default_interval_km
+                and mt.default_interval_months == catalog_mt.default_interval_months
+                and not mt.description and not catalog_mt.description
+            )
+            if untouched:
+                repoint_user_logs(db, user_id, mt.id, catalog_mt.id)
+                # Intervalos iguais aos do catálogo: os vencimentos da projeção continuam valendo
+                db.delete(mt)
+            else:
+                mt.catalog_id = catalog_mt.id
+    db.flush()
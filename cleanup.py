@@ -0,0 +1,72 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+import rollups
+
+# Exclusões em cascata feitas com poucos DELETEs em lote (número fixo de comandos, qualquer que seja
+# o volume de dados), na ordem filhos -> pais exigida pelas chaves estrangeiras.
+#   python cleanup.py --check  -> lista linhas órfãs (sem o veículo/usuário/tipo a que pertencem)
+
+
+def _delete(db: Session, column, ids) -> int:
+    return db.query(column.class_).filter(column.in_(ids)).delete(synchronize_session=False)
+
+
+def delete_vehicles(db: Session, vehicle_ids) -> int:
+    # vehicle_ids: lista ou SELECT de ids; remove logs, insights, jobs e projeções junto com os veículos
+    _delete(db, models.MaintenanceLog.vehicle_id, vehicle_ids)
+    _delete(db, models.VehicleInsights.vehicle_id, vehicle_ids)
+    _delete(db, models.InsightJob.vehicle_id, vehicle_ids)
+    rollups.purge_vehicles(db, vehicle_ids)
+    return _delete(db, models.Vehicle.id, vehicle_ids)
+
+
+def delete_user(db: Session, user_id: int):
+    # Conta inteira: veículos (com tudo que depende deles), jobs, exclusões registradas, configuração, tipos próprios
+    # (inclusive personalizações e lápides do catálogo) e o próprio usuário
+    delete_vehicles(db, select(models.Vehicle.id).where(models.Vehicle.owner_id == user_id))
+    _delete(db, models.InsightJob.user_id, [user_id])
+    _delete(db, models.SyncTombstone.user_id, [user_id])
+    _delete(db, models.UserConfig.user_id, [user_id])
+    _delete(db, models.MaintenanceType.user_id, [user_id])
+    _delete(db, models.User.id, [user_id])
+
+
+def _missing(db: Session, column, parent_column) -> int:
+    # Linhas cujo valor em `column` não existe mais na tabela pai
+    return db.query(column.class_).filter(column.isnot(None), column.not_in(select(parent_column))).count()
+
+
+def find_orphans(db: Session) -> dict:
+    # {tabela.coluna: quantidade de linhas órfãs}, só com o que tiver órfãos
+    checks = {
+        "vehicles.owner_id": (models.Vehicle.owner_id, models.User.id),
+        "maintenance_types.user_id": (models.MaintenanceType.user_id, models.User.id),
+        "maintenance_logs.vehicle_id": (models.MaintenanceLog.vehicle_id, models.Vehicle.id),
+        "user_configs.user_id": (models.UserConfig.user_id, models.User.id),
+        "vehicle_insights.vehicle_id": (models.VehicleInsights.vehicle_id, models.Vehicle.id),
+        "insight_jobs.user_id": (models.InsightJob.user_id, models.User.id),
+        "sync_tombstones.user_id": (models.SyncTombstone.user_id, models.User.id),
+        "insight_jobs.vehicle_id": (models.InsightJob.vehicle_id, models.Vehicle.id),
+        "last_service.vehicle_id": (models.LastService.vehicle_id, models.Vehicle.id),
+        "vehicle_summaries.vehicle_id": (models.VehicleSummary.vehicle_id, models.Vehicle.id),
+        "monthly_costs.vehicle_id": (models.MonthlyCost.vehicle_id, models.Vehicle.id),
+    }
+    counts = {name: _missing(db, column, parent) for name, (column, parent) in checks.items()}
+    return {name: count for name, count in counts.items() if count}
+
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if "--check" not in sys.argv:
+            print("Uso: python cleanup.py --check")
+            sys.exit(2)
+        orphans = find_orphans(db)
+        print(f"Linhas órfãs: {orphans}" if orphans else "Nenhuma linha órfã.")
+        sys.exit(1 if orphans else 0)
+    finally:
+        db.close()
@@ -1,11 +1,80 @@
-from sqlalchemy import create_engine
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./manutencar.db"
+load_dotenv()
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Banco configurável via DATABASE_URL (padrão: SQLite local)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./manutencar.db")
+if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
+    # Alguns provedores ainda entregam o esquema antigo
+    SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+# Ajustes do SQLite (podem ser sobrescritos por variáveis de ambiente)
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),   # leitores não bloqueiam o escritor
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),  # seguro com WAL e bem mais rápido que FULL
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")) * -1,  # negativo = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+    "foreign_keys": os.getenv("SQLITE_FOREIGN_KEYS", "ON"),      # recusa linhas órfãs, como o Postgres
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def _pool_options() -> dict:
+    # Postgres (ou outro servidor): pool dimensionado e verificação da conexão antes do uso
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+    }
+
+
+def build_engine(url: str):
+    if url.startswith("sqlite"):
+        sqlite_engine = create_engine(url, connect_args={"check_same_thread": False})
+        event.listen(sqlite_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+    return create_engine(url, **_pool_options())
+
+
+def async_url(url: str) -> str:
+    # Mesmo banco, driver assíncrono (aiosqlite / asyncpg)
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    if url.startswith("postgresql+psycopg2:"):
+        return url.replace("postgresql+psycopg2:", "postgresql+asyncpg:", 1)
+    return url
+
+
+def build_async_engine(url: str):
+    url = async_url(url)
+    if url.startswith("sqlite"):
+        sqlite_engine = create_async_engine(url)
+        event.listen(sqlite_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+    return create_async_engine(url, **_pool_options())
+
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+
+# Caminho assíncrono usado pelas rotas de leitura mais acessadas
+async_engine = build_async_engine(SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+Base = declarative_base()
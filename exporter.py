@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+import os
+import zlib
+from sqlalchemy import select
+
+import models
+from database import SessionLocal
+
+# Exportação do histórico completo do usuário (CSV ou NDJSON) em streaming: os logs são lidos do
+# banco em lotes (yield_per, cursor no servidor) e cada lote é escrito e enviado antes do próximo,
+# então a memória não cresce com o tamanho do histórico. As colunas são as aceitas pelo importer.py.
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+COLUMNS = [
+    "vehicle_id", "license_plate", "make", "model", "date_performed", "maintenance_type",
+    "maintenance_type_id", "km_performed", "service_cost", "product_cost", "category", "notes"
+]
+
+
+def _export_query(user_id: int, vehicle_id: int = None):
+    # Nomes de veículo e tipo já no JOIN; ordem do índice (veículo, data, id)
+    log = models.MaintenanceLog
+    vehicle = models.Vehicle
+    query = select(
+        log.vehicle_id, vehicle.license_plate, vehicle.make, vehicle.model, log.date_performed,
+        models.MaintenanceType.name, log.maintenance_type_id, log.km_performed,
+        log.service_cost, log.product_cost, log.category, log.notes
+    ).join(vehicle, vehicle.id == log.vehicle_id)\
+        .outerjoin(models.MaintenanceType, models.MaintenanceType.id == log.maintenance_type_id)\
+        .where(vehicle.owner_id == user_id)\
+        .order_by(vehicle.id, log.date_performed, log.id)
+    if vehicle_id is not None:
+        query = query.where(log.vehicle_id == vehicle_id)
+    return query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def _csv_chunks(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in partitions:
+        writer.writerows(
+            (*row[:4], row.date_performed.isoformat() if row.date_performed else "", *row[5:]) for row in rows
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _ndjson_chunks(partitions):
+    for rows in partitions:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, (
+                *row[:4], row.date_performed.isoformat() if row.date_performed else None, *row[5:]
+            ))), ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+
+def _gzip(chunks):
+    # Compressão gzip incremental: cada lote sai comprimido sem esperar o fim do arquivo
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(user_id: int, fmt: str, vehicle_id: int = None, gzip: bool = False):
+    # Gerador usado pelo StreamingResponse; abre a própria sessão, que dura o tempo do download
+    db = SessionLocal()
+    try:
+        partitions = db.execute(_export_query(user_id, vehicle_id)).partitions()
+        chunks = _csv_chunks(partitions) if fmt == "csv" else _ndjson_chunks(partitions)
+        encoded = (chunk.encode("utf-8") for chunk in chunks)
+        yield from (_gzip(encoded) if gzip else encoded)
+    finally:
+        db.close()
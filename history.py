@@ -0,0 +1,50 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import and_, or_, select
+
+import models
+
+
+def history_query(
+    vehicle_id: int,
+    category: str = None,
+    maintenance_type_id: int = None,
+    date_from: date = None,
+    date_to: date = None,
+    km_min: int = None,
+    km_max: int = None,
+    after: tuple = None
+):
+    # SELECT (log, nome do tipo) do histórico de um veículo, do mais recente ao mais antigo.
+    # after=(date_performed, id) do último item da página anterior (paginação por chave/keyset).
+    log = models.MaintenanceLog
+    # Nome do tipo vem no mesmo SELECT (sem lazy load por linha)
+    query = select(log, models.MaintenanceType.name)\
+        .outerjoin(models.MaintenanceType, models.MaintenanceType.id == log.maintenance_type_id)\
+        .where(log.vehicle_id == vehicle_id)
+
+    if category:
+        query = query.where(log.category == category)
+    if maintenance_type_id is not None:
+        query = query.where(log.maintenance_type_id == maintenance_type_id)
+    # Intervalo inclusivo; data sem hora vale o dia inteiro (date_to=2024-01-31 inclui 31/01 às 18h)
+    if date_from is not None:
+        if not isinstance(date_from, datetime):
+            date_from = datetime.combine(date_from, time())
+        query = query.where(log.date_performed >= date_from)
+    if date_to is not None:
+        if isinstance(date_to, datetime):
+            query = query.where(log.date_performed <= date_to)
+        else:
+            query = query.where(log.date_performed < datetime.combine(date_to, time()) + timedelta(days=1))
+    if km_min is not None:
+        query = query.where(log.km_performed >= km_min)
+    if km_max is not None:
+        query = query.where(log.km_performed <= km_max)
+
+    if after is not None:
+        after_date, after_id = after
+        query = query.where(or_(
+            log.date_performed < after_date,
+            and_(log.date_performed == after_date, log.id < after_id)
+        ))
+    return query.order_by(log.date_performed.desc(), log.id.desc())
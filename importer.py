@@ -0,0 +1,204 @@
+import csv
+import json
+import os
+import re
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import catalog
+import models
+import normalizer
+import rollups
+import versions
+
+# Importação em lote do histórico de manutenção (CSV ou NDJSON, uma manutenção por linha).
+# O arquivo é lido linha a linha; as linhas válidas são gravadas em lotes (executemany), cada lote
+# na sua própria transação. No fim, a quilometragem e as projeções de cada veículo afetado são
+# recalculadas uma única vez (também quando um lote falha: os lotes já gravados ficam consistentes).
+# Linhas inválidas entram no relatório sem interromper o arquivo.
+#
+# Colunas: date_performed, km_performed, maintenance_type (nome) ou maintenance_type_id,
+# vehicle_id ou license_plate (opcionais se o veículo vier na URL), notes, service_cost,
+# product_cost, category. Colunas extras (ex.: "total" do CSV exportado pela tela) são ignoradas.
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))  # erros detalhados no relatório
+
+_br_date = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})(.*)$")
+_plate_chars = re.compile(r"[^A-Z0-9]")
+
+
+def detect_format(filename: str, requested: str = None) -> str:
+    if requested:
+        return requested
+    name = (filename or "").lower()
+    return "ndjson" if name.endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+
+def _plate(value) -> str:
+    return _plate_chars.sub("", str(value or "").upper())
+
+
+def _records(text, fmt: str):
+    # (linha, dict) de cada registro; registros ilegíveis chegam como (linha, mensagem de erro)
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {k.strip(): v for k, v in row.items() if k and v not in (None, "")}
+        return
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, "JSON inválido"
+            continue
+        yield line_no, row if isinstance(row, dict) else "Cada linha deve ser um objeto JSON"
+
+
+class _Lookups:
+    # Mapas em memória carregados uma vez por importação: veículos do usuário e tipos visíveis
+
+    def __init__(self, db: Session, user_id: int, default_vehicle_id: int = None):
+        vehicles = db.query(models.Vehicle.id, models.Vehicle.license_plate, models.Vehicle.current_km)\
+            .filter(models.Vehicle.owner_id == user_id).all()
+        self.current_km = {v.id: v.current_km or 0 for v in vehicles}
+        self.plates = {_plate(v.license_plate): v.id for v in vehicles if v.license_plate}
+        self.default_vehicle_id = default_vehicle_id
+
+        self.type_ids, self.type_names = {}, {}
+        for mt in db.scalars(catalog.visible_types(user_id)):
+            self.type_ids[mt.id] = mt.id
+            if mt.catalog_id:
+                # Id do catálogo já personalizado pelo usuário vale como o da personalização
+                self.type_ids[mt.catalog_id] = mt.id
+            self.type_names.setdefault(normalizer.fold(mt.name), mt.id)
+
+    def vehicle_id(self, row: dict) -> int:
+        if "vehicle_id" in row:
+            try:
+                vehicle_id = int(row["vehicle_id"])
+            except (TypeError, ValueError):
+                raise ValueError("vehicle_id inválido")
+        elif "license_plate" in row:
+            vehicle_id = self.plates.get(_plate(row["license_plate"]))
+        else:
+            vehicle_id = self.default_vehicle_id
+        if vehicle_id not in self.current_km:
+            raise ValueError("Veículo não encontrado")
+        return vehicle_id
+
+    def type_id(self, row: dict) -> int:
+        if "maintenance_type_id" in row:
+            try:
+                type_id = self.type_ids.get(int(row["maintenance_type_id"]))
+            except (TypeError, ValueError):
+                type_id = None
+        else:
+            name = row.get("maintenance_type") or row.get("maintenance_type_name")
+            if not name:
+                raise ValueError("Informe maintenance_type ou maintenance_type_id")
+            name = str(name)
+            if name not in self.type_names:
+                # Memoiza a grafia exata: o nome é normalizado uma vez, não a cada linha
+                self.type_names[name] = self.type_names.get(normalizer.fold(name))
+            type_id = self.type_names[name]
+        if type_id is None:
+            raise ValueError("Tipo de manutenção não encontrado")
+        return type_id
+
+
+def _error_message(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in exc.errors())
+    return str(exc)
+
+
+def _parse_row(row: dict, lookups: _Lookups, schema) -> dict:
+    vehicle_id = lookups.vehicle_id(row)
+    row["maintenance_type_id"] = lookups.type_id(row)
+    match = _br_date.match(str(row.get("date_performed", "")).strip())
+    if match:
+        # Data no formato da tela (dd/mm/aaaa), como no CSV exportado pelo histórico
+        day, month, year, rest = match.groups()
+        row["date_performed"] = f"{year}-{int(month):02d}-{int(day):02d}{rest}"
+    values = schema(**row).dict()
+    values["vehicle_id"] = vehicle_id
+    return values
+
+
+def _flush(db: Session, batch: list):
+    # Um lote = uma transação com um INSERT executemany
+    db.execute(insert(models.MaintenanceLog), batch)
+    db.commit()
+
+
+def _finish(db: Session, user_id: int, lookups: _Lookups, max_km: dict, report: dict):
+    # Quilometragem e projeções atualizadas uma única vez por veículo, no fim (consultas agrupadas,
+    # em vez de recalcular cada par veículo/tipo e cada mês a cada lote)
+    if not max_km:
+        return
+    rollups.rebuild_all(db, list(max_km))
+    for vehicle_id, km in max_km.items():
+        if km > lookups.current_km[vehicle_id]:
+            db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id)\
+                .update({models.Vehicle.current_km: km}, synchronize_session=False)
+            lookups.current_km[vehicle_id] = km
+        report["vehicles"][vehicle_id] = lookups.current_km[vehicle_id]
+    versions.touch_vehicles(db, user_id, list(max_km))
+    db.commit()
+
+
+def import_logs(db: Session, user_id: int, text, fmt: str, schema, default_vehicle_id: int = None) -> dict:
+    # text: arquivo em modo texto; schema: modelo de validação de cada linha (MaintenanceLogCreate)
+    lookups = _Lookups(db, user_id, default_vehicle_id)
+    report = {"imported": 0, "failed": 0, "errors": [], "vehicles": {}}
+    max_km = {}      # maior KM por veículo entre as linhas já gravadas
+    batch_km = {}    # o mesmo para o lote ainda em memória
+    batch = []
+
+    def fail(line_no, message):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_ERRORS:
+            report["errors"].append({"line": line_no, "error": message})
+
+    def flush():
+        _flush(db, batch)
+        report["imported"] += len(batch)
+        for vehicle_id, km in batch_km.items():
+            max_km[vehicle_id] = max(max_km.get(vehicle_id, 0), km)
+        batch.clear()
+        batch_km.clear()
+
+    try:
+        try:
+            for line_no, row in _records(text, fmt):
+                if isinstance(row, str):
+                    fail(line_no, row)
+                    continue
+                try:
+                    values = _parse_row(row, lookups, schema)
+                except ValueError as e:  # inclui ValidationError
+                    fail(line_no, _error_message(e))
+                    continue
+                batch.append(values)
+                vehicle_id = values["vehicle_id"]
+                batch_km[vehicle_id] = max(batch_km.get(vehicle_id, 0), values["km_performed"] or 0)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    flush()
+        except UnicodeDecodeError:
+            fail(None, "Arquivo deve estar em UTF-8; importação interrompida")
+        except csv.Error as e:
+            fail(None, f"CSV inválido ({e}); importação interrompida")
+
+        if batch:
+            flush()
+    except Exception:
+        # O lote que falhou é descartado; os já gravados ainda recebem projeções e versão abaixo
+        db.rollback()
+        raise
+    finally:
+        _finish(db, user_id, lookups, max_km, report)
+    return report
@@ -0,0 +1,121 @@
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+import ai_service
+import models
+from database import AsyncSessionLocal
+
+# Leitura/gravação do banco usadas pelas rotas de IA. As rotas chamam estas funções via
+# AsyncSession.run_sync e encerram a transação antes de aguardar o provedor de IA.
+
+
+def load_ai_config(db: Session, user_id: int, detail: str = "Configuração de IA ausente no perfil.") -> tuple:
+    # (provedor, chave criptografada) do usuário ou 400 se não configurado
+    config = db.query(models.UserConfig).filter(models.UserConfig.user_id == user_id).first()
+    if not config or not config.llm_provider or not config.llm_api_key_encrypted:
+        raise HTTPException(status_code=400, detail=detail)
+    return config.llm_provider, config.llm_api_key_encrypted
+
+
+def load_vehicle_context(db: Session, user_id: int, vehicle_id: int) -> dict:
+    # Dados do veículo + histórico (nome do tipo via JOIN, sem lazy load por log)
+    vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user_id).first()
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Veículo não encontrado")
+
+    rows = db.query(models.MaintenanceLog.date_performed, models.MaintenanceLog.km_performed, models.MaintenanceType.name)\
+        .outerjoin(models.MaintenanceType, models.MaintenanceType.id == models.MaintenanceLog.maintenance_type_id)\
+        .filter(models.MaintenanceLog.vehicle_id == vehicle_id)\
+        .order_by(models.MaintenanceLog.date_performed.asc())\
+        .all()
+
+    history = [{
+        "maintenance_type": name or "Desconhecido",
+        "date_performed": date_performed,
+        "km_performed": km_performed or 0
+    } for date_performed, km_performed, name in rows]
+
+    return {
+        "make": vehicle.make,
+        "model": vehicle.model,
+        "year": vehicle.year,
+        "current_km": vehicle.current_km,
+        "history": history
+    }
+
+
+def save_insights(db: Session, vehicle_id: int, result) -> models.VehicleInsights:
+    insight = db.query(models.VehicleInsights).filter(models.VehicleInsights.vehicle_id == vehicle_id).first()
+    if not insight:
+        insight = models.VehicleInsights(vehicle_id=vehicle_id)
+        db.add(insight)
+
+    result_dict = result if isinstance(result, dict) else {}
+    insight.chronic_issues = json.dumps(result_dict.get("chronic_issues", []))
+    insight.suggested_maintenance = json.dumps(result_dict.get("suggested_maintenance", []))
+    insight.generated_at = datetime.utcnow()
+    return insight
+
+
+async def generate_for_vehicle(user_id: int, vehicle_id: int) -> dict:
+    # Gera e grava os insights de um veículo; a conexão não fica presa enquanto a IA responde
+    async with AsyncSessionLocal() as db:
+        provider, encrypted_key = await db.run_sync(
+            load_ai_config, user_id, "Configuração de IA ausente no perfil. Configure na aba de Perfil."
+        )
+        context = await db.run_sync(load_vehicle_context, user_id, vehicle_id)
+
+    result = await ai_service.generate_vehicle_insights(
+        make=context["make"],
+        model=context["model"],
+        year=context["year"],
+        current_km=context["current_km"],
+        history=context["history"],
+        provider=provider,
+        encrypted_key=encrypted_key,
+        user_id=user_id
+    )
+
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(save_insights, vehicle_id, result)
+        await db.commit()
+    return result
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=_json_default, ensure_ascii=False)}\n\n"
+
+
+async def stream_for_vehicle(vehicle_id: int, context: dict, provider: str, encrypted_key: str, user_id: int):
+    # Eventos SSE: progress (etapas), partial (cada item assim que chega), final (JSON validado e gravado) ou error
+    yield sse("progress", {"stage": "generating"})
+    try:
+        result = None
+        async for kind, data in ai_service.stream_vehicle_insights(
+            make=context["make"],
+            model=context["model"],
+            year=context["year"],
+            current_km=context["current_km"],
+            history=context["history"],
+            provider=provider,
+            encrypted_key=encrypted_key,
+            user_id=user_id
+        ):
+            if kind == "partial":
+                yield sse("partial", data)
+            else:
+                result = data
+
+        yield sse("progress", {"stage": "saving"})
+        async with AsyncSessionLocal() as db:
+            insight = await db.run_sync(save_insights, vehicle_id, result)
+            await db.commit()
+        yield sse("final", {**result, "generated_at": insight.generated_at})
+    except HTTPException as e:
+        yield sse("error", {"status": e.status_code, "detail": e.detail})
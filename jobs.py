@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import insights
+import models
+from database import AsyncSessionLocal
+
+# Fila de geração de insights em segundo plano. O estado dos jobs fica na tabela insight_jobs
+# (consultável por GET /jobs/{id}); a fila e os workers são tarefas asyncio do próprio processo.
+
+JOB_WORKERS = int(os.getenv("INSIGHT_JOB_WORKERS", "4"))
+BULK_CONCURRENCY = int(os.getenv("INSIGHT_BULK_CONCURRENCY", "3"))
+# Jobs sem atualização há mais tempo que isso (ex.: processo reiniciado) não bloqueiam novos pedidos
+JOB_STALE_AFTER = timedelta(minutes=int(os.getenv("INSIGHT_JOB_STALE_MINUTES", "10")))
+ACTIVE_STATUSES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+_queue = None
+_workers = []
+_loop = None
+
+
+def job_payload(job: models.InsightJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "vehicle_id": job.vehicle_id,
+        "status": job.status,
+        "progress": job.progress or 0,
+        "total": job.total or 0,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at
+    }
+
+
+def active_job_query(user_id: int, kind: str, vehicle_id: int = None):
+    query = select(models.InsightJob).where(
+        models.InsightJob.user_id == user_id,
+        models.InsightJob.kind == kind,
+        models.InsightJob.status.in_(ACTIVE_STATUSES),
+        models.InsightJob.updated_at >= datetime.utcnow() - JOB_STALE_AFTER
+    )
+    if vehicle_id is not None:
+        query = query.where(models.InsightJob.vehicle_id == vehicle_id)
+    return query.order_by(models.InsightJob.id.desc()).limit(1)
+
+
+def _active_job(db: Session, user_id: int, kind: str, vehicle_id: int = None):
+    return db.scalars(active_job_query(user_id, kind, vehicle_id)).first()
+
+
+def active_vehicle_job(db: Session, user_id: int, vehicle_id: int):
+    job = _active_job(db, user_id, "vehicle", vehicle_id)
+    return job_payload(job) if job else None
+
+
+def _create_job(db: Session, user_id: int, kind: str, vehicle_id: int = None, total: int = 1) -> models.InsightJob:
+    now = datetime.utcnow()
+    job = models.InsightJob(user_id=user_id, vehicle_id=vehicle_id, kind=kind, status="queued",
+                            progress=0, total=total, created_at=now, updated_at=now)
+    db.add(job)
+    db.flush()
+    return job
+
+
+def enqueue_vehicle_job(db: Session, user_id: int, vehicle_id: int, before_create=None) -> tuple:
+    # (job, criado?) - enquanto houver um job ativo para o veículo, ele é reaproveitado.
+    # before_create() só roda quando um job novo vai ser criado (ex.: consumir o limite de uso da IA)
+    vehicle = db.query(models.Vehicle.id).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user_id).first()
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Veículo não encontrado")
+    job = _active_job(db, user_id, "vehicle", vehicle_id)
+    if job:
+        return job_payload(job), False
+    if before_create is not None:
+        before_create()
+    return job_payload(_create_job(db, user_id, "vehicle", vehicle_id=vehicle_id)), True
+
+
+def enqueue_bulk_job(db: Session, user_id: int, before_create=None) -> tuple:
+    job = _active_job(db, user_id, "bulk")
+    if job:
+        return job_payload(job), False
+    total = db.query(models.Vehicle).filter(models.Vehicle.owner_id == user_id).count()
+    if not total:
+        raise HTTPException(status_code=400, detail="Nenhum veículo cadastrado.")
+    if before_create is not None:
+        before_create()
+    return job_payload(_create_job(db, user_id, "bulk", total=total)), True
+
+
+def get_user_job(db: Session, user_id: int, job_id: int) -> dict:
+    job = db.query(models.InsightJob).filter(models.InsightJob.id == job_id, models.InsightJob.user_id == user_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job_payload(job)
+
+
+def _claim(db: Session, job_id: int):
+    # Passa de 'queued' para 'running' de forma atômica: um job nunca é processado duas vezes
+    claimed = db.query(models.InsightJob)\
+        .filter(models.InsightJob.id == job_id, models.InsightJob.status == "queued")\
+        .update({"status": "running", "updated_at": datetime.utcnow()}, synchronize_session=False)
+    if not claimed:
+        return None
+    job = db.query(models.InsightJob).filter(models.InsightJob.id == job_id).first()
+    return {"id": job.id, "kind": job.kind, "user_id": job.user_id, "vehicle_id": job.vehicle_id}
+
+
+def _advance(db: Session, job_id: int):
+    db.query(models.InsightJob).filter(models.InsightJob.id == job_id).update(
+        {"progress": models.InsightJob.progress + 1, "updated_at": datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def _finish(db: Session, job_id: int, status: str, result=None, error: str = None):
+    now = datetime.utcnow()
+    values = {"status": status, "error": error, "updated_at": now, "finished_at": now}
+    if result is not None:
+        values["result"] = json.dumps(result)
+    if status == "done":
+        values["progress"] = models.InsightJob.total
+    db.query(models.InsightJob).filter(models.InsightJob.id == job_id).update(values, synchronize_session=False)
+
+
+def _queued_job_ids(db: Session) -> list:
+    rows = db.query(models.InsightJob.id).filter(
+        models.InsightJob.status == "queued",
+        models.InsightJob.updated_at >= datetime.utcnow() - JOB_STALE_AFTER
+    ).order_by(models.InsightJob.id).all()
+    return [r.id for r in rows]
+
+
+def _user_vehicle_ids(db: Session, user_id: int) -> list:
+    rows = db.query(models.Vehicle.id).filter(models.Vehicle.owner_id == user_id).order_by(models.Vehicle.id).all()
+    return [r.id for r in rows]
+
+
+async def _db(fn, *args):
+    async with AsyncSessionLocal() as db:
+        result = await db.run_sync(fn, *args)
+        await db.commit()
+        return result
+
+
+async def _run_bulk(job: dict) -> dict:
+    # Um veículo por vez por slot: no máximo BULK_CONCURRENCY chamadas à IA deste job ao mesmo tempo
+    slots = asyncio.Semaphore(BULK_CONCURRENCY)
+    results = {}
+
+    async def regenerate(vehicle_id: int):
+        async with slots:
+            try:
+                await insights.generate_for_vehicle(job["user_id"], vehicle_id)
+                results[vehicle_id] = "ok"
+            except HTTPException as e:
+                results[vehicle_id] = e.detail
+            except Exception as e:
+                results[vehicle_id] = str(e)
+            await _db(_advance, job["id"])
+
+    vehicle_ids = await _db(_user_vehicle_ids, job["user_id"])
+    await asyncio.gather(*(regenerate(vid) for vid in vehicle_ids))
+    return {"vehicles": results}
+
+
+async def run_job(job_id: int):
+    job = await _db(_claim, job_id)
+    if not job:
+        return
+    try:
+        if job["kind"] == "bulk":
+            result = await _run_bulk(job)
+        else:
+            result = await insights.generate_for_vehicle(job["user_id"], job["vehicle_id"])
+        await _db(_finish, job_id, "done", result)
+    except HTTPException as e:
+        await _db(_finish, job_id, "failed", None, str(e.detail))
+    except Exception as e:
+        await _db(_finish, job_id, "failed", None, str(e))
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await run_job(job_id)
+        except Exception:
+            logger.exception("Erro no job de insights %s", job_id)
+        finally:
+            _queue.task_done()
+
+
+def _pending_ids(queue) -> list:
+    ids = []
+    while queue is not None and not queue.empty():
+        ids.append(queue.get_nowait())
+    return ids
+
+
+def _ensure_workers():
+    global _queue, _workers, _loop
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        # Outro event loop (ex.: a API reiniciou no mesmo processo): fila e workers antigos não servem
+        # mais, mas os ids que estavam esperando passam para a nova fila
+        pending = _pending_ids(_queue)
+        _loop, _queue, _workers = loop, asyncio.Queue(), []
+        for job_id in pending:
+            _queue.put_nowait(job_id)
+    # Repõe só os workers que terminaram (cancelados ou com erro); a fila continua a mesma
+    _workers = [w for w in _workers if not w.done()]
+    _workers += [loop.create_task(_worker()) for _ in range(JOB_WORKERS - len(_workers))]
+
+
+def submit(job_id: int):
+    _ensure_workers()
+    _queue.put_nowait(job_id)
+
+
+async def start():
+    # Sobe os workers e retoma os jobs que ficaram na fila (ex.: após reiniciar a API);
+    # um id que já estava na fila em memória não é repetido
+    _ensure_workers()
+    queued = set(_pending_ids(_queue))
+    for job_id in sorted(queued | set(await _db(_queued_job_ids))):
+        _queue.put_nowait(job_id)
+
+
+async def stop():
+    global _workers
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers = []
@@ -1,45 +1,59 @@
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, File, Query, Request, Response, UploadFile
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
-from typing import List, Optional
-from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
+from datetime import date, datetime, timedelta
+from typing import Annotated, Any, Dict, List, Optional, Union
+from pydantic import BaseModel, BeforeValidator
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from sqlalchemy.exc import IntegrityError
 import os
 import json
+import math
+import base64
+import io
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
 import models
 import ai_service
-from database import SessionLocal, engine
+import alerts
+import analysis
+import catalog
+import cleanup
+import exporter
+import history
+import importer
+import insights
+import jobs
+import metrics
+import normalizer
+import ratelimit
+import rollups
+import sync
+import versions
+from cache import TTLCache
+import database
+from database import SessionLocal, AsyncSessionLocal
 
-# Cria as tabelas
-models.Base.metadata.create_all(bind=engine)
+# O esquema é criado/atualizado fora do processo da API: python migrations.py
 
-# Auto-migration para adicionar colunas faltantes em bancos antigos (como os de produção)
-from sqlalchemy import text
-with engine.connect() as conn:
-    try:
-        conn.execute(text("ALTER TABLE users ADD COLUMN created_at DATETIME;"))
-        conn.execute(text("UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;"))
-        conn.commit()
-    except Exception:
-        pass # Coluna já existe
-
-    try:
-        conn.execute(text("ALTER TABLE users ADD COLUMN last_login DATETIME;"))
-        conn.commit()
-    except Exception:
-        pass # Coluna já existe
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers da fila de insights vivem junto com o processo da API
+    await jobs.start()
+    yield
+    await jobs.stop()
 
-app = FastAPI(title="ManutenCar API")
+# Respostas JSON serializadas com orjson
+app = FastAPI(title="ManutenCar API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = ["*"]
 
@@ -52,17 +66,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Latência por rota, consultas SQL por requisição e cabeçalho Server-Timing (ver metrics.py)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engines(database.engine, database.async_engine.sync_engine)
+
 # Montar arquivos estáticos
 app.mount("/static", StaticFiles(directory="."), name="static")
 
 # Rota de teste
-@app.get("/health")
+@app.get("/health", response_model=Dict[str, str])
 async def health_check():
     return {"status": "ok"}
 
 # Configuração de Segurança (Simplificada para o exemplo)
 SECRET_KEY = "sua_chave_secreta_super_segura"
 ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", str(7 * 24 * 60)))
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -74,7 +93,20 @@ def get_db():
     finally:
         db.close()
 
+# Sessão assíncrona: rotas async def não ocupam uma thread do pool durante o acesso ao banco
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # --- Schemas Pydantic ---
+def parse_day_or_datetime(value):
+    # "AAAA-MM-DD" vira date (o dia inteiro); valores com hora continuam datetime
+    if isinstance(value, str) and len(value.strip()) == 10:
+        return date.fromisoformat(value.strip())
+    return value
+
+DayOrDateTime = Annotated[Union[datetime, date], BeforeValidator(parse_day_or_datetime)]
+
 class VehicleCreate(BaseModel):
     make: str
     model: str
@@ -140,25 +172,359 @@ class UserConfigResponse(BaseModel):
 class NormalizeRequest(BaseModel):
     maintenance_names: List[str]
 
+class MaintenanceTypeMerge(BaseModel):
+    target_id: int
+    source_ids: List[int]
+    name: Optional[str] = None
+
+class Principal(BaseModel):
+    # Dados mínimos do usuário autenticado, mantidos em cache entre requisições
+    id: int
+    name: Optional[str] = None
+    email: str
+    token_version: int = 0
+
+# --- Schemas de resposta ---
+# Só os campos que o frontend usa: a resposta é validada e serializada pelo Pydantic (sem o
+# jsonable_encoder percorrendo objetos do SQLAlchemy) e nunca expõe colunas internas.
+class MessageResponse(BaseModel):
+    msg: str
+
+class TokenResponse(BaseModel):
+    access_token: str
+    token_type: str
+
+class UserResponse(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: str
+
+class UserUpdateResponse(UserResponse):
+    access_token: Optional[str] = None
+
+class MaintenanceTypeResponse(BaseModel):
+    id: int
+    name: str
+    default_interval_km: Optional[int] = None
+    default_interval_months: Optional[int] = None
+    description: Optional[str] = None
+
+class TypeCluster(BaseModel):
+    type_ids: List[int]
+    names: List[str]
+    target_id: int
+    suggested_name: str
+    score: float
+    confidence: str
+
+class DuplicateTypesResponse(BaseModel):
+    clusters: List[TypeCluster]
+
+class MergeResponse(MessageResponse):
+    target_id: int
+    moved_logs: int
+    removed_type_ids: List[int]
+
+class VehicleResponse(BaseModel):
+    id: int
+    make: Optional[str] = None
+    model: Optional[str] = None
+    year: Optional[int] = None
+    current_km: Optional[int] = None
+    license_plate: Optional[str] = None
+
+class VehicleAlert(BaseModel):
+    type: str
+    msg: str
+
+class VehicleWithAlertsResponse(VehicleResponse):
+    total_maintenance_cost: float
+    alerts: List[VehicleAlert]
+
+class CategoryTotal(BaseModel):
+    total: float
+    count: int
+
+class LastServiceItem(BaseModel):
+    maintenance_type_id: int
+    maintenance_type: str
+    last_date: Optional[datetime] = None
+    last_km: Optional[int] = None
+    next_due_km: Optional[int] = None
+    next_due_date: Optional[datetime] = None
+
+class ProjectionItem(BaseModel):
+    type: str
+    next_km: Optional[int] = None
+    next_date: Optional[datetime] = None
+    estimated_cost: float
+
+class MonthlyProjectionItem(BaseModel):
+    month: str
+    maintenances: List[str]
+    total_cost: float
+
+class VehicleAnalysisResponse(BaseModel):
+    log_count: int
+    km_driven: int
+    monthly_km: float
+    costs_by_category: Dict[str, float]
+    avg_costs: Dict[str, float]
+    category_totals: Dict[str, CategoryTotal]
+    total_spent: float
+    total_spent_6_months: float
+    total_spent_3_months: float
+    last_services: List[LastServiceItem]
+    future_projections: List[ProjectionItem]
+    monthly_projection: List[MonthlyProjectionItem]
+
+class MaintenanceAddedResponse(MessageResponse):
+    next_due_km: int
+
+class ImportErrorItem(BaseModel):
+    line: Optional[int] = None
+    error: str
+
+class ImportResponse(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ImportErrorItem]
+    vehicles: Dict[int, int]  # veículo -> quilometragem atual
+
+class MaintenanceLogResponse(BaseModel):
+    id: int
+    vehicle_id: int
+    maintenance_type_id: Optional[int] = None
+    date_performed: Optional[datetime] = None
+    km_performed: Optional[int] = None
+    notes: Optional[str] = None
+    service_cost: Optional[float] = None
+    product_cost: Optional[float] = None
+    category: str
+
+class HistoryItem(BaseModel):
+    id: int
+    maintenance_type_id: Optional[int] = None
+    maintenance_type: str
+    date_performed: Optional[datetime] = None
+    km_performed: Optional[int] = None
+    notes: Optional[str] = None
+    service_cost: Optional[float] = None
+    product_cost: Optional[float] = None
+    category: str
+
+class HistoryPageResponse(BaseModel):
+    items: List[HistoryItem]
+    next_cursor: Optional[str] = None
+
+class SyncVehicle(VehicleResponse):
+    updated_at: Optional[datetime] = None
+
+class SyncMaintenanceType(MaintenanceTypeResponse):
+    updated_at: Optional[datetime] = None
+
+class SyncMaintenanceLog(MaintenanceLogResponse):
+    updated_at: Optional[datetime] = None
+
+class SyncDeleted(BaseModel):
+    vehicles: List[int]
+    maintenance_types: List[int]
+    maintenance_logs: List[int]
+
+class SyncResponse(BaseModel):
+    cursor: int
+    full: bool
+    vehicles: List[SyncVehicle]
+    maintenance_types: List[SyncMaintenanceType]
+    maintenance_logs: List[SyncMaintenanceLog]
+    deleted: SyncDeleted
+
+class MonthlyBreakdown(BaseModel):
+    service_cost: float
+    product_cost: float
+    count: int
+
+class MonthlyStatsItem(BaseModel):
+    month: str
+    service_cost: float
+    product_cost: float
+    count: int
+    sort_key: str
+    by_vehicle: Optional[Dict[int, MonthlyBreakdown]] = None
+    by_category: Optional[Dict[str, MonthlyBreakdown]] = None
+
+class GlobalStatsResponse(BaseModel):
+    total_users: int
+    avg_usage_days: float
+    last_usage_time: Optional[datetime] = None
+    ai_users_count: int
+    avg_vehicles_per_user: float
+    total_vehicles: int
+    insights_cache: Dict[str, int]
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    vehicle_id: Optional[int] = None
+    status: str
+    progress: int
+    total: int
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class VehicleInsightsResponse(BaseModel):
+    chronic_issues: List[Any]
+    suggested_maintenance: List[Any]
+    generated_at: Optional[datetime] = None
+    job: Optional[JobResponse] = None
+
 
 # --- Funções Auxiliares ---
+# Cache do usuário autenticado: a maioria das requisições não consulta a tabela users.
+# Em vários workers, uma troca de senha/e-mail leva até PRINCIPAL_CACHE_TTL segundos para valer nos demais.
+principal_cache = TTLCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+)
+
+# Limite das rotas de IA: token bucket por usuário e por provedor, rejeitando rajadas com 429 + Retry-After
+ai_user_limiter = ratelimit.RateLimiter(
+    capacity=float(os.getenv("AI_USER_BURST", "5")),
+    per_minute=float(os.getenv("AI_USER_PER_MINUTE", "10"))
+)
+ai_provider_limiter = ratelimit.RateLimiter(
+    capacity=float(os.getenv("AI_PROVIDER_BURST", "60")),
+    per_minute=float(os.getenv("AI_PROVIDER_PER_MINUTE", "300"))
+)
+
+def enforce_ai_rate_limit(user_id: int, provider: str):
+    retry_after = ratelimit.acquire((ai_user_limiter, user_id), (ai_provider_limiter, provider))
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Muitas solicitações à IA. Aguarde alguns instantes e tente novamente.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
 def create_access_token(data: dict):
     to_encode = data.copy()
+    to_encode["exp"] = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def create_user_token(user: models.User) -> str:
+    # O token carrega o id e a versão de credenciais; trocar e-mail/senha invalida os anteriores
+    return create_access_token(data={"sub": str(user.id), "ver": user.token_version or 0})
+
+def token_claims(token: str) -> tuple:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Credenciais inválidas")
-    except JWTError:
+        user_id = int(payload.get("sub"))
+        version = int(payload.get("ver", 0))
+    except (JWTError, TypeError, ValueError):
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
-    user = db.query(models.User).filter(models.User.email == email).first()
+    return user_id, version
+
+def cached_principal(user_id: int, version: int) -> Optional[Principal]:
+    principal = principal_cache.get(user_id)
+    if principal is not None and principal.token_version == version:
+        return principal
+    return None
+
+def remember_principal(user: Optional[models.User], version: int) -> Principal:
     if user is None:
         raise HTTPException(status_code=401, detail="Usuário não encontrado")
-    return user
+    if (user.token_version or 0) != version:
+        raise HTTPException(status_code=401, detail="Sessão expirada, faça login novamente")
+    principal = Principal(id=user.id, name=user.name, email=user.email, token_version=user.token_version or 0)
+    principal_cache.set(user.id, principal)
+    return principal
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user_id, version = token_claims(token)
+    principal = cached_principal(user_id, version)
+    if principal is None:
+        principal = remember_principal(db.get(models.User, user_id), version)
+    return principal
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    user_id, version = token_claims(token)
+    principal = cached_principal(user_id, version)
+    if principal is None:
+        principal = remember_principal(await db.get(models.User, user_id), version)
+    return principal
+
+def encode_history_cursor(date_performed: datetime, log_id: int) -> str:
+    # Cursor opaco para paginação por chave (date_performed, id)
+    raw = f"{date_performed.isoformat() if date_performed else ''}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_str, log_id = raw.rsplit("|", 1)
+        return (datetime.fromisoformat(date_str) if date_str else None), int(log_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido")
+
+def load_type_names(db: Session, owner_id: int) -> tuple:
+    # ({id: nome}, {id: quantidade de registros}) dos tipos do usuário, em duas consultas
+    visible = catalog.visible_types(owner_id).with_only_columns(models.MaintenanceType.id, models.MaintenanceType.name)
+    names = dict(db.execute(visible).all())
+    usage = dict(db.query(models.MaintenanceLog.maintenance_type_id, func.count(models.MaintenanceLog.id))
+                 .join(models.Vehicle, models.Vehicle.id == models.MaintenanceLog.vehicle_id)
+                 .filter(models.Vehicle.owner_id == owner_id)
+                 .group_by(models.MaintenanceLog.maintenance_type_id).all())
+    return names, usage
+
+def load_history_page(
+    db: Session,
+    owner_id: int,
+    vehicle_id: int,
+    limit: int,
+    cursor: Optional[str],
+    category: Optional[str],
+    maintenance_type_id: Optional[int],
+    date_from: Optional[date],
+    date_to: Optional[date],
+    km_min: Optional[int],
+    km_max: Optional[int]
+):
+    vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == owner_id).first()
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Veículo não encontrado")
+    if limit < 1 or limit > 500:
+        raise HTTPException(status_code=400, detail="O limite deve estar entre 1 e 500")
+
+    after = decode_history_cursor(cursor) if cursor else None
+    query = history.history_query(
+        vehicle_id, category, maintenance_type_id, date_from, date_to, km_min, km_max, after
+    )
+    rows = db.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for db_log, m_type_name in rows:
+        items.append({
+            "id": db_log.id,
+            "maintenance_type_id": db_log.maintenance_type_id,
+            "maintenance_type": m_type_name or "Tipo Desconhecido",
+            "date_performed": db_log.date_performed,
+            "km_performed": db_log.km_performed,
+            "notes": db_log.notes,
+            "service_cost": db_log.service_cost,
+            "product_cost": db_log.product_cost,
+            "category": db_log.category
+        })
+
+    next_cursor = None
+    if has_more:
+        last_log = rows[-1][0]
+        next_cursor = encode_history_cursor(last_log.date_performed, last_log.id)
+    return {"items": items, "next_cursor": next_cursor}
 
 def send_email_alert(email: str, message: str):
     # Simulação de envio de email
@@ -166,7 +532,7 @@ def send_email_alert(email: str, message: str):
 
 # --- Rotas ---
 
-@app.post("/register")
+@app.post("/register", response_model=MessageResponse)
 def register(user: UserCreate, db: Session = Depends(get_db)):
     try:
         # 1. Verificar se o e-mail já existe
@@ -180,30 +546,8 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         hashed_pw = pwd_context.hash(user.password)
         db_user = models.User(name=user.name, email=user.email, hashed_password=hashed_pw)
         db.add(db_user)
-        db.flush() # Obtém o ID sem commitar
-        
-        # 3. Seed personal maintenance types (na mesma transação)
-        defaults = [
-            {"name": "Troca de Óleo do Motor", "km": 10000, "months": 12},
-            {"name": "Filtro de Óleo", "km": 10000, "months": 12},
-            {"name": "Filtro de Ar", "km": 20000, "months": 24},
-            {"name": "Filtro de Combustível", "km": 20000, "months": 24},
-            {"name": "Pastilhas de Freio", "km": 30000, "months": 36},
-            {"name": "Fluido de Freio", "km": 40000, "months": 24},
-            {"name": "Líquido de Arrefecimento", "km": 40000, "months": 24},
-            {"name": "Óleo de Câmbio (Manual)", "km": 100000, "months": 60},
-            {"name": "Correia Dentada", "km": 60000, "months": 48},
-            {"name": "Velas de Ignição", "km": 50000, "months": 48},
-        ]
-        for item in defaults:
-            mt = models.MaintenanceType(
-                name=item["name"], 
-                default_interval_km=item["km"], 
-                default_interval_months=item["months"],
-                user_id=db_user.id
-            )
-            db.add(mt)
         
+        # 3. Tipos de manutenção padrão vêm do catálogo global (catalog.py): nada a copiar
         db.commit()
         return {"msg": "Usuário criado"}
         
@@ -221,7 +565,7 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         print(f"ERRO NO REGISTRO: {e}")
         raise HTTPException(status_code=500, detail=f"Ocorreu um erro interno: {e}")
 
-@app.post("/token")
+@app.post("/token", response_model=TokenResponse)
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     from sqlalchemy import func
     email_clean = form_data.username.strip().lower()
@@ -232,79 +576,88 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     user.last_login = datetime.utcnow()
     db.commit()
     
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.get("/me")
-def get_current_user_info(current_user: models.User = Depends(get_current_user)):
+@app.get("/me", response_model=UserResponse)
+def get_current_user_info(current_user: Principal = Depends(get_current_user)):
     return {"id": current_user.id, "name": current_user.name, "email": current_user.email}
 
-@app.put("/me")
-def update_current_user(user_update: UserUpdate, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.put("/me", response_model=UserUpdateResponse)
+def update_current_user(user_update: UserUpdate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    db_user = db.get(models.User, current_user.id)
+    credentials_changed = False
     if user_update.name is not None:
-        current_user.name = user_update.name
-    if user_update.email is not None:
+        db_user.name = user_update.name
+    if user_update.email is not None and user_update.email != db_user.email:
         # Check if email is already taken
         from sqlalchemy import func
         email_clean = user_update.email.strip().lower()
         existing = db.query(models.User).filter(func.lower(models.User.email) == email_clean, models.User.id != current_user.id).first()
         if existing:
             raise HTTPException(status_code=400, detail="Este e-mail já está em uso.")
-        current_user.email = user_update.email
+        db_user.email = user_update.email
+        credentials_changed = True
     if user_update.password is not None:
-        current_user.hashed_password = pwd_context.hash(user_update.password)
+        db_user.hashed_password = pwd_context.hash(user_update.password)
+        credentials_changed = True
+    if credentials_changed:
+        # Invalida os tokens emitidos antes da troca de e-mail/senha
+        db_user.token_version = (db_user.token_version or 0) + 1
+    versions.touch_user(db, db_user.id)
     db.commit()
-    db.refresh(current_user)
-    return {"id": current_user.id, "name": current_user.name, "email": current_user.email}
+    db.refresh(db_user)
+    principal_cache.pop(db_user.id)
+    return {
+        "id": db_user.id,
+        "name": db_user.name,
+        "email": db_user.email,
+        "access_token": create_user_token(db_user) if credentials_changed else None
+    }
 
-@app.delete("/me")
-def delete_current_user(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Deletar todos os dados associados
-    # 1. Veículos (que deletarão logs devido à relação)
-    vehicles = db.query(models.Vehicle).filter(models.Vehicle.owner_id == current_user.id).all()
-    for v in vehicles:
-        db.query(models.MaintenanceLog).filter(models.MaintenanceLog.vehicle_id == v.id).delete()
-        db.delete(v)
-    
-    # 2. Tipos de manutenção
-    db.query(models.MaintenanceType).filter(models.MaintenanceType.user_id == current_user.id).delete()
-    
-    # 3. O próprio usuário
-    db.delete(current_user)
+@app.delete("/me", response_model=MessageResponse)
+def delete_current_user(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    # Deletar todos os dados associados em lote, numa única transação (ver cleanup.py)
+    cleanup.delete_user(db, current_user.id)
     db.commit()
+    principal_cache.pop(current_user.id)
     return {"msg": "Conta excluída com sucesso"}
 
-@app.get("/users")
-def get_users(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/users", response_model=List[UserResponse])
+def get_users(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    # Lista de contas é administrativa: mesmo token do dashboard global
+    require_dashboard_token(token)
     return db.query(models.User).all()
 
-@app.get("/maintenance-types")
-def get_maintenance_types(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(models.MaintenanceType).filter(models.MaintenanceType.user_id == user.id).order_by(models.MaintenanceType.name).all()
+@app.get("/maintenance-types", response_model=List[MaintenanceTypeResponse])
+async def get_maintenance_types(request: Request, response: Response, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    not_modified = versions.conditional(request, response, await db.run_sync(versions.user_etag, user.id))
+    if not_modified:
+        return not_modified
+    # Catálogo global + tipos próprios/personalizados, resolvidos em uma consulta
+    result = await db.execute(catalog.visible_types(user.id).order_by(models.MaintenanceType.name))
+    return result.scalars().all()
 
-@app.post("/maintenance-types")
-def create_maintenance_type(mt: MaintenanceTypeCreate, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    existing = db.query(models.MaintenanceType).filter(
-        models.MaintenanceType.name == mt.name,
-        models.MaintenanceType.user_id == user.id
-    ).first()
+@app.post("/maintenance-types", response_model=MaintenanceTypeResponse)
+def create_maintenance_type(mt: MaintenanceTypeCreate, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    existing = db.scalars(catalog.visible_types(user.id).where(models.MaintenanceType.name == mt.name)).first()
     if existing:
         raise HTTPException(status_code=400, detail="Tipo de manutenção já existe para este usuário")
     db_mt = models.MaintenanceType(**mt.dict(), user_id=user.id)
     db.add(db_mt)
+    versions.touch_user(db, user.id)
     db.commit()
     db.refresh(db_mt)
     return db_mt
 
 
-@app.put("/maintenance-types/{mt_id}")
-def update_maintenance_type(mt_id: int, mt_update: MaintenanceTypeUpdate, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db_mt = db.query(models.MaintenanceType).filter(
-        models.MaintenanceType.id == mt_id,
-        models.MaintenanceType.user_id == user.id
-    ).first()
+@app.put("/maintenance-types/{mt_id}", response_model=MaintenanceTypeResponse)
+def update_maintenance_type(mt_id: int, mt_update: MaintenanceTypeUpdate, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    db_mt = catalog.get_visible_type(db, user.id, mt_id)
     if not db_mt:
         raise HTTPException(status_code=404, detail="Tipo de manutenção não encontrado")
+    # Tipo do catálogo: a alteração vale só para este usuário (cópia própria)
+    db_mt = catalog.materialize(db, user.id, db_mt)
     
     if mt_update.name is not None:
         db_mt.name = mt_update.name
@@ -314,42 +667,113 @@ def update_maintenance_type(mt_id: int, mt_update: MaintenanceTypeUpdate, user:
         db_mt.default_interval_months = mt_update.default_interval_months
     if mt_update.description is not None:
         db_mt.description = mt_update.description
-        
+
+    # Intervalos alterados: atualiza os vencimentos da projeção na mesma transação
+    if mt_update.default_interval_km is not None or mt_update.default_interval_months is not None:
+        rollups.refresh_next_due_for_type(db, db_mt)
+    # Nome/intervalos aparecem no histórico e na análise de todos os veículos
+    versions.touch_vehicles(db, user.id)
     db.commit()
     db.refresh(db_mt)
     return db_mt
 
 
-@app.delete("/maintenance-types/{mt_id}")
-def delete_maintenance_type(mt_id: int, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    mt = db.query(models.MaintenanceType).filter(
-        models.MaintenanceType.id == mt_id,
-        models.MaintenanceType.user_id == user.id
-    ).first()
+@app.delete("/maintenance-types/{mt_id}", response_model=MessageResponse)
+def delete_maintenance_type(mt_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    mt = catalog.get_visible_type(db, user.id, mt_id)
     if not mt:
         raise HTTPException(status_code=404, detail="Tipo de manutenção não encontrado")
 
-    # Verifica se existem logs de manutenção referenciando este tipo
-    linked = db.query(models.MaintenanceLog).filter(models.MaintenanceLog.maintenance_type_id == mt_id).first()
+    # Verifica se existem logs de manutenção (dos veículos do usuário) referenciando este tipo
+    linked = db.query(models.MaintenanceLog.id)\
+        .join(models.Vehicle, models.Vehicle.id == models.MaintenanceLog.vehicle_id)\
+        .filter(models.MaintenanceLog.maintenance_type_id == mt_id, models.Vehicle.owner_id == user.id)\
+        .first()
     if linked:
         raise HTTPException(status_code=400, detail="Não é possível remover: existem registros de manutenção ligados a este tipo")
 
-    db.delete(mt)
+    catalog.hide(db, user.id, mt)
+    versions.touch_user(db, user.id)
     db.commit()
     return {"msg": "Tipo de manutenção removido"}
 
-@app.post("/vehicles")
-def create_vehicle(vehicle: VehicleCreate, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/maintenance-types/duplicates", response_model=DuplicateTypesResponse)
+async def find_duplicate_types(use_ai: bool = False, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    # Grupos de tipos com nomes equivalentes, calculados localmente. Com use_ai=true, os grupos
+    # ambíguos vão para a IA em uma única chamada (confirmados viram "ai", rejeitados são descartados).
+    names, usage = await db.run_sync(load_type_names, user.id)
+    clusters = normalizer.find_clusters(names, usage)
+    ambiguous = [c for c in clusters if c["confidence"] == "ambiguous"]
+
+    if use_ai and ambiguous:
+        provider, encrypted_key = await db.run_sync(insights.load_ai_config, user.id)
+        await db.rollback()
+        enforce_ai_rate_limit(user.id, provider)
+        reviews = await ai_service.review_name_clusters(ambiguous, provider, encrypted_key, user_id=user.id)
+        for review in reviews:
+            cluster = ambiguous[review["index"]]
+            if review.get("same_service"):
+                cluster["confidence"] = "ai"
+                if review.get("normalized_name"):
+                    cluster["suggested_name"] = str(review["normalized_name"]).strip()
+            else:
+                cluster["confidence"] = "rejected"
+        clusters = [c for c in clusters if c["confidence"] != "rejected"]
+
+    return {"clusters": clusters}
+
+@app.post("/maintenance-types/merge", response_model=MergeResponse)
+def merge_maintenance_types(merge: MaintenanceTypeMerge, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    # Une vários tipos em um só: os registros passam para o tipo destino e os demais são removidos (uma transação)
+    source_ids = set(merge.source_ids) - {merge.target_id}
+    if not source_ids:
+        raise HTTPException(status_code=400, detail="Informe ao menos um tipo para mesclar.")
+    all_ids = source_ids | {merge.target_id}
+    m_types = db.scalars(catalog.visible_types(user.id).where(models.MaintenanceType.id.in_(all_ids))).all()
+    if len(m_types) != len(all_ids):
+        raise HTTPException(status_code=404, detail="Tipo de manutenção não encontrado")
+    target = next(mt for mt in m_types if mt.id == merge.target_id)
+    if merge.name and merge.name.strip() and merge.name.strip() != target.name:
+        # Renomear um tipo do catálogo cria a cópia própria do usuário
+        target = catalog.materialize(db, user.id, target)
+        target.name = merge.name.strip()
+
+    # Só os registros e projeções dos veículos do usuário (tipos do catálogo são compartilhados)
+    log = models.MaintenanceLog
+    own_vehicles = select(models.Vehicle.id).where(models.Vehicle.owner_id == user.id)
+    vehicle_ids = [row[0] for row in db.query(log.vehicle_id)
+                   .filter(log.maintenance_type_id.in_(source_ids), log.vehicle_id.in_(own_vehicles)).distinct().all()]
+    moved = db.query(log).filter(log.maintenance_type_id.in_(source_ids), log.vehicle_id.in_(own_vehicles))\
+        .update({log.maintenance_type_id: target.id}, synchronize_session=False)
+
+    # Projeção last_service: some com os tipos removidos e é recalculada para o destino
+    db.query(models.LastService)\
+        .filter(models.LastService.maintenance_type_id.in_(source_ids), models.LastService.vehicle_id.in_(own_vehicles))\
+        .delete(synchronize_session=False)
+    for mt in m_types:
+        if mt.id in source_ids:
+            catalog.hide(db, user.id, mt)
+    db.flush()
+    for vehicle_id in vehicle_ids:
+        rollups.refresh_last_service(db, vehicle_id, target.id)
+    versions.touch_vehicles(db, user.id)
+
+    db.commit()
+    return {"msg": "Tipos de manutenção mesclados", "target_id": target.id, "moved_logs": moved, "removed_type_ids": sorted(source_ids)}
+
+@app.post("/vehicles", response_model=VehicleResponse)
+def create_vehicle(vehicle: VehicleCreate, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     data = vehicle.dict()
     data['license_plate'] = data['license_plate'].upper()
     db_vehicle = models.Vehicle(**data, owner_id=user.id)
     db.add(db_vehicle)
+    versions.touch_user(db, user.id)
     db.commit()
     db.refresh(db_vehicle)
     return db_vehicle
 
-@app.put("/vehicles/{vehicle_id}")
-def update_vehicle(vehicle_id: int, vehicle: VehicleUpdate, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.put("/vehicles/{vehicle_id}", response_model=VehicleResponse)
+def update_vehicle(vehicle_id: int, vehicle: VehicleUpdate, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     db_vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
     if not db_vehicle:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
@@ -359,95 +783,68 @@ def update_vehicle(vehicle_id: int, vehicle: VehicleUpdate, user: models.User =
     db_vehicle.year = vehicle.year
     db_vehicle.current_km = vehicle.current_km
     db_vehicle.license_plate = vehicle.license_plate.upper()
-    
+    versions.touch_vehicles(db, user.id, [vehicle_id])
     db.commit()
     db.refresh(db_vehicle)
     return db_vehicle
 
-@app.delete("/vehicles/{vehicle_id}")
-def delete_vehicle(vehicle_id: int, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.delete("/vehicles/{vehicle_id}", response_model=MessageResponse)
+def delete_vehicle(vehicle_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     db_vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
     if not db_vehicle:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
     
-    # Deleta logs associados (ou o banco cuidaria se houvesse cascade, mas vamos garantir)
-    db.query(models.MaintenanceLog).filter(models.MaintenanceLog.vehicle_id == vehicle_id).delete()
-    
-    db.delete(db_vehicle)
+    # Logs, insights, jobs e projeções saem junto, em lote
+    cleanup.delete_vehicles(db, [vehicle_id])
+    sync.record_deletions(db, user.id, "vehicle", [vehicle_id])
+    versions.touch_user(db, user.id)
     db.commit()
     return {"msg": "Veículo removido com sucesso"}
 
-@app.get("/vehicles")
-def get_vehicles(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Aqui calculamos o status de alerta para cada veículo
-    vehicles = db.query(models.Vehicle).filter(models.Vehicle.owner_id == user.id).all()
-    results = []
-    
-    for v in vehicles:
-        alerts = []
-        # Verifica cada tipo de manutenção DO USUÁRIO
-        m_types = db.query(models.MaintenanceType).filter(models.MaintenanceType.user_id == user.id).all()
-        for mt in m_types:
-            # Pega a última manutenção deste tipo para este carro
-            last_log = db.query(models.MaintenanceLog)\
-                .filter(models.MaintenanceLog.vehicle_id == v.id, models.MaintenanceLog.maintenance_type_id == mt.id)\
-                .order_by(models.MaintenanceLog.date_performed.desc())\
-                .first()
-            
-            status_msg = "OK"
-            is_due = False
-            
-            if last_log:
-                next_km = (last_log.km_performed or 0) + (mt.default_interval_km or 0)
-                # Garantir que temos um intervalo de meses válido
-                interval_months = mt.default_interval_months if mt.default_interval_months is not None else 12
-                next_date = last_log.date_performed + timedelta(days=interval_months * 30)
-                
-                # Forçar comparação com datetime naive (SQLite armazena sem fuso)
-                now = datetime.utcnow()
-                if v.current_km >= next_km:
-                    is_due = True
-                    status_msg = f"Vencido por KM (Próx: {next_km}km)"
-                elif now >= next_date:
-                    is_due = True
-                    status_msg = f"Vencido por Tempo (Próx: {next_date.date()})"
-            else:
-                # Nunca fez manutenção, considera pendente se o carro já rodou muito?
-                # Para simplificar, vamos considerar OK até o primeiro registro ou marcar como "Nunca realizado"
-                status_msg = "Nunca registrado"
-            
-            if is_due:
-                alerts.append({"type": mt.name, "msg": status_msg})
-        
-        # Garantir que total_cost seja calculado de forma segura
-        total_cost = 0.0
-        for l in v.maintenance_logs:
-            s_cost = l.service_cost if l.service_cost is not None else 0.0
-            p_cost = l.product_cost if l.product_cost is not None else 0.0
-            total_cost += (s_cost + p_cost)
-
-        results.append({
-            "id": v.id,
-            "make": v.make,
-            "model": v.model,
-            "current_km": v.current_km,
-            "license_plate": v.license_plate,
-            "total_maintenance_cost": total_cost,
-            "alerts": alerts
-        })
-    return results
+@app.get("/vehicles", response_model=List[VehicleWithAlertsResponse])
+async def get_vehicles(request: Request, response: Response, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    not_modified = versions.conditional(request, response, await db.run_sync(versions.user_etag, user.id, True))
+    if not_modified:
+        return not_modified
+    # Status de alerta de toda a frota calculado em lote (número fixo de consultas)
+    return await db.run_sync(alerts.vehicles_with_alerts, user.id)
 
-@app.post("/vehicles/{vehicle_id}/maintenance")
+@app.get("/vehicles/{vehicle_id}", response_model=VehicleWithAlertsResponse)
+def get_vehicle(vehicle_id: int, request: Request, response: Response, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    not_modified = versions.conditional(request, response, versions.vehicle_etag(db, user.id, vehicle_id, daily=True))
+    if not_modified:
+        return not_modified
+    # Mesmo payload de GET /vehicles, mas apenas para um veículo
+    results = alerts.vehicles_with_alerts(db, user.id, vehicle_id=vehicle_id)
+    if not results:
+        raise HTTPException(status_code=404, detail="Veículo não encontrado")
+    return results[0]
+
+@app.get("/vehicles/{vehicle_id}/analysis", response_model=VehicleAnalysisResponse)
+def get_vehicle_analysis(vehicle_id: int, request: Request, response: Response, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    not_modified = versions.conditional(request, response, versions.vehicle_etag(db, user.id, vehicle_id, daily=True))
+    if not_modified:
+        return not_modified
+    vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Veículo não encontrado")
+    return analysis.vehicle_analysis(db, vehicle_id)
+
+@app.post("/vehicles/{vehicle_id}/maintenance", response_model=MaintenanceAddedResponse)
 def add_maintenance(
     vehicle_id: int, 
     log: MaintenanceLogCreate, 
     background_tasks: BackgroundTasks,
-    user: models.User = Depends(get_current_user), 
+    user: Principal = Depends(get_current_user), 
     db: Session = Depends(get_db)
 ):
     vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
     if not vehicle:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
+    # Id do catálogo já personalizado vira o id da personalização; tipos de outros usuários ou ocultos não valem
+    type_id = catalog.resolve_type_id(db, user.id, log.maintenance_type_id)
+    if not catalog.get_visible_type(db, user.id, type_id):
+        raise HTTPException(status_code=404, detail="Tipo de manutenção não encontrado")
     
     # 1. Atualiza a quilometragem do veículo se a da manutenção for maior
     if log.km_performed > vehicle.current_km:
@@ -455,12 +852,15 @@ def add_maintenance(
     
     # 2. Registra a manutenção
     db_log = models.MaintenanceLog(**log.dict(), vehicle_id=vehicle_id)
+    db_log.maintenance_type_id = type_id
     db.add(db_log)
+    rollups.refresh_for_logs(db, [rollups.log_key(db_log)])
+    versions.touch_vehicles(db, user.id, [vehicle_id])
     db.commit()
     
     # 3. Verifica se precisa enviar email de alerta sobre PRÓXIMAS manutenções (Lógica simplificada)
     # Exemplo: Se trocou óleo agora, avisa quando será a próxima
-    mt = db.query(models.MaintenanceType).filter(models.MaintenanceType.id == log.maintenance_type_id).first()
+    mt = db.query(models.MaintenanceType).filter(models.MaintenanceType.id == db_log.maintenance_type_id).first()
     interval_km = mt.default_interval_km if mt and mt.default_interval_km is not None else 10000
     next_km = log.km_performed + interval_km
     
@@ -469,34 +869,75 @@ def add_maintenance(
     
     return {"msg": "Manutenção registrada e KM atualizada", "next_due_km": next_km}
 
-@app.get("/vehicles/{vehicle_id}/history")
-def get_vehicle_history(vehicle_id: int, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Veículo não encontrado")
-    
-    logs = db.query(models.MaintenanceLog)\
-        .filter(models.MaintenanceLog.vehicle_id == vehicle_id)\
-        .order_by(models.MaintenanceLog.date_performed.desc())\
-        .all()
-        
-    history = []
-    for log in logs:
-        m_type_name = log.maintenance_type.name if log.maintenance_type else "Tipo Desconhecido"
-        history.append({
-            "id": log.id,
-            "maintenance_type": m_type_name,
-            "date_performed": log.date_performed,
-            "km_performed": log.km_performed,
-            "notes": log.notes,
-            "service_cost": log.service_cost,
-            "product_cost": log.product_cost,
-            "category": log.category
-        })
-    return history
+@app.post("/maintenance-logs/import", response_model=ImportResponse)
+def import_maintenance_logs(
+    file: UploadFile = File(...),
+    vehicle_id: Optional[int] = None,
+    file_format: Optional[str] = Query(None, alias="format"),
+    user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Histórico em lote (CSV/NDJSON); vehicle_id na URL vale para as linhas sem vehicle_id/license_plate
+    fmt = importer.detect_format(file.filename, file_format)
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato inválido. Use csv ou ndjson.")
+    if vehicle_id is not None:
+        vehicle = db.query(models.Vehicle.id).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
+        if not vehicle:
+            raise HTTPException(status_code=404, detail="Veículo não encontrado")
+    text = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    return importer.import_logs(db, user.id, text, fmt, MaintenanceLogCreate, default_vehicle_id=vehicle_id)
+
+@app.get("/export", response_class=StreamingResponse)
+def export_maintenance_logs(
+    file_format: str = Query("csv", alias="format"),
+    vehicle_id: Optional[int] = None,
+    gzip: bool = False,
+    user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Histórico completo (ou de um veículo) em streaming; gzip=true comprime durante o envio
+    if file_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato inválido. Use csv ou ndjson.")
+    if vehicle_id is not None:
+        vehicle = db.query(models.Vehicle.id).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
+        if not vehicle:
+            raise HTTPException(status_code=404, detail="Veículo não encontrado")
+    filename = f"manutencoes.{file_format}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else ("text/csv; charset=utf-8" if file_format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        exporter.stream_export(user.id, file_format, vehicle_id, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/vehicles/{vehicle_id}/history", response_model=HistoryPageResponse)
+async def get_vehicle_history(
+    vehicle_id: int,
+    request: Request,
+    response: Response,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    maintenance_type_id: Optional[int] = None,
+    date_from: Optional[DayOrDateTime] = None,
+    date_to: Optional[DayOrDateTime] = None,
+    km_min: Optional[int] = None,
+    km_max: Optional[int] = None,
+    user: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # O ETag vale por URL: cada página/filtro é revalidado separadamente
+    not_modified = versions.conditional(request, response, await db.run_sync(versions.vehicle_etag, user.id, vehicle_id))
+    if not_modified:
+        return not_modified
+    return await db.run_sync(
+        load_history_page, user.id, vehicle_id, limit, cursor,
+        category, maintenance_type_id, date_from, date_to, km_min, km_max
+    )
 
-@app.put("/maintenance-logs/{log_id}")
-def update_maintenance_log(log_id: int, log_update: MaintenanceLogUpdate, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.put("/maintenance-logs/{log_id}", response_model=MaintenanceLogResponse)
+def update_maintenance_log(log_id: int, log_update: MaintenanceLogUpdate, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Verificar se o log pertence a um veículo do usuário
     db_log = db.query(models.MaintenanceLog)\
         .join(models.Vehicle)\
@@ -506,8 +947,12 @@ def update_maintenance_log(log_id: int, log_update: MaintenanceLogUpdate, user:
     if not db_log:
         raise HTTPException(status_code=404, detail="Log de manutenção não encontrado")
     
+    key_before = rollups.log_key(db_log)
     if log_update.maintenance_type_id is not None:
-        db_log.maintenance_type_id = log_update.maintenance_type_id
+        type_id = catalog.resolve_type_id(db, user.id, log_update.maintenance_type_id)
+        if not catalog.get_visible_type(db, user.id, type_id):
+            raise HTTPException(status_code=404, detail="Tipo de manutenção não encontrado")
+        db_log.maintenance_type_id = type_id
     if log_update.km_performed is not None:
         db_log.km_performed = log_update.km_performed
         # Se alterou o KM, pode ser necessário atualizar o current_km do veículo
@@ -525,13 +970,15 @@ def update_maintenance_log(log_id: int, log_update: MaintenanceLogUpdate, user:
         db_log.product_cost = log_update.product_cost
     if log_update.category is not None:
         db_log.category = log_update.category
-        
+
+    rollups.refresh_for_logs(db, [key_before, rollups.log_key(db_log)])
+    versions.touch_vehicles(db, user.id, [db_log.vehicle_id])
     db.commit()
     db.refresh(db_log)
     return db_log
 
-@app.delete("/maintenance-logs/{log_id}")
-def delete_maintenance_log(log_id: int, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.delete("/maintenance-logs/{log_id}", response_model=MessageResponse)
+def delete_maintenance_log(log_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     db_log = db.query(models.MaintenanceLog)\
         .join(models.Vehicle)\
         .filter(models.MaintenanceLog.id == log_id, models.Vehicle.owner_id == user.id)\
@@ -540,47 +987,41 @@ def delete_maintenance_log(log_id: int, user: models.User = Depends(get_current_
     if not db_log:
         raise HTTPException(status_code=404, detail="Log de manutenção não encontrado")
         
+    key = rollups.log_key(db_log)
     db.delete(db_log)
+    rollups.refresh_for_logs(db, [key])
+    sync.record_deletions(db, user.id, "maintenance_log", [log_id])
+    versions.touch_vehicles(db, user.id, [key[0]])
     db.commit()
     return {"msg": "Log de manutenção removido"}
 
-@app.get("/stats")
-def get_stats(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Busca logs dos últimos 12 meses
-    one_year_ago = datetime.utcnow() - timedelta(days=365)
-    logs = db.query(models.MaintenanceLog)\
-        .join(models.Vehicle)\
-        .filter(models.Vehicle.owner_id == user.id)\
-        .filter(models.MaintenanceLog.date_performed >= one_year_ago)\
-        .all()
-        
-    monthly_data = {}
-    # Inicializa os últimos 12 meses com zero
-    for i in range(12):
-        d = datetime.utcnow() - timedelta(days=30 * i)
-        key = d.strftime("%Y-%m")
-        monthly_data[key] = {"month": d.strftime("%m/%Y"), "service_cost": 0, "product_cost": 0, "count": 0, "sort_key": key}
-        
-    for log in logs:
-        if not log.date_performed:
-            continue
-        key = log.date_performed.strftime("%Y-%m")
-        if key in monthly_data:
-            s_cost = log.service_cost or 0
-            p_cost = log.product_cost or 0
-            monthly_data[key]["service_cost"] += s_cost
-            monthly_data[key]["product_cost"] += p_cost
-            monthly_data[key]["count"] += 1
-            
-    return sorted(monthly_data.values(), key=lambda x: x["sort_key"])
+@app.get("/sync", response_model=SyncResponse)
+async def sync_changes(since: int = 0, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    # Réplica local (apps offline): só veículos, tipos e manutenções alterados/excluídos desde o cursor
+    return await db.run_sync(sync.changes_since, user.id, since)
+
+@app.get("/stats", response_model=List[MonthlyStatsItem], response_model_exclude_unset=True)
+async def get_stats(request: Request, response: Response, months: int = 12, breakdown: Optional[str] = None, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    # Série mensal (calendário) lida do consolidado mensal; breakdown opcional por veículo ou categoria
+    if months < 1 or months > 60:
+        raise HTTPException(status_code=400, detail="O período deve estar entre 1 e 60 meses")
+    if breakdown not in (None, "vehicle", "category"):
+        raise HTTPException(status_code=400, detail="Breakdown inválido (use 'vehicle' ou 'category')")
+    not_modified = versions.conditional(request, response, await db.run_sync(versions.user_etag, user.id, True))
+    if not_modified:
+        return not_modified
+    return await db.run_sync(rollups.monthly_stats, user.id, months=months, breakdown=breakdown)
 
 # --- Rotas de Inteligência Artificial ---
 
-@app.get("/global-stats")
-def get_global_stats(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def require_dashboard_token(token: str):
     expected_token = os.getenv("GLOBAL_DASHBOARD_TOKEN")
     if not expected_token or token != expected_token:
         raise HTTPException(status_code=403, detail="Acesso negado ao dashboard global")
+
+@app.get("/global-stats", response_model=GlobalStatsResponse)
+def get_global_stats(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    require_dashboard_token(token)
     
     total_users = db.query(models.User).count()
     
@@ -613,11 +1054,20 @@ def get_global_stats(token: str = Depends(oauth2_scheme), db: Session = Depends(
         "last_usage_time": last_usage_time,
         "ai_users_count": ai_users_count,
         "avg_vehicles_per_user": avg_vehicles,
-        "total_vehicles": total_vehicles
+        "total_vehicles": total_vehicles,
+        "insights_cache": ai_service.insights_cache_stats()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics(token: str = Depends(oauth2_scheme)):
+    # Formato texto do Prometheus; o coletor se autentica com Authorization: Bearer <METRICS_TOKEN>
+    expected_token = os.getenv("METRICS_TOKEN")
+    if not expected_token or token != expected_token:
+        raise HTTPException(status_code=403, detail="Acesso negado às métricas")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/user-config", response_model=UserConfigResponse)
-def get_user_config(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_config(user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     config = db.query(models.UserConfig).filter(models.UserConfig.user_id == user.id).first()
     if not config:
         return {"llm_provider": None, "has_api_key": False}
@@ -626,8 +1076,8 @@ def get_user_config(user: models.User = Depends(get_current_user), db: Session =
         "has_api_key": bool(config.llm_api_key_encrypted)
     }
 
-@app.post("/user-config")
-def update_user_config(config_update: UserConfigUpdate, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.post("/user-config", response_model=MessageResponse)
+def update_user_config(config_update: UserConfigUpdate, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     config = db.query(models.UserConfig).filter(models.UserConfig.user_id == user.id).first()
     if not config:
         config = models.UserConfig(user_id=user.id)
@@ -644,85 +1094,81 @@ def update_user_config(config_update: UserConfigUpdate, user: models.User = Depe
     db.commit()
     return {"msg": "Configurações de IA salvas com sucesso"}
 
-@app.get("/vehicles/{vehicle_id}/insights")
-def get_vehicle_insights(vehicle_id: int, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/vehicles/{vehicle_id}/insights", response_model=VehicleInsightsResponse)
+def get_vehicle_insights(vehicle_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check ownership
     vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
     if not vehicle:
         raise HTTPException(status_code=404, detail="Veículo não encontrado")
     
+    # Job de geração em andamento (se houver), para o cliente acompanhar
+    job = jobs.active_vehicle_job(db, user.id, vehicle_id)
+    
     insight = db.query(models.VehicleInsights).filter(models.VehicleInsights.vehicle_id == vehicle_id).first()
     if not insight:
-        return {"chronic_issues": [], "suggested_maintenance": [], "generated_at": None}
+        return {"chronic_issues": [], "suggested_maintenance": [], "generated_at": None, "job": job}
     
     return {
         "chronic_issues": json.loads(insight.chronic_issues) if insight.chronic_issues else [],
         "suggested_maintenance": json.loads(insight.suggested_maintenance) if insight.suggested_maintenance else [],
-        "generated_at": insight.generated_at
+        "generated_at": insight.generated_at,
+        "job": job
     }
 
-@app.post("/vehicles/{vehicle_id}/insights")
-def generate_insights(vehicle_id: int, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    config = db.query(models.UserConfig).filter(models.UserConfig.user_id == user.id).first()
-    if not config or not config.llm_provider or not config.llm_api_key_encrypted:
-        raise HTTPException(status_code=400, detail="Configuração de IA ausente no perfil. Configure na aba de Perfil.")
-    
-    vehicle = db.query(models.Vehicle).filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user.id).first()
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Veículo não encontrado")
-    
-    # Get history
-    logs = db.query(models.MaintenanceLog)\
-        .filter(models.MaintenanceLog.vehicle_id == vehicle_id)\
-        .order_by(models.MaintenanceLog.date_performed.asc())\
-        .all()
-    
-    history_data = []
-    for log in logs:
-        m_type_name = log.maintenance_type.name if log.maintenance_type else "Desconhecido"
-        history_data.append({
-            "maintenance_type": m_type_name,
-            "date_performed": log.date_performed,
-            "km_performed": log.km_performed or 0
-        })
-    
-    # Call AI
-    result = ai_service.generate_vehicle_insights(
-        make=vehicle.make,
-        model=vehicle.model,
-        year=vehicle.year,
-        current_km=vehicle.current_km,
-        history=history_data,
-        provider=config.llm_provider,
-        encrypted_key=config.llm_api_key_encrypted
+@app.post("/vehicles/{vehicle_id}/insights", status_code=202, response_model=JobResponse)
+async def generate_insights(vehicle_id: int, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    # Enfileira a geração e responde na hora; o resultado sai em GET /jobs/{id}
+    provider, _ = await db.run_sync(insights.load_ai_config, user.id, "Configuração de IA ausente no perfil. Configure na aba de Perfil.")
+    # Pedido repetido com um job ativo devolve o mesmo job sem consumir o limite de uso da IA
+    job, created = await db.run_sync(
+        jobs.enqueue_vehicle_job, user.id, vehicle_id, lambda: enforce_ai_rate_limit(user.id, provider)
     )
-    
-    # Save to Cache
-    insight = db.query(models.VehicleInsights).filter(models.VehicleInsights.vehicle_id == vehicle_id).first()
-    if not insight:
-        insight = models.VehicleInsights(vehicle_id=vehicle_id)
-        db.add(insight)
-    
-    result_dict = result if isinstance(result, dict) else {}
-    insight.chronic_issues = json.dumps(result_dict.get("chronic_issues", []))
-    insight.suggested_maintenance = json.dumps(result_dict.get("suggested_maintenance", []))
-    insight.generated_at = datetime.utcnow()
-    db.commit()
-    
-    return result
+    await db.commit()
+    if created:
+        jobs.submit(job["id"])
+    return job
 
-@app.post("/maintenance-logs/normalize")
-def normalize_maintenance(req: NormalizeRequest, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    config = db.query(models.UserConfig).filter(models.UserConfig.user_id == user.id).first()
-    if not config or not config.llm_provider or not config.llm_api_key_encrypted:
-        raise HTTPException(status_code=400, detail="Configuração de IA ausente no perfil.")
+@app.post("/vehicles/{vehicle_id}/insights/stream", response_class=StreamingResponse)
+async def stream_insights(vehicle_id: int, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    # Variante em Server-Sent Events: os itens aparecem conforme a IA responde
+    provider, encrypted_key = await db.run_sync(insights.load_ai_config, user.id, "Configuração de IA ausente no perfil. Configure na aba de Perfil.")
+    context = await db.run_sync(insights.load_vehicle_context, user.id, vehicle_id)
+    await db.rollback()
+    enforce_ai_rate_limit(user.id, provider)
+    return StreamingResponse(
+        insights.stream_for_vehicle(vehicle_id, context, provider, encrypted_key, user.id),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: o Nginx do frontend repassa cada evento sem acumular
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/insights/regenerate", status_code=202, response_model=JobResponse)
+async def regenerate_all_insights(user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    # Regenera os insights de todos os veículos do usuário em um único job
+    provider, _ = await db.run_sync(insights.load_ai_config, user.id, "Configuração de IA ausente no perfil. Configure na aba de Perfil.")
+    job, created = await db.run_sync(jobs.enqueue_bulk_job, user.id, lambda: enforce_ai_rate_limit(user.id, provider))
+    await db.commit()
+    if created:
+        jobs.submit(job["id"])
+    return job
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: int, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(jobs.get_user_job, user.id, job_id)
+
+@app.post("/maintenance-logs/normalize", response_model=Dict[str, Any])
+async def normalize_maintenance(req: NormalizeRequest, user: Principal = Depends(get_current_user_async), db: AsyncSession = Depends(get_async_db)):
+    provider, encrypted_key = await db.run_sync(insights.load_ai_config, user.id)
+    await db.rollback()
     
     if not req.maintenance_names:
          raise HTTPException(status_code=400, detail="Lista de nomes vazia.")
+    enforce_ai_rate_limit(user.id, provider)
          
-    result = ai_service.normalize_maintenance_name(
+    result = await ai_service.normalize_maintenance_name(
         input_names=req.maintenance_names,
-        provider=config.llm_provider,
-        encrypted_key=config.llm_api_key_encrypted
+        provider=provider,
+        encrypted_key=encrypted_key,
+        user_id=user.id
     )
     return result
\ No newline at end of file
@@ -0,0 +1,252 @@
+import asyncio
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+# Métricas de desempenho em memória, por processo, expostas em formato texto do Prometheus (GET /metrics):
+#   - latência por rota (histograma), com a rota no formato do decorator (/vehicles/{vehicle_id})
+#   - consultas SQL e tempo de banco por rota, e alerta de N+1 (mesmo SQL repetido na requisição)
+#   - chamadas à IA por provedor: latência e resultado (ok / error / cancelled)
+# Com vários workers, cada processo tem os próprios contadores (o Prometheus soma por instância).
+# O cabeçalho Server-Timing (db, llm, app) mostra no navegador onde foi o tempo de cada requisição.
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))  # execuções do mesmo SQL na requisição
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+BACKGROUND = "(background)"  # consultas e chamadas fora de uma requisição (jobs, migrações)
+UNMATCHED = "(unmatched)"    # 404 e arquivos estáticos: uma única série, sem o caminho bruto
+
+logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self._values = {}
+
+    def inc(self, label_values: tuple, amount: float = 1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with _lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple):
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, labels, buckets
+        self._values = {}  # rótulos -> [contagem por faixa..., soma, total]
+
+    def observe(self, label_values: tuple, value: float):
+        with _lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            values = sorted((label_values, list(series)) for label_values, series in self._values.items())
+        for label_values, series in values:
+            labels = _labels(self.labels, label_values)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+request_duration = Histogram(
+    "manutencar_http_request_duration_seconds", "Duração das requisições HTTP por rota",
+    ("method", "route", "status"), LATENCY_BUCKETS
+)
+request_queries = Histogram(
+    "manutencar_db_queries_per_request", "Consultas SQL por requisição", ("route",), QUERY_COUNT_BUCKETS
+)
+db_queries = Counter("manutencar_db_queries_total", "Consultas SQL executadas", ("route",))
+db_seconds = Counter("manutencar_db_seconds_total", "Tempo gasto em consultas SQL", ("route",))
+n_plus_one = Counter(
+    "manutencar_db_n_plus_one_total", "Requisições que repetiram o mesmo SQL N_PLUS_ONE_THRESHOLD vezes ou mais", ("route",)
+)
+llm_duration = Histogram(
+    "manutencar_llm_request_duration_seconds", "Duração das chamadas à IA", ("provider", "mode"), LLM_BUCKETS
+)
+llm_requests = Counter("manutencar_llm_requests_total", "Chamadas à IA por resultado", ("provider", "mode", "outcome"))
+
+REGISTRY = (request_duration, request_queries, db_queries, db_seconds, n_plus_one, llm_duration, llm_requests)
+
+
+class RequestStats:
+    # Acumulado de uma requisição; as threads do pool (rotas def) herdam o mesmo objeto pelo contexto
+    __slots__ = ("queries", "db_time", "llm_time", "statements", "repeated", "closed")
+
+    def __init__(self):
+        self.queries, self.db_time, self.llm_time = 0, 0.0, 0.0
+        self.statements = collections.Counter()
+        self.repeated = None  # primeiro SQL que passou do limite de N+1
+        self.closed = False
+
+    def server_timing(self, elapsed: float) -> str:
+        app_time = max(elapsed - self.db_time - self.llm_time, 0.0)
+        parts = [f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"']
+        if self.llm_time:
+            parts.append(f"llm;dur={self.llm_time * 1000:.1f}")
+        parts.append(f"app;dur={app_time * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+def _stats():
+    # Tarefas criadas durante uma requisição (workers de jobs) herdam o contexto depois que ela terminou
+    stats = _current.get()
+    return stats if stats is not None and not stats.closed else None
+
+
+# --- Banco de dados ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _stats()
+    if stats is None:
+        db_queries.inc((BACKGROUND,))
+        db_seconds.inc((BACKGROUND,), elapsed)
+        return
+    stats.queries += 1
+    stats.db_time += elapsed
+    if executemany:
+        return  # lotes de INSERT/UPDATE (executemany) são a correção do N+1, não um sintoma
+    stats.statements[statement] += 1
+    if stats.repeated is None and stats.statements[statement] >= N_PLUS_ONE_THRESHOLD:
+        stats.repeated = statement
+
+
+def _handle_error(context):
+    # Consulta que falhou não passa pelo after_cursor_execute
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engines(*engines):
+    # Recebe engines síncronas (para a assíncrona, use async_engine.sync_engine)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+# --- IA ---
+
+@contextmanager
+def llm_timer(provider: str, mode: str):
+    # Envolve uma chamada (mode="call") ou um stream (mode="stream") inteiro, com as novas tentativas
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"  # cliente desconectou no meio do stream
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        llm_duration.observe((provider, mode), elapsed)
+        llm_requests.inc((provider, mode, outcome))
+        stats = _stats()
+        if stats is not None:
+            stats.llm_time += elapsed
+
+
+# --- HTTP ---
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED
+
+
+def _record_request(scope, status: int, elapsed: float, stats: RequestStats):
+    route = _route_label(scope)
+    request_duration.observe((scope["method"], route, status), elapsed)
+    request_queries.observe((route,), stats.queries)
+    db_queries.inc((route,), stats.queries)
+    db_seconds.inc((route,), stats.db_time)
+    if stats.repeated is not None:
+        n_plus_one.inc((route,))
+        count = stats.statements[stats.repeated]
+        sql = " ".join(stats.repeated.split())[:200]
+        logger.warning("Possível N+1 em %s %s: %dx %s", scope["method"], route, count, sql)
+
+
+class MetricsMiddleware:
+    # Middleware ASGI puro (não acumula o corpo das respostas em streaming)
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    MutableHeaders(scope=message).append("Server-Timing", stats.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            stats.closed = True
+            _current.reset(token)
+            _record_request(scope, status, time.perf_counter() - started, stats)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
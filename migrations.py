@@ -0,0 +1,214 @@
+import sys
+from datetime import datetime
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.orm import Session
+
+import alerts
+import catalog
+import history
+import jobs
+import models
+import rollups
+import sync
+from database import engine
+
+# Migrações versionadas do esquema. Rodam uma única vez, fora do processo da API:
+#   python migrations.py            -> aplica as migrações pendentes
+#   python migrations.py --explain  -> confere (EXPLAIN QUERY PLAN) que as consultas principais usam índices
+# Cada migração deve ser idempotente, pois bancos antigos podem já ter parte do esquema.
+
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _add_column_if_missing(conn, table: str, column: str, column_type) -> bool:
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column in columns:
+        return False
+    # Tipo compilado para o dialeto em uso (DATETIME no SQLite, TIMESTAMP no Postgres...)
+    ddl = column_type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _add_missing_columns(conn):
+    # Migrações que rodam código do ORM precisam de todas as colunas do modelo atual, inclusive as
+    # de migrações posteriores (que então só preenchem os valores onde estiverem nulos)
+    inspector = inspect(conn)
+    for table in models.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        for column in table.columns:
+            if not column.primary_key:
+                _add_column_if_missing(conn, table.name, column.name, column.type)
+
+
+def _create_missing_indexes(conn):
+    # create_all só cria índices junto com tabelas novas; em tabelas existentes criamos aqui.
+    # Índices de colunas que ainda não existem ficam para a migração que adiciona a coluna.
+    inspector = inspect(conn)
+    for table in models.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if all(c.name in columns for c in index.columns):
+                index.create(conn, checkfirst=True)
+
+
+def m001_initial_tables(conn):
+    models.Base.metadata.create_all(bind=conn)
+
+
+def m002_user_activity_columns(conn):
+    # Colunas adicionadas depois da primeira versão (antes feitas com ALTER TABLE a cada import)
+    if _add_column_if_missing(conn, "users", "created_at", DateTime()):
+        conn.execute(text("UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
+    _add_column_if_missing(conn, "users", "last_login", DateTime())
+
+
+def m003_composite_indexes(conn):
+    _create_missing_indexes(conn)
+
+
+def m004_rebuild_rollups(conn):
+    # Popula as projeções (last_service, vehicle_summaries, monthly_costs) de bancos existentes
+    db = Session(bind=conn)
+    rollups.rebuild_all(db)
+    db.flush()
+
+
+def m005_user_token_version(conn):
+    _add_column_if_missing(conn, "users", "token_version", Integer())
+
+
+def m006_insight_jobs(conn):
+    models.InsightJob.__table__.create(conn, checkfirst=True)
+
+
+def m007_type_catalog(conn):
+    # Colunas do catálogo global + tipos padrão, antes copiados para cada usuário no cadastro
+    _add_column_if_missing(conn, "maintenance_types", "catalog_id", Integer())
+    _add_column_if_missing(conn, "maintenance_types", "hidden", Boolean())
+    conn.execute(text("UPDATE maintenance_types SET hidden = :hidden WHERE hidden IS NULL"), {"hidden": False})
+    _add_missing_columns(conn)
+    _create_missing_indexes(conn)
+    db = Session(bind=conn)
+    catalog.collapse_user_defaults(db)
+    db.flush()
+
+
+def m008_data_versions(conn):
+    # Versões de dados usadas nos ETags das rotas de leitura
+    for table in ("users", "vehicles"):
+        _add_column_if_missing(conn, table, "data_version", Integer())
+        conn.execute(text(f"UPDATE {table} SET data_version = 0 WHERE data_version IS NULL"))
+
+
+def m009_sync(conn):
+    # Sincronização incremental (GET /sync): versão/data da última alteração de cada linha + exclusões
+    for table in ("vehicles", "maintenance_types", "maintenance_logs"):
+        _add_column_if_missing(conn, table, "sync_version", Integer())
+        _add_column_if_missing(conn, table, "updated_at", DateTime())
+        # Linhas existentes entram só na primeira sincronização completa
+        conn.execute(text(f"UPDATE {table} SET sync_version = 0 WHERE sync_version IS NULL"))
+    models.SyncTombstone.__table__.create(conn, checkfirst=True)
+    _create_missing_indexes(conn)
+
+
+MIGRATIONS = [
+    (1, "tabelas iniciais", m001_initial_tables),
+    (2, "colunas de atividade do usuário", m002_user_activity_columns),
+    (3, "índices compostos", m003_composite_indexes),
+    (4, "reconstrução das projeções", m004_rebuild_rollups),
+    (5, "versão de credenciais do usuário", m005_user_token_version),
+    (6, "fila de jobs de insights", m006_insight_jobs),
+    (7, "catálogo global de tipos de manutenção", m007_type_catalog),
+    (8, "versões de dados para ETag", m008_data_versions),
+    (9, "sincronização incremental", m009_sync),
+]
+
+
+def applied_versions(conn) -> set:
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(schema_migrations.select())}
+
+
+def upgrade(bind=engine) -> list:
+    with bind.begin() as conn:
+        applied = applied_versions(conn)
+
+    done = []
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        # Cada migração roda na sua própria transação junto com o registro da versão
+        with bind.begin() as conn:
+            migration(conn)
+            conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        done.append(version)
+    return done
+
+
+def hot_queries() -> dict:
+    # Consultas dos endpoints mais acessados, montadas pelas mesmas funções que as rotas usam
+    # (parâmetros fixos só para o EXPLAIN)
+    day = datetime(2000, 1, 1)
+    return {
+        "GET /vehicles (veículos)": alerts.vehicles_query(1),
+        "GET /vehicles (tipos)": catalog.visible_types(1).order_by(models.MaintenanceType.id),
+        "GET /vehicles (last_service)": alerts.last_services_query(1),
+        "GET /vehicles (consolidados)": alerts.summaries_query(1),
+        "GET /vehicles/{id}/history": history.history_query(1).limit(51),
+        "GET /vehicles/{id}/history (próxima página, filtros)":
+            history.history_query(1, maintenance_type_id=1, date_from=day, date_to=day, after=(day, 100)).limit(51),
+        "escrita de log (última manutenção)": rollups.last_log_query(1, 1),
+        "reconstrução de projeções (última manutenção por tipo)": alerts.latest_logs_query(vehicle_ids=[1, 2]),
+        "GET /stats": rollups.monthly_stats_query(1, "2000-01", "2000-12"),
+        "GET /stats?breakdown=vehicle": rollups.monthly_stats_query(1, "2000-01", "2000-12", "vehicle"),
+        "GET /user-config": select(models.UserConfig).where(models.UserConfig.user_id == 1),
+        "POST /vehicles/{id}/insights (job em andamento)": jobs.active_job_query(1, "vehicle", 1),
+        "GET /sync (manutenções alteradas)": sync.logs_query(1, since=10),
+    }
+
+
+def explain_hot_queries(bind=engine) -> list:
+    # Retorna (consulta, detalhe) de cada passo que varre uma tabela inteira sem índice
+    if bind.dialect.name != "sqlite":
+        raise RuntimeError("A verificação de plano usa EXPLAIN QUERY PLAN do SQLite")
+    scans = []
+    with bind.connect() as conn:
+        for label, query in hot_queries().items():
+            sql = query.compile(dialect=bind.dialect, compile_kwargs={"literal_binds": True})
+            # Varrer o resultado de uma subconsulta (CO-ROUTINE/MATERIALIZE) não lê tabela inteira
+            subqueries = set()
+            for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")):
+                detail = row[-1]
+                print(f"{label}: {detail}")
+                if detail.startswith(("CO-ROUTINE ", "MATERIALIZE ")):
+                    subqueries.add(detail.split(" ", 1)[1])
+                    continue
+                target = detail[len("SCAN "):] if detail.startswith("SCAN ") else None
+                if target is None or "INDEX" in detail or target in subqueries:
+                    continue
+                scans.append((label, detail))
+    return scans
+
+
+if __name__ == "__main__":
+    if "--explain" in sys.argv:
+        scans = explain_hot_queries()
+        if scans:
+            print("Consultas com varredura completa:")
+            for label, detail in scans:
+                print(f"  {label}: {detail}")
+            sys.exit(1)
+        print("Nenhuma varredura completa nas consultas principais.")
+    else:
+        applied = upgrade()
+        print(f"Migrações aplicadas: {applied}" if applied else "Banco já está na versão mais recente.")
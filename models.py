@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, UniqueConstraint, Index, null
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -11,37 +11,57 @@ class User(Base):
     hashed_password = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login = Column(DateTime, nullable=True)
+    token_version = Column(Integer, default=0) # incrementado ao trocar e-mail/senha
+    data_version = Column(Integer, default=0) # incrementado a cada escrita nos dados do usuário (ETag)
     vehicles = relationship("Vehicle", back_populates="owner")
     config = relationship("UserConfig", back_populates="user", uselist=False)
 
 class Vehicle(Base):
     __tablename__ = "vehicles"
+    __table_args__ = (Index('ix_vehicles_owner_sync', 'owner_id', 'sync_version'),)
     id = Column(Integer, primary_key=True, index=True)
     make = Column(String)
     model = Column(String)
     year = Column(Integer)
     current_km = Column(Integer)
     license_plate = Column(String)
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    data_version = Column(Integer, default=0) # incrementado a cada escrita no histórico do veículo (ETag)
+    # Sincronização: versão do usuário em que a linha mudou pela última vez (NULL = alterada na transação atual)
+    sync_version = Column(Integer, nullable=True, onupdate=null())
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     owner = relationship("User", back_populates="vehicles")
     maintenance_logs = relationship("MaintenanceLog", back_populates="vehicle")
     insights = relationship("VehicleInsights", back_populates="vehicle", uselist=False)
 
 class MaintenanceType(Base):
     __tablename__ = "maintenance_types"
-    __table_args__ = (UniqueConstraint('name', 'user_id', name='_name_user_uc'),)
+    __table_args__ = (
+        UniqueConstraint('name', 'user_id', name='_name_user_uc'),
+        Index('ix_maintenance_types_user_sync', 'user_id', 'sync_version'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     default_interval_km = Column(Integer) 
     default_interval_months = Column(Integer)
     description = Column(String, nullable=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True) # NULL = catálogo global
+    catalog_id = Column(Integer, ForeignKey("maintenance_types.id"), nullable=True, index=True) # tipo do catálogo personalizado/oculto
+    hidden = Column(Boolean, default=False)
+    sync_version = Column(Integer, nullable=True, onupdate=null())
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user = relationship("User")
 
 class MaintenanceLog(Base):
     __tablename__ = "maintenance_logs"
+    __table_args__ = (
+        # Última manutenção por (veículo, tipo) e histórico paginado por (data, id)
+        Index('ix_maintenance_logs_vehicle_type_date', 'vehicle_id', 'maintenance_type_id', 'date_performed'),
+        Index('ix_maintenance_logs_vehicle_date_id', 'vehicle_id', 'date_performed', 'id'),
+        Index('ix_maintenance_logs_vehicle_sync', 'vehicle_id', 'sync_version'),
+    )
     id = Column(Integer, primary_key=True, index=True)
     vehicle_id = Column(Integer, ForeignKey("vehicles.id"))
     maintenance_type_id = Column(Integer, ForeignKey("maintenance_types.id"))
@@ -51,6 +71,8 @@ class MaintenanceLog(Base):
     service_cost = Column(Float, default=0.0)
     product_cost = Column(Float, default=0.0)
     category = Column(String, nullable=False, default='preventiva')  # preventiva, desgaste, corretiva
+    sync_version = Column(Integer, nullable=True, onupdate=null())
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     vehicle = relationship("Vehicle", back_populates="maintenance_logs")
     maintenance_type = relationship("MaintenanceType")
@@ -72,4 +94,62 @@ class VehicleInsights(Base):
     suggested_maintenance = Column(String, nullable=True) # armazenaremos como JSON string
     generated_at = Column(DateTime, default=datetime.utcnow)
     
-    vehicle = relationship("Vehicle", back_populates="insights")
\ No newline at end of file
+    vehicle = relationship("Vehicle", back_populates="insights")
+
+class LastService(Base):
+    # Projeção desnormalizada da última manutenção por veículo e tipo (mantida na escrita dos logs)
+    __tablename__ = "last_service"
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), primary_key=True)
+    maintenance_type_id = Column(Integer, ForeignKey("maintenance_types.id"), primary_key=True)
+    last_log_id = Column(Integer, nullable=True)
+    last_date = Column(DateTime, nullable=True)
+    last_km = Column(Integer, nullable=True)
+    next_due_km = Column(Integer, nullable=True)
+    next_due_date = Column(DateTime, nullable=True)
+
+class VehicleSummary(Base):
+    # Consolidado de custos e atividade por veículo (mantido na escrita dos logs)
+    __tablename__ = "vehicle_summaries"
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), primary_key=True)
+    total_service_cost = Column(Float, default=0.0)
+    total_product_cost = Column(Float, default=0.0)
+    log_count = Column(Integer, default=0)
+    cost_by_category = Column(String, nullable=True) # armazenaremos como JSON string
+    first_service_date = Column(DateTime, nullable=True)
+    last_service_date = Column(DateTime, nullable=True)
+
+class MonthlyCost(Base):
+    # Consolidado mensal de custos por veículo e categoria (mantido na escrita dos logs)
+    __tablename__ = "monthly_costs"
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), primary_key=True)
+    month = Column(String, primary_key=True) # formato YYYY-MM
+    category = Column(String, primary_key=True)
+    service_cost = Column(Float, default=0.0)
+    product_cost = Column(Float, default=0.0)
+    log_count = Column(Integer, default=0)
+class InsightJob(Base):
+    # Job de geração de insights processado em segundo plano (um veículo ou toda a frota do usuário)
+    __tablename__ = "insight_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=True, index=True)
+    kind = Column(String, default="vehicle") # 'vehicle' ou 'bulk'
+    status = Column(String, default="queued") # 'queued', 'running', 'done', 'failed'
+    progress = Column(Integer, default=0)
+    total = Column(Integer, default=1)
+    result = Column(String, nullable=True) # armazenaremos como JSON string
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class SyncTombstone(Base):
+    # Registro de exclusão para GET /sync: clientes offline removem a linha da réplica local
+    __tablename__ = "sync_tombstones"
+    __table_args__ = (Index('ix_sync_tombstones_user_sync', 'user_id', 'sync_version'),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    entity = Column(String) # 'vehicle', 'maintenance_type' ou 'maintenance_log'
+    entity_id = Column(Integer)
+    sync_version = Column(Integer, nullable=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
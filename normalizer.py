@@ -0,0 +1,149 @@
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+# Normalização local de nomes de manutenção: agrupa nomes digitados de formas diferentes
+# ("Troca de óleo", "troca oleo", "TROCA DO OLEO") sem chamar a IA. Só os grupos ambíguos
+# (similaridade entre AMBIGUOUS_SCORE e CONFIDENT_SCORE) precisam de confirmação externa.
+
+CONFIDENT_SCORE = float(os.getenv("NORMALIZER_CONFIDENT_SCORE", "0.8"))
+AMBIGUOUS_SCORE = float(os.getenv("NORMALIZER_AMBIGUOUS_SCORE", "0.55"))
+NGRAM_SIZE = 3
+# Pares com poucos n-gramas em comum nem chegam a ser pontuados
+CANDIDATE_MIN_DICE = 0.3
+STOPWORDS = {"de", "do", "da", "dos", "das", "e", "o", "a", "os", "as", "no", "na", "em", "para", "com"}
+
+_non_alnum = re.compile(r"[^a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    # Minúsculas, sem acentos e sem pontuação: "Troca do Óleo!" -> "troca do oleo"
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    without_accents = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _non_alnum.sub(" ", without_accents.casefold()).strip()
+
+
+def tokens(folded: str) -> frozenset:
+    return frozenset(t for t in folded.split() if t not in STOPWORDS) or frozenset(folded.split())
+
+
+def char_ngrams(folded: str, n: int = NGRAM_SIZE) -> frozenset:
+    # N-gramas de caracteres sobre o texto sem stopwords, com borda, para tolerar erros de digitação
+    text = f" {' '.join(t for t in folded.split() if t not in STOPWORDS) or folded} "
+    if len(text) <= n:
+        return frozenset([text])
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+@lru_cache(maxsize=65536)
+def token_similarity(a: str, b: str) -> float:
+    # Dice dos n-gramas de duas palavras ("pastilha" ~ "pastilhas"); abaixo de 0.5 não conta
+    if a == b:
+        return 1.0
+    grams_a, grams_b = char_ngrams(a), char_ngrams(b)
+    dice = 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+    return dice if dice >= 0.5 else 0.0
+
+
+def _coverage(tokens_a: frozenset, tokens_b: frozenset) -> float:
+    # Quanto de A aparece em B: média da melhor correspondência de cada palavra de A
+    return sum(max(token_similarity(t, u) for u in tokens_b) for t in tokens_a) / len(tokens_a)
+
+
+def similarity(a: dict, b: dict) -> float:
+    # Cobertura mínima entre os dois sentidos: "troca oleo" x "troca filtro oleo" fica ambíguo,
+    # "filtro ar" x "filtro oleo" fica abaixo do limiar (nomes iguais após a normalização valem 1)
+    if a["key"] == b["key"]:
+        return 1.0
+    if not a["tokens"] or not b["tokens"]:
+        return 0.0
+    return min(_coverage(a["tokens"], b["tokens"]), _coverage(b["tokens"], a["tokens"]))
+
+
+class NameIndex:
+    # Índice invertido n-grama -> ids: cada nome só é comparado com os que compartilham n-gramas
+
+    def __init__(self, names: dict):
+        # names: {id: nome}
+        self.entries = {}
+        self.postings = defaultdict(set)
+        for item_id, name in names.items():
+            folded = fold(name)
+            grams = char_ngrams(folded)
+            self.entries[item_id] = {
+                "name": name,
+                "key": " ".join(sorted(tokens(folded))) or folded,
+                "tokens": tokens(folded),
+                "grams": grams
+            }
+            for gram in grams:
+                self.postings[gram].add(item_id)
+
+    def candidates(self, item_id) -> set:
+        grams = self.entries[item_id]["grams"]
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings[gram])
+        shared.pop(item_id, None)
+        return {
+            other_id for other_id, count in shared.items()
+            if 2 * count / (len(grams) + len(self.entries[other_id]["grams"])) >= CANDIDATE_MIN_DICE
+        }
+
+    def pairs(self, min_score: float = AMBIGUOUS_SCORE):
+        # (id_a, id_b, score) de cada par acima do limiar, sem repetir pares
+        for item_id in sorted(self.entries):
+            entry = self.entries[item_id]
+            for other_id in self.candidates(item_id):
+                if other_id <= item_id:
+                    continue
+                score = similarity(entry, self.entries[other_id])
+                if score >= min_score:
+                    yield item_id, other_id, score
+
+
+def find_clusters(names: dict, usage: dict = None) -> list:
+    # Agrupa os nomes parecidos (componentes conexas por similaridade >= AMBIGUOUS_SCORE).
+    # Cada grupo traz o nome sugerido (o mais usado nos registros) e se é confiável ou ambíguo.
+    usage = usage or {}
+    index = NameIndex(names)
+    parent = {item_id: item_id for item_id in names}
+
+    def find(item_id):
+        while parent[item_id] != item_id:
+            parent[item_id] = parent[parent[item_id]]
+            item_id = parent[item_id]
+        return item_id
+
+    edges = list(index.pairs())
+    for a, b, _ in edges:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    members = defaultdict(list)
+    for item_id in names:
+        members[find(item_id)].append(item_id)
+    weakest = {}
+    for a, b, score in edges:
+        root = find(a)
+        weakest[root] = min(weakest.get(root, 1.0), score)
+
+    clusters = []
+    for root, ids in members.items():
+        if len(ids) < 2:
+            continue
+        ids.sort(key=lambda i: (-usage.get(i, 0), len(names[i]), i))
+        score = weakest.get(root, 1.0)
+        clusters.append({
+            "type_ids": ids,
+            "names": [names[i] for i in ids],
+            "target_id": ids[0],
+            "suggested_name": names[ids[0]],
+            "score": round(score, 3),
+            "confidence": "high" if score >= CONFIDENT_SCORE else "ambiguous"
+        })
+    clusters.sort(key=lambda c: (c["confidence"] != "high", -c["score"], c["target_id"]))
+    return clusters
@@ -0,0 +1,65 @@
+import math
+import threading
+import time
+
+from cache import TTLCache
+
+
+class TokenBucket:
+    # Balde de fichas: comporta rajadas de até `capacity` e repõe `rate` fichas por segundo
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, now: float) -> float:
+        # Consome uma ficha e retorna 0, ou retorna quantos segundos faltam para haver uma
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class RateLimiter:
+    # Um balde por chave (usuário, provedor...); baldes ociosos expiram do cache
+    def __init__(self, capacity: float, per_minute: float, maxsize: int = 10000):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        # Ocioso por capacity/rate segundos, o balde já estaria cheio: descartá-lo não libera fichas a mais
+        self._buckets = TTLCache(maxsize=maxsize, ttl=capacity / self.rate if self.rate > 0 else math.inf)
+
+    def bucket(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.capacity, self.rate)
+        # Cada acesso renova a expiração: um balde em uso nunca volta cheio por ter expirado
+        self._buckets.set(key, bucket)
+        return bucket
+
+
+_lock = threading.Lock()
+
+
+def acquire(*pairs) -> float:
+    # Consome uma ficha de cada (limitador, chave) ou de nenhum; retorna o Retry-After em segundos (0 = liberado)
+    now = time.monotonic()
+    with _lock:
+        taken = []
+        for limiter, key in pairs:
+            bucket = limiter.bucket(key)
+            wait = bucket.take(now)
+            if wait:
+                for previous in taken:
+                    previous.give_back()
+                return wait
+            taken.append(bucket)
+    return 0.0
@@ -0,0 +1,339 @@
+import json
+from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+import alerts
+
+
+def log_key(log) -> tuple:
+    # Identifica quais projeções um log afeta: (veículo, tipo, data)
+    return (log.vehicle_id, log.maintenance_type_id, log.date_performed)
+
+
+# --- Última manutenção por veículo e tipo (last_service) ---
+
+def last_log_query(vehicle_id: int, maintenance_type_id: int):
+    log = models.MaintenanceLog
+    return select(log)\
+        .where(log.vehicle_id == vehicle_id, log.maintenance_type_id == maintenance_type_id)\
+        .order_by(log.date_performed.desc(), log.id.desc())\
+        .limit(1)
+
+
+def refresh_last_service(db: Session, vehicle_id: int, maintenance_type_id: int):
+    # Recalcula a linha da projeção para um par (veículo, tipo) a partir do log mais recente
+    last_log = db.scalars(last_log_query(vehicle_id, maintenance_type_id)).first()
+    row = db.get(models.LastService, (vehicle_id, maintenance_type_id))
+
+    if not last_log:
+        if row:
+            db.delete(row)
+        return
+
+    if not row:
+        row = models.LastService(vehicle_id=vehicle_id, maintenance_type_id=maintenance_type_id)
+        db.add(row)
+    mt = db.get(models.MaintenanceType, maintenance_type_id)
+    row.last_log_id = last_log.id
+    row.last_date = last_log.date_performed
+    row.last_km = last_log.km_performed
+    if mt:
+        row.next_due_km, row.next_due_date = alerts.next_due(last_log.date_performed, last_log.km_performed, mt)
+    else:
+        row.next_due_km, row.next_due_date = None, None
+
+
+def refresh_next_due_for_type(db: Session, mt: models.MaintenanceType):
+    # Intervalos do tipo mudaram: recalcula apenas os vencimentos (a última manutenção continua a mesma)
+    rows = db.query(models.LastService).filter(models.LastService.maintenance_type_id == mt.id).all()
+    for row in rows:
+        row.next_due_km, row.next_due_date = alerts.next_due(row.last_date, row.last_km, mt)
+
+
+def rebuild_last_service(db: Session, vehicle_ids: list = None):
+    # Reconstrói a projeção a partir do histórico (bancos existentes, importações em lote ou verificação
+    # de consistência); vehicle_ids limita a reconstrução a esses veículos
+    latest = alerts.latest_logs_by_vehicle_and_type(db, vehicle_ids=vehicle_ids)
+    deleted = db.query(models.LastService)
+    types = db.query(
+        # Só as colunas usadas: a reconstrução também roda em migrações antigas, antes de colunas novas existirem
+        models.MaintenanceType.id, models.MaintenanceType.default_interval_km, models.MaintenanceType.default_interval_months
+    )
+    if vehicle_ids is not None:
+        deleted = deleted.filter(models.LastService.vehicle_id.in_(vehicle_ids))
+        types = types.filter(models.MaintenanceType.id.in_({type_id for _, type_id in latest}))
+    deleted.delete(synchronize_session=False)
+    m_types = {mt.id: mt for mt in types}
+    for (vehicle_id, type_id), r in latest.items():
+        row = models.LastService(
+            vehicle_id=vehicle_id,
+            maintenance_type_id=type_id,
+            last_log_id=r.id,
+            last_date=r.date_performed,
+            last_km=r.km_performed
+        )
+        mt = m_types.get(type_id)
+        if mt:
+            row.next_due_km, row.next_due_date = alerts.next_due(r.date_performed, r.km_performed, mt)
+        db.add(row)
+
+
+# --- Consolidado por veículo (vehicle_summaries) ---
+
+def vehicle_aggregates(db: Session, vehicle_ids: list = None) -> dict:
+    # Agregados de custo/atividade calculados no banco (duas consultas agrupadas)
+    log = models.MaintenanceLog
+    service = func.coalesce(log.service_cost, 0.0)
+    product = func.coalesce(log.product_cost, 0.0)
+
+    totals = db.query(
+        log.vehicle_id,
+        func.sum(service),
+        func.sum(product),
+        func.count(log.id),
+        func.min(log.date_performed),
+        func.max(log.date_performed)
+    ).group_by(log.vehicle_id)
+    by_category = db.query(log.vehicle_id, log.category, func.sum(service + product))\
+        .group_by(log.vehicle_id, log.category)
+    if vehicle_ids is not None:
+        totals = totals.filter(log.vehicle_id.in_(vehicle_ids))
+        by_category = by_category.filter(log.vehicle_id.in_(vehicle_ids))
+
+    result = {}
+    for vehicle_id, s_cost, p_cost, count, first_date, last_date in totals.all():
+        result[vehicle_id] = {
+            "total_service_cost": float(s_cost or 0.0),
+            "total_product_cost": float(p_cost or 0.0),
+            "log_count": count,
+            "cost_by_category": {},
+            "first_service_date": first_date,
+            "last_service_date": last_date
+        }
+    for vehicle_id, category, total in by_category.all():
+        if vehicle_id in result:
+            result[vehicle_id]["cost_by_category"][category or "preventiva"] = float(total or 0.0)
+    return result
+
+
+def _apply_summary(row: models.VehicleSummary, data: dict):
+    row.total_service_cost = data["total_service_cost"]
+    row.total_product_cost = data["total_product_cost"]
+    row.log_count = data["log_count"]
+    row.cost_by_category = json.dumps(data["cost_by_category"], sort_keys=True)
+    row.first_service_date = data["first_service_date"]
+    row.last_service_date = data["last_service_date"]
+
+
+def refresh_vehicle_summary(db: Session, vehicle_id: int):
+    data = vehicle_aggregates(db, [vehicle_id]).get(vehicle_id)
+    row = db.get(models.VehicleSummary, vehicle_id)
+    if not data:
+        if row:
+            db.delete(row)
+        return
+    if not row:
+        row = models.VehicleSummary(vehicle_id=vehicle_id)
+        db.add(row)
+    _apply_summary(row, data)
+
+
+def check_vehicle_summaries(db: Session) -> list:
+    # Verificação de consistência: retorna os veículos cujo consolidado diverge do histórico
+    expected = vehicle_aggregates(db)
+    stored = {row.vehicle_id: row for row in db.query(models.VehicleSummary).all()}
+    mismatched = []
+    for vehicle_id in set(expected) | set(stored):
+        data, row = expected.get(vehicle_id), stored.get(vehicle_id)
+        if not data or not row:
+            mismatched.append(vehicle_id)
+            continue
+        same = (
+            abs((row.total_service_cost or 0.0) - data["total_service_cost"]) < 0.005
+            and abs((row.total_product_cost or 0.0) - data["total_product_cost"]) < 0.005
+            and row.log_count == data["log_count"]
+            and row.first_service_date == data["first_service_date"]
+            and row.last_service_date == data["last_service_date"]
+        )
+        stored_categories = json.loads(row.cost_by_category) if row.cost_by_category else {}
+        if same and set(stored_categories) == set(data["cost_by_category"]):
+            same = all(abs(stored_categories[c] - v) < 0.005 for c, v in data["cost_by_category"].items())
+        else:
+            same = False
+        if not same:
+            mismatched.append(vehicle_id)
+    return sorted(mismatched)
+
+
+def rebuild_vehicle_summaries(db: Session, vehicle_ids: list = None):
+    deleted = db.query(models.VehicleSummary)
+    if vehicle_ids is not None:
+        deleted = deleted.filter(models.VehicleSummary.vehicle_id.in_(vehicle_ids))
+    deleted.delete(synchronize_session=False)
+    for vehicle_id, data in vehicle_aggregates(db, vehicle_ids).items():
+        row = models.VehicleSummary(vehicle_id=vehicle_id)
+        _apply_summary(row, data)
+        db.add(row)
+
+
+# --- Consolidado mensal (monthly_costs) ---
+
+def month_key(dt: datetime) -> str:
+    return dt.strftime("%Y-%m")
+
+
+def add_months(dt: datetime, months: int) -> datetime:
+    # Primeiro dia do mês deslocado em N meses (calendário, sem passo fixo de 30 dias)
+    index = dt.year * 12 + (dt.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def month_series(now: datetime, months: int) -> list:
+    # Primeiro dia de cada um dos últimos N meses, do mais antigo ao atual
+    return [add_months(now, -i) for i in range(months - 1, -1, -1)]
+
+
+def refresh_monthly_cost(db: Session, vehicle_id: int, month_start: datetime):
+    log = models.MaintenanceLog
+    month = month_key(month_start)
+    rows = db.query(
+        log.category,
+        func.sum(func.coalesce(log.service_cost, 0.0)),
+        func.sum(func.coalesce(log.product_cost, 0.0)),
+        func.count(log.id)
+    ).filter(
+        log.vehicle_id == vehicle_id,
+        log.date_performed >= month_start,
+        log.date_performed < add_months(month_start, 1)
+    ).group_by(log.category).all()
+
+    db.query(models.MonthlyCost)\
+        .filter(models.MonthlyCost.vehicle_id == vehicle_id, models.MonthlyCost.month == month)\
+        .delete(synchronize_session=False)
+    for category, s_cost, p_cost, count in rows:
+        db.add(models.MonthlyCost(
+            vehicle_id=vehicle_id,
+            month=month,
+            category=category or "preventiva",
+            service_cost=float(s_cost or 0.0),
+            product_cost=float(p_cost or 0.0),
+            log_count=count
+        ))
+
+
+def rebuild_monthly_costs(db: Session, vehicle_ids: list = None):
+    # Agrupamento por mês feito em Python para não depender de funções de data específicas do banco
+    log = models.MaintenanceLog
+    deleted = db.query(models.MonthlyCost)
+    query = db.query(log.vehicle_id, log.category, log.date_performed, log.service_cost, log.product_cost)\
+        .filter(log.date_performed.isnot(None))
+    if vehicle_ids is not None:
+        deleted = deleted.filter(models.MonthlyCost.vehicle_id.in_(vehicle_ids))
+        query = query.filter(log.vehicle_id.in_(vehicle_ids))
+    deleted.delete(synchronize_session=False)
+    buckets = {}
+    query = query.yield_per(1000)
+    for vehicle_id, category, date_performed, s_cost, p_cost in query:
+        bucket = buckets.setdefault((vehicle_id, month_key(date_performed), category or "preventiva"), [0.0, 0.0, 0])
+        bucket[0] += s_cost or 0.0
+        bucket[1] += p_cost or 0.0
+        bucket[2] += 1
+    for (vehicle_id, month, category), (s_cost, p_cost, count) in buckets.items():
+        db.add(models.MonthlyCost(
+            vehicle_id=vehicle_id,
+            month=month,
+            category=category,
+            service_cost=s_cost,
+            product_cost=p_cost,
+            log_count=count
+        ))
+
+
+def monthly_stats_query(owner_id: int, first_month: str, last_month: str, breakdown: str = None):
+    # Custos da frota agrupados por mês (e por veículo ou categoria) sobre o consolidado mensal
+    mc = models.MonthlyCost
+    columns = [mc.month]
+    if breakdown == "vehicle":
+        columns.append(mc.vehicle_id)
+    elif breakdown == "category":
+        columns.append(mc.category)
+    return select(
+        *columns,
+        func.sum(mc.service_cost),
+        func.sum(mc.product_cost),
+        func.sum(mc.log_count)
+    ).join(models.Vehicle, models.Vehicle.id == mc.vehicle_id)\
+        .where(models.Vehicle.owner_id == owner_id, mc.month >= first_month, mc.month <= last_month)\
+        .group_by(*columns)
+
+
+def monthly_stats(db: Session, owner_id: int, months: int = 12, breakdown: str = None, now: datetime = None) -> list:
+    # Série mensal de custos da frota em UMA consulta agrupada sobre o consolidado mensal
+    series = month_series(now or datetime.utcnow(), months)
+    keys = [month_key(m) for m in series]
+    rows = db.execute(monthly_stats_query(owner_id, keys[0], keys[-1], breakdown)).all()
+
+    monthly_data = {}
+    for month_start, key in zip(series, keys):
+        monthly_data[key] = {"month": month_start.strftime("%m/%Y"), "service_cost": 0, "product_cost": 0, "count": 0, "sort_key": key}
+        if breakdown:
+            monthly_data[key][f"by_{breakdown}"] = {}
+
+    for row in rows:
+        entry = monthly_data[row[0]]
+        s_cost, p_cost, count = float(row[-3] or 0.0), float(row[-2] or 0.0), int(row[-1] or 0)
+        entry["service_cost"] += s_cost
+        entry["product_cost"] += p_cost
+        entry["count"] += count
+        if breakdown:
+            entry[f"by_{breakdown}"][row[1]] = {"service_cost": s_cost, "product_cost": p_cost, "count": count}
+
+    return [monthly_data[key] for key in keys]
+
+
+# --- Pontos de entrada usados pelas rotas ---
+
+def refresh_for_logs(db: Session, keys: list):
+    # Chamado na mesma transação das escritas de log; keys = log_key() antes e/ou depois da alteração
+    db.flush()
+    pairs = {(vehicle_id, type_id) for vehicle_id, type_id, _ in keys if vehicle_id and type_id}
+    for vehicle_id, type_id in pairs:
+        refresh_last_service(db, vehicle_id, type_id)
+    for vehicle_id in {vehicle_id for vehicle_id, _ in pairs}:
+        refresh_vehicle_summary(db, vehicle_id)
+    months = {(vehicle_id, add_months(date_performed, 0)) for vehicle_id, _, date_performed in keys if vehicle_id and date_performed}
+    for vehicle_id, month_start in months:
+        refresh_monthly_cost(db, vehicle_id, month_start)
+
+
+def purge_vehicles(db: Session, vehicle_ids):
+    # Remove as projeções dos veículos excluídos (lista ou SELECT de ids)
+    db.query(models.LastService).filter(models.LastService.vehicle_id.in_(vehicle_ids)).delete(synchronize_session=False)
+    db.query(models.VehicleSummary).filter(models.VehicleSummary.vehicle_id.in_(vehicle_ids)).delete(synchronize_session=False)
+    db.query(models.MonthlyCost).filter(models.MonthlyCost.vehicle_id.in_(vehicle_ids)).delete(synchronize_session=False)
+
+
+def rebuild_all(db: Session, vehicle_ids: list = None):
+    rebuild_last_service(db, vehicle_ids)
+    rebuild_vehicle_summaries(db, vehicle_ids)
+    rebuild_monthly_costs(db, vehicle_ids)
+
+
+if __name__ == "__main__":
+    # Uso: python rollups.py          -> reconstrói as projeções de um banco existente
+    #      python rollups.py --check  -> apenas verifica a consistência dos consolidados
+    import sys
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if "--check" in sys.argv:
+            mismatched = check_vehicle_summaries(db)
+            print(f"Veículos com consolidado divergente: {mismatched}" if mismatched else "Consolidados consistentes.")
+            sys.exit(1 if mismatched else 0)
+        rebuild_all(db)
+        db.commit()
+        print("Projeções reconstruídas com sucesso.")
+    finally:
+        db.close()
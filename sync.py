@@ -0,0 +1,104 @@
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+import catalog
+import models
+
+# Sincronização incremental para clientes com réplica local (GET /sync?since=<cursor>).
+# O cursor é a users.data_version, incrementada por toda escrita (versions.touch_*): as linhas
+# alteradas na transação ficam com sync_version NULL (onupdate) e recebem a nova versão antes do
+# commit. Uma versão por usuário, e não um horário, garante que nenhuma alteração fique para trás
+# quando duas transações terminam fora de ordem. Exclusões viram registros em sync_tombstones.
+
+DELETED_KEYS = {"vehicle": "vehicles", "maintenance_type": "maintenance_types", "maintenance_log": "maintenance_logs"}
+
+
+def record_deletions(db: Session, user_id: int, entity: str, entity_ids):
+    db.add_all(models.SyncTombstone(user_id=user_id, entity=entity, entity_id=entity_id) for entity_id in entity_ids)
+
+
+def stamp_changes(db: Session, user_id: int, version: int):
+    # Carimba com a nova versão tudo o que o usuário alterou nesta transação
+    owned = select(models.Vehicle.id).where(models.Vehicle.owner_id == user_id)
+    for model, condition in (
+        (models.Vehicle, models.Vehicle.owner_id == user_id),
+        (models.MaintenanceType, models.MaintenanceType.user_id == user_id),
+        (models.MaintenanceLog, models.MaintenanceLog.vehicle_id.in_(owned)),
+        (models.SyncTombstone, models.SyncTombstone.user_id == user_id),
+    ):
+        db.execute(
+            update(model).where(condition, model.sync_version.is_(None)).values(sync_version=version)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _vehicle(v: models.Vehicle) -> dict:
+    return {
+        "id": v.id, "make": v.make, "model": v.model, "year": v.year, "current_km": v.current_km,
+        "license_plate": v.license_plate, "updated_at": v.updated_at
+    }
+
+
+def _maintenance_type(mt: models.MaintenanceType) -> dict:
+    return {
+        "id": mt.id, "name": mt.name, "default_interval_km": mt.default_interval_km,
+        "default_interval_months": mt.default_interval_months, "description": mt.description,
+        "updated_at": mt.updated_at
+    }
+
+
+def _maintenance_log(log: models.MaintenanceLog) -> dict:
+    return {
+        "id": log.id, "vehicle_id": log.vehicle_id, "maintenance_type_id": log.maintenance_type_id,
+        "date_performed": log.date_performed, "km_performed": log.km_performed, "notes": log.notes,
+        "service_cost": log.service_cost, "product_cost": log.product_cost, "category": log.category,
+        "updated_at": log.updated_at
+    }
+
+
+def logs_query(user_id: int, since: int = None):
+    # Manutenções dos veículos do usuário (as alteradas depois de since, se informado)
+    owned = select(models.Vehicle.id).where(models.Vehicle.owner_id == user_id)
+    query = select(models.MaintenanceLog).where(models.MaintenanceLog.vehicle_id.in_(owned))
+    if since is not None:
+        query = query.where(models.MaintenanceLog.sync_version > since)
+    return query
+
+
+def changes_since(db: Session, user_id: int, since: int = 0) -> dict:
+    # since=0 (ou um cursor desconhecido) devolve tudo com full=True: o cliente substitui a réplica.
+    # Nas respostas incrementais, o cliente aplica 'deleted' antes das listas de inclusão/alteração.
+    cursor = db.query(models.User.data_version).filter(models.User.id == user_id).scalar() or 0
+    full = since <= 0 or since > cursor
+    vehicles = db.query(models.Vehicle).filter(models.Vehicle.owner_id == user_id)
+    logs = logs_query(user_id, None if full else since)
+    deleted = {key: [] for key in DELETED_KEYS.values()}
+
+    if full:
+        types = db.scalars(catalog.visible_types(user_id)).all()
+    else:
+        vehicles = vehicles.filter(models.Vehicle.sync_version > since)
+        changed = db.query(models.MaintenanceType)\
+            .filter(models.MaintenanceType.user_id == user_id, models.MaintenanceType.sync_version > since).all()
+        types = []
+        for mt in changed:
+            # Personalização substitui o tipo do catálogo; lápide (hidden) o esconde
+            if mt.catalog_id:
+                deleted["maintenance_types"].append(mt.catalog_id)
+            if mt.hidden:
+                deleted["maintenance_types"].append(mt.id)
+            else:
+                types.append(mt)
+        tombstones = db.query(models.SyncTombstone.entity, models.SyncTombstone.entity_id)\
+            .filter(models.SyncTombstone.user_id == user_id, models.SyncTombstone.sync_version > since)
+        for entity, entity_id in tombstones:
+            deleted[DELETED_KEYS[entity]].append(entity_id)
+
+    return {
+        "cursor": cursor,
+        "full": full,
+        "vehicles": [_vehicle(v) for v in vehicles.order_by(models.Vehicle.id)],
+        "maintenance_types": [_maintenance_type(mt) for mt in sorted(types, key=lambda mt: mt.id)],
+        "maintenance_logs": [_maintenance_log(log) for log in db.scalars(logs.order_by(models.MaintenanceLog.id))],
+        "deleted": deleted
+    }
@@ -0,0 +1,70 @@
+import contextlib
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# Banco SQLite temporário: a URL precisa estar definida antes de importar database.py
+_tmp_dir = tempfile.mkdtemp(prefix="manutencar-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}"
+os.environ.setdefault("LLM_FAKE_PROVIDER", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import database
+import main
+import migrations
+
+migrations.upgrade()
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def make_user(client):
+    # Cada teste cria os próprios usuários (e-mail único), então os testes não dependem da ordem
+    def create(password: str = "senha123") -> dict:
+        email = f"{uuid.uuid4().hex}@teste.com"
+        assert client.post("/register", json={"email": email, "password": password}).status_code == 200
+        token = client.post("/token", data={"username": email, "password": password}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        user_id = client.get("/me", headers=headers).json()["id"]
+        return {"id": user_id, "email": email, "password": password, "headers": headers}
+    return create
+
+
+@pytest.fixture
+def count_queries():
+    # with count_queries() as counter: ... -> counter["n"] = comandos SQL executados (engines síncrona e assíncrona)
+    @contextlib.contextmanager
+    def counting():
+        counter = {"n": 0}
+
+        def before_cursor_execute(*args):
+            counter["n"] += 1
+
+        engines = (database.engine, database.async_engine.sync_engine)
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield counter
+        finally:
+            for engine in engines:
+                event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return counting
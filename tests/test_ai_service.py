@@ -0,0 +1,60 @@
+import asyncio
+import gc
+import json
+
+import ai_service
+
+
+def test_user_limit_holds_while_other_users_churn():
+    async def scenario() -> int:
+        state = {"running": 0, "max": 0}
+
+        async def call(i: int):
+            async with ai_service._call_slots("limit-user"):
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+                # Muitos outros usuários e um GC no meio da chamada não podem descartar o semáforo em uso
+                for j in range(1000):
+                    ai_service._user_semaphore(f"other-{i}-{j}")
+                gc.collect()
+                await asyncio.sleep(0.01)
+                state["running"] -= 1
+
+        await asyncio.gather(*(call(i) for i in range(10)))
+        return state["max"]
+
+    assert asyncio.run(scenario()) == ai_service.LLM_MAX_CONCURRENCY_PER_USER
+    gc.collect()
+    assert "limit-user" not in ai_service._user_slots
+
+
+def test_insights_cache_is_per_user(monkeypatch):
+    calls = []
+
+    async def run_llm(prompt, provider, encrypted_key, user_id=None):
+        calls.append(user_id)
+        return {"chronic_issues": [f"resposta de {user_id}"], "suggested_maintenance": []}
+
+    async def stream_llm(prompt, provider, api_key, user_id=None):
+        calls.append(user_id)
+        yield json.dumps({"chronic_issues": [f"resposta de {user_id}"], "suggested_maintenance": []})
+
+    monkeypatch.setattr(ai_service, "_run_llm", run_llm)
+    monkeypatch.setattr(ai_service, "stream_llm", stream_llm)
+    monkeypatch.setattr(ai_service, "_api_key", lambda encrypted_key: "k")
+    ai_service._insights_cache.clear()
+    # Veículos idênticos: o mesmo fingerprint para os três usuários
+    vehicle = ("Fiat", "Uno", 2012, 90000, [{"maintenance_type": "Óleo", "date_performed": "2024-01-10", "km_performed": 80000}], "fake", "k")
+
+    async def scenario():
+        first = await ai_service.generate_vehicle_insights(*vehicle, user_id=1)
+        again = await ai_service.generate_vehicle_insights(*vehicle, user_id=1)
+        other = await ai_service.generate_vehicle_insights(*vehicle, user_id=2)
+        streamed = [event async for event in ai_service.stream_vehicle_insights(*vehicle, user_id=3)]
+        return first, again, other, streamed[-1]
+
+    first, again, other, streamed = asyncio.run(scenario())
+    assert calls == [1, 2, 3]
+    assert first == again == {"chronic_issues": ["resposta de 1"], "suggested_maintenance": []}
+    assert other["chronic_issues"] == ["resposta de 2"]
+    assert streamed == ("final", {"chronic_issues": ["resposta de 3"], "suggested_maintenance": []})
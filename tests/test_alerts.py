@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import models
+import rollups
+
+
+def seed_fleet(db, user_id: int, type_ids: list, vehicles: int):
+    # Veículos com um registro antigo de cada tipo (todos geram alerta) e projeções já calculadas
+    fleet = [
+        models.Vehicle(make="VW", model=f"Gol {i}", year=2010, current_km=200000, license_plate=f"T{i:04d}", owner_id=user_id)
+        for i in range(vehicles)
+    ]
+    db.add_all(fleet)
+    db.flush()
+    db.add_all(
+        models.MaintenanceLog(vehicle_id=v.id, maintenance_type_id=type_id, km_performed=1000, date_performed=datetime(2020, 1, 1))
+        for v in fleet for type_id in type_ids
+    )
+    db.flush()
+    rollups.rebuild_all(db, [v.id for v in fleet])
+    db.commit()
+
+
+def test_get_vehicles_query_count_does_not_grow_with_fleet(client, db, make_user, count_queries):
+    small, large = make_user(), make_user()
+    type_ids = [t["id"] for t in client.get("/maintenance-types", headers=small["headers"]).json()]
+    assert len(type_ids) >= 10
+    seed_fleet(db, small["id"], type_ids[:2], vehicles=2)
+    seed_fleet(db, large["id"], type_ids[:10], vehicles=50)
+
+    counts = {}
+    for name, user, expected in (("small", small, 2), ("large", large, 50)):
+        with count_queries() as counter:
+            response = client.get("/vehicles", headers=user["headers"])
+        assert response.status_code == 200
+        vehicles = response.json()
+        assert len(vehicles) == expected
+        assert all(v["alerts"] for v in vehicles)
+        counts[name] = counter["n"]
+
+    # O número de consultas é fixo (versão para o ETag, veículos, tipos, last_service, consolidados)
+    assert counts["small"] == counts["large"]
+    assert counts["large"] <= 6
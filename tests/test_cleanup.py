@@ -0,0 +1,115 @@
+import cleanup
+import models
+
+VEHICLE_TABLES = (
+    models.MaintenanceLog, models.VehicleInsights, models.InsightJob,
+    models.LastService, models.VehicleSummary, models.MonthlyCost,
+)
+
+
+def seed_account(client, db, user) -> list:
+    # Dois veículos com registros (projeções mantidas pela API), insights, jobs, configuração de IA,
+    # um tipo próprio, uma personalização e uma lápide do catálogo
+    headers = user["headers"]
+    catalog_types = client.get("/maintenance-types", headers=headers).json()
+    own_type = client.post(
+        "/maintenance-types", headers=headers,
+        json={"name": "Tipo Próprio", "default_interval_km": 5000, "default_interval_months": 6}
+    ).json()
+    assert client.put(f"/maintenance-types/{catalog_types[0]['id']}", headers=headers, json={"default_interval_km": 7000}).status_code == 200
+    assert client.delete(f"/maintenance-types/{catalog_types[1]['id']}", headers=headers).status_code == 200
+    assert client.post("/user-config", headers=headers, json={"llm_provider": "fake", "llm_api_key": "k"}).status_code == 200
+
+    vehicle_ids = []
+    for i in range(2):
+        vehicle_id = client.post(
+            "/vehicles", headers=headers,
+            json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": f"CLN000{i}"}
+        ).json()["id"]
+        vehicle_ids.append(vehicle_id)
+        for type_id, when in ((own_type["id"], "2024-01-10T10:00:00"), (catalog_types[2]["id"], "2024-03-05T10:00:00")):
+            response = client.post(
+                f"/vehicles/{vehicle_id}/maintenance", headers=headers,
+                json={"maintenance_type_id": type_id, "km_performed": 80000, "date_performed": when, "service_cost": 100}
+            )
+            assert response.status_code == 200
+        db.add(models.VehicleInsights(vehicle_id=vehicle_id, chronic_issues="[]", suggested_maintenance="[]"))
+        db.add(models.InsightJob(user_id=user["id"], vehicle_id=vehicle_id, kind="vehicle", status="done"))
+    db.add(models.InsightJob(user_id=user["id"], kind="bulk", status="done", total=2))
+    db.commit()
+
+    for model in VEHICLE_TABLES:
+        assert rows_for_vehicles(db, model, vehicle_ids) > 0, model.__tablename__
+    return vehicle_ids
+
+
+def rows_for_vehicles(db, model, vehicle_ids) -> int:
+    return db.query(model).filter(model.vehicle_id.in_(vehicle_ids)).count()
+
+
+def test_deleting_vehicle_and_account_leaves_no_orphans(client, db, make_user):
+    user = make_user()
+    other = make_user()
+    vehicle_ids = seed_account(client, db, user)
+    other_vehicles = seed_account(client, db, other)
+
+    assert client.delete(f"/vehicles/{vehicle_ids[0]}", headers=user["headers"]).status_code == 200
+    db.expire_all()
+    assert cleanup.find_orphans(db) == {}
+    for model in VEHICLE_TABLES:
+        assert rows_for_vehicles(db, model, vehicle_ids[:1]) == 0, model.__tablename__
+        assert rows_for_vehicles(db, model, vehicle_ids[1:]) > 0, model.__tablename__
+
+    assert client.delete("/me", headers=user["headers"]).status_code == 200
+    db.expire_all()
+    assert cleanup.find_orphans(db) == {}
+    for model in VEHICLE_TABLES:
+        assert rows_for_vehicles(db, model, vehicle_ids) == 0, model.__tablename__
+    for column in (
+        models.Vehicle.owner_id, models.MaintenanceType.user_id, models.UserConfig.user_id,
+        models.InsightJob.user_id, models.SyncTombstone.user_id, models.User.id,
+    ):
+        assert db.query(column.class_).filter(column == user["id"]).count() == 0, column
+
+    # Os dados do outro usuário ficam intactos
+    for model in VEHICLE_TABLES:
+        assert rows_for_vehicles(db, model, other_vehicles) > 0, model.__tablename__
+
+
+def test_logs_reject_foreign_unknown_and_hidden_types(client, db, make_user):
+    owner, other = make_user(), make_user()
+    private_type = client.post(
+        "/maintenance-types", headers=owner["headers"],
+        json={"name": "Tipo Privado", "default_interval_km": 5000, "default_interval_months": 6}
+    ).json()
+    catalog_types = client.get("/maintenance-types", headers=other["headers"]).json()
+    assert client.delete(f"/maintenance-types/{catalog_types[1]['id']}", headers=other["headers"]).status_code == 200
+    vehicle_id = client.post(
+        "/vehicles", headers=other["headers"],
+        json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": "CLN0100"}
+    ).json()["id"]
+
+    def add_log(type_id):
+        return client.post(
+            f"/vehicles/{vehicle_id}/maintenance", headers=other["headers"],
+            json={"maintenance_type_id": type_id, "km_performed": 80000, "date_performed": "2024-01-10T10:00:00"}
+        )
+
+    # Tipo privado de outro usuário, id inexistente e tipo do catálogo oculto
+    for type_id in (private_type["id"], 999999, catalog_types[1]["id"]):
+        response = add_log(type_id)
+        assert response.status_code == 404, type_id
+        assert response.json()["detail"] == "Tipo de manutenção não encontrado"
+
+    assert add_log(catalog_types[0]["id"]).status_code == 200
+    log_id = client.get(f"/vehicles/{vehicle_id}/history", headers=other["headers"]).json()["items"][0]["id"]
+    for type_id in (private_type["id"], 999999):
+        response = client.put(f"/maintenance-logs/{log_id}", headers=other["headers"], json={"maintenance_type_id": type_id})
+        assert response.status_code == 404, type_id
+    db.expire_all()
+    assert db.get(models.MaintenanceLog, log_id).maintenance_type_id == catalog_types[0]["id"]
+
+    # Nenhum registro alheio aponta para o tipo privado: a exclusão da conta do dono segue funcionando
+    assert client.delete("/me", headers=owner["headers"]).status_code == 200
+    db.expire_all()
+    assert cleanup.find_orphans(db) == {}
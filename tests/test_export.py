@@ -0,0 +1,88 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import exporter
+
+
+def add_vehicle(client, user, plate: str) -> int:
+    response = client.post(
+        "/vehicles", headers=user["headers"],
+        json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": plate}
+    )
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def add_log(client, user, vehicle_id: int, type_id: int, when: str, notes: str):
+    response = client.post(
+        f"/vehicles/{vehicle_id}/maintenance", headers=user["headers"],
+        json={"maintenance_type_id": type_id, "km_performed": 1000, "date_performed": when, "notes": notes, "service_cost": 50}
+    )
+    assert response.status_code == 200
+
+
+@pytest.fixture
+def fleet(client, make_user):
+    # Dois veículos do usuário (um com duas manutenções) e um veículo de outro usuário
+    user, other = make_user(), make_user()
+    type_id = client.get("/maintenance-types", headers=user["headers"]).json()[0]["id"]
+    first, second = add_vehicle(client, user, "EXP0001"), add_vehicle(client, user, "EXP0002")
+    add_log(client, user, first, type_id, "2024-01-10T10:00:00", 'com, "aspas"')
+    add_log(client, user, first, type_id, "2024-02-10T10:00:00", "acentuação")
+    add_log(client, user, second, type_id, "2024-03-10T10:00:00", "segundo")
+    foreign = add_vehicle(client, other, "OUT0001")
+    add_log(client, other, foreign, type_id, "2024-01-01T10:00:00", "de outro usuário")
+    return {"user": user, "first": first, "second": second, "foreign": foreign}
+
+
+def export(client, fleet, **params):
+    response = client.get("/export", headers=fleet["user"]["headers"], params=params)
+    assert response.status_code == 200, response.text
+    return response
+
+
+def test_csv_export(client, fleet):
+    response = export(client, fleet)
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.content.decode("utf-8"))))
+    assert rows[0] == exporter.COLUMNS
+    records = [dict(zip(rows[0], row)) for row in rows[1:]]
+    assert [r["license_plate"] for r in records] == ["EXP0001", "EXP0001", "EXP0002"]
+    assert [r["notes"] for r in records] == ['com, "aspas"', "acentuação", "segundo"]
+    assert records[0]["date_performed"] == "2024-01-10T10:00:00"
+
+
+def test_ndjson_export(client, fleet):
+    response = export(client, fleet, format="ndjson")
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in response.content.decode("utf-8").splitlines()]
+    assert [r["vehicle_id"] for r in records] == [fleet["first"], fleet["first"], fleet["second"]]
+    assert set(records[0]) == set(exporter.COLUMNS)
+    assert records[1]["notes"] == "acentuação"
+
+
+@pytest.mark.parametrize("file_format", ["csv", "ndjson"])
+def test_gzip_export_matches_plain_output(client, fleet, file_format):
+    plain = export(client, fleet, format=file_format).content
+    compressed = export(client, fleet, format=file_format, gzip="true")
+    assert compressed.headers["content-type"] == "application/gzip"
+    assert compressed.headers["content-disposition"].endswith(f'.{file_format}.gz"')
+    assert gzip.decompress(compressed.content) == plain
+
+
+def test_vehicle_filter(client, fleet):
+    records = [json.loads(line) for line in export(client, fleet, format="ndjson", vehicle_id=fleet["second"]).content.splitlines()]
+    assert [r["notes"] for r in records] == ["segundo"]
+
+
+def test_other_users_vehicle_is_not_exported(client, fleet):
+    response = client.get("/export", headers=fleet["user"]["headers"], params={"vehicle_id": fleet["foreign"]})
+    assert response.status_code == 404
+    for file_format in ("csv", "ndjson"):
+        content = export(client, fleet, format=file_format).content.decode("utf-8")
+        assert "OUT0001" not in content
+        assert "de outro usuário" not in content
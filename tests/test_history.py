@@ -0,0 +1,43 @@
+def add_vehicle(client, user) -> int:
+    response = client.post(
+        "/vehicles", headers=user["headers"],
+        json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": "HIS0001"}
+    )
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def add_log(client, user, vehicle_id: int, type_id: int, when: str, km: int):
+    response = client.post(
+        f"/vehicles/{vehicle_id}/maintenance", headers=user["headers"],
+        json={"maintenance_type_id": type_id, "km_performed": km, "date_performed": when}
+    )
+    assert response.status_code == 200
+
+
+def history_dates(client, user, vehicle_id: int, **params) -> list:
+    response = client.get(f"/vehicles/{vehicle_id}/history", headers=user["headers"], params=params)
+    assert response.status_code == 200
+    return sorted(item["date_performed"][:16] for item in response.json()["items"])
+
+
+def test_history_date_range_is_inclusive(client, make_user):
+    user = make_user()
+    vehicle_id = add_vehicle(client, user)
+    type_id = client.get("/maintenance-types", headers=user["headers"]).json()[0]["id"]
+    add_log(client, user, vehicle_id, type_id, "2024-01-01T00:00:00", 80000)
+    add_log(client, user, vehicle_id, type_id, "2024-01-31T18:30:00", 85000)
+    add_log(client, user, vehicle_id, type_id, "2024-02-01T00:00:00", 86000)
+
+    # Data sem hora vale o dia inteiro nas duas pontas
+    assert history_dates(client, user, vehicle_id, date_from="2024-01-01", date_to="2024-01-31") == [
+        "2024-01-01T00:00", "2024-01-31T18:30"
+    ]
+    assert history_dates(client, user, vehicle_id, date_from="2024-01-31", date_to="2024-01-31") == ["2024-01-31T18:30"]
+    # Com hora, o limite é exato (e inclusivo)
+    assert history_dates(client, user, vehicle_id, date_to="2024-01-31T12:00:00") == ["2024-01-01T00:00"]
+    assert history_dates(client, user, vehicle_id, date_from="2024-01-31T18:30:00") == [
+        "2024-01-31T18:30", "2024-02-01T00:00"
+    ]
+    bad = client.get(f"/vehicles/{vehicle_id}/history", headers=user["headers"], params={"date_to": "2024-13-01"})
+    assert bad.status_code == 422
@@ -0,0 +1,50 @@
+import io
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import importer
+import main
+import models
+
+
+def test_batches_committed_before_a_failure_get_projections_and_versions(client, db, make_user, monkeypatch):
+    user = make_user()
+    vehicle_id = client.post(
+        "/vehicles", headers=user["headers"],
+        json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 1000, "license_plate": "IMP0001"}
+    ).json()["id"]
+    version_before = db.get(models.User, user["id"]).data_version
+    db.rollback()
+
+    monkeypatch.setattr(importer, "IMPORT_BATCH_SIZE", 2)
+    flush = importer._flush
+    calls = []
+
+    def failing_flush(session, batch):
+        calls.append(len(batch))
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("disk I/O error"))
+        flush(session, batch)
+
+    monkeypatch.setattr(importer, "_flush", failing_flush)
+    text = io.StringIO(
+        "maintenance_type,date_performed,km_performed\n"
+        "Filtro de Ar,2024-01-10,20000\n"
+        "Filtro de Ar,2024-02-10,25000\n"
+        "Filtro de Ar,2024-03-10,90000\n"
+        "Filtro de Ar,2024-04-10,95000\n"
+    )
+    with pytest.raises(OperationalError):
+        importer.import_logs(db, user["id"], text, "csv", main.MaintenanceLogCreate, default_vehicle_id=vehicle_id)
+
+    db.expire_all()
+    logs = db.query(models.MaintenanceLog).filter(models.MaintenanceLog.vehicle_id == vehicle_id).all()
+    assert sorted(log.km_performed for log in logs) == [20000, 25000]
+    # Só o lote gravado conta: KM, última manutenção e versões refletem 25.000 km, não o lote perdido
+    vehicle = db.get(models.Vehicle, vehicle_id)
+    assert vehicle.current_km == 25000
+    last = db.query(models.LastService).filter(models.LastService.vehicle_id == vehicle_id).one()
+    assert last.last_km == 25000
+    assert db.get(models.VehicleSummary, vehicle_id) is not None
+    assert db.get(models.User, user["id"]).data_version > version_before
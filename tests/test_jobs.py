@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import jobs
+import main
+import models
+import ratelimit
+
+
+def fake_runner(monkeypatch) -> list:
+    processed = []
+
+    async def run_job(job_id: int):
+        processed.append(job_id)
+
+    monkeypatch.setattr(jobs, "run_job", run_job)
+    return processed
+
+
+def test_dead_workers_are_replaced_without_dropping_queued_jobs(monkeypatch):
+    processed = fake_runner(monkeypatch)
+
+    async def scenario():
+        jobs._ensure_workers()
+        await jobs.stop()
+        # Jobs na fila enquanto não há worker vivo
+        jobs._queue.put_nowait(1)
+        jobs._queue.put_nowait(2)
+        jobs.submit(3)
+        await asyncio.wait_for(jobs._queue.join(), 5)
+        await jobs.stop()
+
+    asyncio.run(scenario())
+    assert processed == [1, 2, 3]
+
+
+def test_queued_jobs_move_to_a_new_event_loop(monkeypatch):
+    processed = fake_runner(monkeypatch)
+
+    async def first_loop():
+        jobs._ensure_workers()
+        await jobs.stop()
+        jobs._queue.put_nowait(10)
+
+    async def second_loop():
+        jobs.submit(11)
+        await asyncio.wait_for(jobs._queue.join(), 5)
+        await jobs.stop()
+
+    asyncio.run(first_loop())
+    asyncio.run(second_loop())
+    assert processed == [10, 11]
+
+
+def test_repeated_insight_requests_reuse_the_job_without_spending_rate_limit(client, make_user, monkeypatch):
+    # Sem workers: o job continua ativo ("queued") entre os pedidos
+    monkeypatch.setattr(jobs, "submit", lambda job_id: None)
+    user = make_user()
+    headers = user["headers"]
+    assert client.post("/user-config", json={"llm_provider": "fake", "llm_api_key": "k"}, headers=headers).status_code == 200
+    vehicle = client.post(
+        "/vehicles", headers=headers,
+        json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": "JOB0001"}
+    ).json()
+
+    burst = int(main.ai_user_limiter.capacity)
+    for path in (f"/vehicles/{vehicle['id']}/insights", "/insights/regenerate"):
+        responses = [client.post(path, headers=headers) for _ in range(burst + 3)]
+        assert {r.status_code for r in responses} == {202}
+        assert len({r.json()["id"] for r in responses}) == 1
+
+    # Uma ficha por job criado (um por veículo e um em lote), e não uma por pedido
+    assert main.ai_user_limiter.bucket(user["id"]).tokens < burst - 1.9
+    assert main.ai_user_limiter.bucket(user["id"]).tokens > burst - 2.1
+
+
+def test_insight_requests_over_the_burst_get_429_with_retry_after(client, db, make_user, monkeypatch):
+    monkeypatch.setattr(jobs, "submit", lambda job_id: None)
+    user = make_user()
+    headers = user["headers"]
+    assert client.post("/user-config", json={"llm_provider": "fake", "llm_api_key": "k"}, headers=headers).status_code == 200
+    burst = int(main.ai_user_limiter.capacity)
+    vehicle_ids = [
+        client.post(
+            "/vehicles", headers=headers,
+            json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": f"RL{i:05d}"}
+        ).json()["id"]
+        for i in range(burst + 1)
+    ]
+
+    # Um job novo por veículo consome uma ficha; o excedente recebe 429 e nenhum job é criado
+    responses = [client.post(f"/vehicles/{vehicle_id}/insights", headers=headers) for vehicle_id in vehicle_ids]
+    assert [r.status_code for r in responses] == [202] * burst + [429]
+    assert int(responses[-1].headers["Retry-After"]) >= 1
+    assert db.query(models.InsightJob).filter(models.InsightJob.user_id == user["id"]).count() == burst
+    assert client.post("/insights/regenerate", headers=headers).status_code == 429
+
+
+def test_busy_buckets_do_not_expire_back_to_a_full_burst(monkeypatch):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(time, "monotonic", lambda: clock["now"])
+    limiter = ratelimit.RateLimiter(capacity=2, per_minute=1)
+
+    # Um pedido a cada 50 s por mais que o TTL do cache: o balde nunca acumula a rajada inteira de novo
+    allowed = 0
+    for _ in range(200):
+        allowed += ratelimit.acquire((limiter, "busy")) == 0
+        allowed += ratelimit.acquire((limiter, "busy")) == 0
+        clock["now"] += 50
+    # Rajada inicial + uma ficha por minuto decorrido entre o primeiro e o último pedido
+    assert allowed == 2 + int(199 * 50 / 60)
+
+    # Ocioso até encher, o balde pode sair do cache sem mudar o resultado
+    clock["now"] += 120
+    assert limiter.bucket("busy").tokens == 2
@@ -0,0 +1,17 @@
+import logging
+
+import metrics
+
+
+def test_repeated_statement_is_logged_and_counted(caplog):
+    stats = metrics.RequestStats()
+    stats.queries = 12
+    stats.statements["SELECT * FROM vehicles WHERE id = ?"] = 12
+    stats.repeated = "SELECT * FROM vehicles WHERE id = ?"
+    scope = {"method": "GET", "route": None}
+
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        metrics._record_request(scope, 200, 0.01, stats)
+
+    assert "Possível N+1 em GET (unmatched): 12x SELECT * FROM vehicles" in caplog.text
+    assert 'manutencar_db_n_plus_one_total{route="(unmatched)"}' in metrics.render()
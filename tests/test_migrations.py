@@ -0,0 +1,15 @@
+from sqlalchemy import select
+
+import database
+import migrations
+import models
+
+
+def test_hot_queries_use_indexes():
+    assert migrations.explain_hot_queries(database.engine) == []
+
+
+def test_explain_flags_full_table_scan(monkeypatch):
+    unindexed = select(models.MaintenanceLog).where(models.MaintenanceLog.notes == "x")
+    monkeypatch.setattr(migrations, "hot_queries", lambda: {"sem índice": unindexed})
+    assert migrations.explain_hot_queries(database.engine) == [("sem índice", "SCAN maintenance_logs")]
@@ -0,0 +1,107 @@
+import models
+import normalizer
+
+
+def entry(name: str) -> dict:
+    return normalizer.NameIndex({1: name}).entries[1]
+
+
+def test_fold_drops_case_accents_and_punctuation():
+    assert normalizer.fold("Troca do Óleo!") == "troca do oleo"
+    assert normalizer.fold("  PASTILHA/Freio  ") == "pastilha freio"
+    assert normalizer.fold(None) == ""
+
+
+def test_similarity_thresholds():
+    # Acentos, caixa e stopwords não mudam o nome; o plural fica próximo
+    assert normalizer.similarity(entry("Troca de óleo"), entry("TROCA DO OLEO")) == 1.0
+    assert normalizer.similarity(entry("Pastilha de freio"), entry("Pastilhas freio")) >= normalizer.CONFIDENT_SCORE
+    # Uma palavra a mais fica ambígua; outra peça com a mesma palavra não chega ao limiar
+    partial = normalizer.similarity(entry("troca oleo"), entry("troca filtro oleo"))
+    assert normalizer.AMBIGUOUS_SCORE <= partial < normalizer.CONFIDENT_SCORE
+    assert normalizer.similarity(entry("filtro ar"), entry("filtro oleo")) < normalizer.AMBIGUOUS_SCORE
+
+
+def test_find_clusters_groups_variants_and_keeps_different_parts_apart():
+    names = {
+        1: "Troca de óleo", 2: "troca oleo", 3: "TROCA DO OLEO",
+        4: "Filtro ar", 5: "Filtro oleo",
+        6: "Pastilha de freio", 7: "Pastilhas freio",
+        8: "Alinhamento",
+    }
+    clusters = normalizer.find_clusters(names, usage={3: 5, 1: 2})
+    by_members = {frozenset(c["type_ids"]): c for c in clusters}
+    assert set(by_members) == {frozenset({1, 2, 3}), frozenset({6, 7})}
+
+    oil = by_members[frozenset({1, 2, 3})]
+    assert oil["confidence"] == "high" and oil["score"] == 1.0
+    # O destino sugerido é o nome mais usado nos registros
+    assert oil["target_id"] == 3 and oil["suggested_name"] == "TROCA DO OLEO"
+    assert by_members[frozenset({6, 7})]["confidence"] == "high"
+
+
+def add_type(client, user, name: str) -> int:
+    response = client.post(
+        "/maintenance-types", headers=user["headers"],
+        json={"name": name, "default_interval_km": 10000, "default_interval_months": 12}
+    )
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_duplicates_route_lists_the_users_clusters(client, make_user):
+    user, other = make_user(), make_user()
+    own = [add_type(client, user, name) for name in ("Lavagem do Radiador", "lavagem radiador")]
+    add_type(client, other, "LAVAGEM DE RADIADOR")
+
+    response = client.get("/maintenance-types/duplicates", headers=user["headers"])
+    assert response.status_code == 200
+    clusters = [c for c in response.json()["clusters"] if set(c["type_ids"]) & set(own)]
+    # Tipos de outro usuário não entram nos grupos
+    assert len(clusters) == 1 and sorted(clusters[0]["type_ids"]) == sorted(own)
+    assert clusters[0]["confidence"] == "high"
+
+
+def test_merge_moves_logs_and_hides_sources_only_for_this_user(client, db, make_user):
+    user, other = make_user(), make_user()
+    catalog_types = client.get("/maintenance-types", headers=user["headers"]).json()
+    source, target = catalog_types[0]["id"], add_type(client, user, "Destino")
+    vehicle_id = client.post(
+        "/vehicles", headers=user["headers"],
+        json={"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": "MRG0001"}
+    ).json()["id"]
+    for when in ("2024-01-10T10:00:00", "2024-05-10T10:00:00"):
+        assert client.post(
+            f"/vehicles/{vehicle_id}/maintenance", headers=user["headers"],
+            json={"maintenance_type_id": source, "km_performed": 80000, "date_performed": when}
+        ).status_code == 200
+
+    response = client.post("/maintenance-types/merge", headers=user["headers"], json={"source_ids": [source], "target_id": target})
+    assert response.status_code == 200, response.text
+    assert response.json() == {
+        "msg": "Tipos de manutenção mesclados", "target_id": target, "moved_logs": 2, "removed_type_ids": [source]
+    }
+    db.expire_all()
+    assert {log.maintenance_type_id for log in db.query(models.MaintenanceLog).filter(models.MaintenanceLog.vehicle_id == vehicle_id)} == {target}
+    visible = [t["id"] for t in client.get("/maintenance-types", headers=user["headers"]).json()]
+    assert source not in visible and target in visible
+
+    # O tipo do catálogo continua existindo e visível para os outros usuários
+    assert db.get(models.MaintenanceType, source) is not None
+    assert client.get("/maintenance-types", headers=other["headers"]).json() == catalog_types
+
+
+def test_merge_rejects_types_the_user_cannot_see(client, make_user):
+    user, other = make_user(), make_user()
+    target = add_type(client, user, "Destino")
+    foreign = add_type(client, other, "Tipo Alheio")
+    hidden = client.get("/maintenance-types", headers=user["headers"]).json()[0]["id"]
+    assert client.delete(f"/maintenance-types/{hidden}", headers=user["headers"]).status_code == 200
+
+    for source in (foreign, hidden, 999999):
+        response = client.post("/maintenance-types/merge", headers=user["headers"], json={"source_ids": [source], "target_id": target})
+        assert response.status_code == 404, source
+    response = client.post("/maintenance-types/merge", headers=user["headers"], json={"source_ids": [target], "target_id": foreign})
+    assert response.status_code == 404
+    # O tipo do outro usuário segue intacto
+    assert foreign in [t["id"] for t in client.get("/maintenance-types", headers=other["headers"]).json()]
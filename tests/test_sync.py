@@ -0,0 +1,111 @@
+import pytest
+
+VEHICLE = {"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000}
+
+
+@pytest.fixture
+def replica(client, make_user):
+    # Usuário com dois veículos e uma manutenção, e o cursor de uma réplica já sincronizada
+    user = make_user()
+    headers = user["headers"]
+    types = client.get("/maintenance-types", headers=headers).json()
+    vehicle_ids = [
+        client.post("/vehicles", headers=headers, json={**VEHICLE, "license_plate": f"SYN000{i}"}).json()["id"]
+        for i in range(2)
+    ]
+    assert client.post(
+        f"/vehicles/{vehicle_ids[0]}/maintenance", headers=headers,
+        json={"maintenance_type_id": types[0]["id"], "km_performed": 80000, "date_performed": "2024-01-10T10:00:00"}
+    ).status_code == 200
+    snapshot = sync(client, user, 0)
+    assert snapshot["full"]
+    return {**user, "types": types, "vehicle_ids": vehicle_ids, "snapshot": snapshot}
+
+
+def sync(client, user, since: int) -> dict:
+    response = client.get("/sync", headers=user["headers"], params={"since": since})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def ids(items) -> list:
+    return [item["id"] for item in items]
+
+
+def test_vehicle_edit_is_in_the_delta(client, make_user, replica):
+    cursor = replica["snapshot"]["cursor"]
+    edited = replica["vehicle_ids"][1]
+    assert client.put(f"/vehicles/{edited}", headers=replica["headers"], json={**VEHICLE, "license_plate": "SYN0001", "current_km": 95000}).status_code == 200
+    # Escrita de outro usuário não aparece na réplica
+    other = make_user()
+    client.post("/vehicles", headers=other["headers"], json={**VEHICLE, "license_plate": "SYN9999"})
+
+    delta = sync(client, replica, cursor)
+    assert not delta["full"]
+    assert delta["cursor"] > cursor
+    assert ids(delta["vehicles"]) == [edited]
+    assert delta["vehicles"][0]["current_km"] == 95000
+    assert delta["maintenance_logs"] == [] and delta["maintenance_types"] == []
+    assert delta["deleted"] == {"vehicles": [], "maintenance_types": [], "maintenance_logs": []}
+
+    # Nada mudou desde o novo cursor: delta vazio
+    empty = sync(client, replica, delta["cursor"])
+    assert not empty["full"]
+    assert empty["vehicles"] == [] and empty["maintenance_logs"] == []
+
+
+def test_deleted_log_arrives_as_tombstone(client, replica):
+    cursor = replica["snapshot"]["cursor"]
+    log_id = replica["snapshot"]["maintenance_logs"][0]["id"]
+    assert client.delete(f"/maintenance-logs/{log_id}", headers=replica["headers"]).status_code == 200
+
+    delta = sync(client, replica, cursor)
+    assert delta["deleted"]["maintenance_logs"] == [log_id]
+    assert log_id not in ids(delta["maintenance_logs"])
+
+
+def test_overridden_and_hidden_catalog_types_report_the_old_id_as_deleted(client, replica):
+    cursor = replica["snapshot"]["cursor"]
+    overridden, hidden = replica["types"][1]["id"], replica["types"][2]["id"]
+    override = client.put(f"/maintenance-types/{overridden}", headers=replica["headers"], json={"default_interval_km": 7000}).json()
+    assert override["id"] != overridden
+    assert client.delete(f"/maintenance-types/{hidden}", headers=replica["headers"]).status_code == 200
+
+    delta = sync(client, replica, cursor)
+    assert overridden in delta["deleted"]["maintenance_types"]
+    assert hidden in delta["deleted"]["maintenance_types"]
+    # A personalização chega como tipo novo; a lápide do tipo oculto não
+    assert ids(delta["maintenance_types"]) == [override["id"]]
+    assert delta["maintenance_types"][0]["default_interval_km"] == 7000
+
+
+def test_old_cursor_still_gets_every_change_since_it(client, replica):
+    # Lápides não expiram: um cursor antigo continua válido e recebe o acumulado de várias escritas
+    cursor = replica["snapshot"]["cursor"]
+    first, second = replica["vehicle_ids"]
+    log_id = replica["snapshot"]["maintenance_logs"][0]["id"]
+    assert client.put(f"/vehicles/{first}", headers=replica["headers"], json={**VEHICLE, "license_plate": "SYN0000", "current_km": 99000}).status_code == 200
+    assert client.delete(f"/maintenance-logs/{log_id}", headers=replica["headers"]).status_code == 200
+    assert client.delete(f"/vehicles/{second}", headers=replica["headers"]).status_code == 200
+
+    delta = sync(client, replica, cursor)
+    assert not delta["full"]
+    assert ids(delta["vehicles"]) == [first]
+    assert delta["deleted"]["vehicles"] == [second]
+    assert delta["deleted"]["maintenance_logs"] == [log_id]
+
+
+@pytest.mark.parametrize("offset", [None, 1000], ids=["reset", "too-new"])
+def test_unknown_cursor_gets_a_full_snapshot(client, replica, offset):
+    log_id = replica["snapshot"]["maintenance_logs"][0]["id"]
+    assert client.delete(f"/maintenance-logs/{log_id}", headers=replica["headers"]).status_code == 200
+    cursor = sync(client, replica, replica["snapshot"]["cursor"])["cursor"]
+
+    # Cursor zerado/negativo ou à frente do servidor (réplica de outro banco): o cliente substitui tudo
+    snapshot = sync(client, replica, -1 if offset is None else cursor + offset)
+    assert snapshot["full"]
+    assert snapshot["cursor"] == cursor
+    assert ids(snapshot["vehicles"]) == replica["vehicle_ids"]
+    assert ids(snapshot["maintenance_types"]) == ids(replica["snapshot"]["maintenance_types"])
+    assert snapshot["maintenance_logs"] == []
+    assert snapshot["deleted"] == {"vehicles": [], "maintenance_types": [], "maintenance_logs": []}
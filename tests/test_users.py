@@ -0,0 +1,21 @@
+def test_users_list_requires_dashboard_token(client, make_user, monkeypatch):
+    user, other = make_user(), make_user()
+    monkeypatch.setenv("GLOBAL_DASHBOARD_TOKEN", "painel")
+
+    # O token de um usuário comum não lista as contas dos outros
+    response = client.get("/users", headers=user["headers"])
+    assert response.status_code == 403
+    assert other["email"] not in response.text
+
+    response = client.get("/users", headers={"Authorization": "Bearer painel"})
+    assert response.status_code == 200
+    emails = {u["email"] for u in response.json()}
+    assert {user["email"], other["email"]} <= emails
+    assert all(set(u) == {"id", "name", "email"} for u in response.json())
+
+
+def test_users_list_is_closed_without_dashboard_token(client, make_user, monkeypatch):
+    user = make_user()
+    monkeypatch.delenv("GLOBAL_DASHBOARD_TOKEN", raising=False)
+    assert client.get("/users", headers=user["headers"]).status_code == 403
+    assert client.get("/users").status_code == 401
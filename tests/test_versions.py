@@ -0,0 +1,124 @@
+import pytest
+
+import models
+
+VEHICLE = {"make": "Fiat", "model": "Uno", "year": 2012, "current_km": 90000, "license_plate": "VER0001"}
+
+
+@pytest.fixture
+def account(client, make_user):
+    # Usuário com um veículo, um registro de manutenção e um tipo próprio
+    user = make_user()
+    headers = user["headers"]
+    types = client.get("/maintenance-types", headers=headers).json()
+    vehicle_id = client.post("/vehicles", headers=headers, json=VEHICLE).json()["id"]
+    assert client.post(
+        f"/vehicles/{vehicle_id}/maintenance", headers=headers,
+        json={"maintenance_type_id": types[0]["id"], "km_performed": 80000, "date_performed": "2024-01-10T10:00:00"}
+    ).status_code == 200
+    own_type = client.post(
+        "/maintenance-types", headers=headers,
+        json={"name": "Tipo Próprio", "default_interval_km": 5000, "default_interval_months": 6}
+    ).json()
+    log_id = client.get(f"/vehicles/{vehicle_id}/history", headers=headers).json()["items"][0]["id"]
+    return {**user, "vehicle_id": vehicle_id, "types": types, "own_type": own_type, "log_id": log_id}
+
+
+def data_versions(db, account) -> tuple:
+    db.expire_all()
+    user = db.get(models.User, account["id"])
+    vehicle = db.get(models.Vehicle, account["vehicle_id"])
+    return user.data_version or 0, (vehicle.data_version or 0) if vehicle else None
+
+
+def etags(client, account) -> dict:
+    # ETag de cada leitura condicional; confere que, sem escrita, o próprio ETag devolve 304
+    paths = ["/vehicles", "/maintenance-types", "/stats", f"/vehicles/{account['vehicle_id']}/history"]
+    tags = {}
+    for path in paths:
+        tag = client.get(path, headers=account["headers"]).headers["ETag"]
+        revalidated = client.get(path, headers={**account["headers"], "If-None-Match": tag})
+        assert revalidated.status_code == 304, path
+        tags[path] = tag
+    return tags
+
+
+def api_write(method, path, **kwargs):
+    return lambda client, account: getattr(client, method)(path.format(**account), headers=account["headers"], **kwargs)
+
+
+def add_log(client, account):
+    return client.post(
+        f"/vehicles/{account['vehicle_id']}/maintenance", headers=account["headers"],
+        json={"maintenance_type_id": account["types"][1]["id"], "km_performed": 85000, "date_performed": "2024-02-01T10:00:00"}
+    )
+
+
+def import_csv(client, account):
+    csv_text = f"maintenance_type_id,km_performed,date_performed\n{account['types'][1]['id']},85000,2024-02-01\n"
+    return client.post(
+        f"/maintenance-logs/import?vehicle_id={account['vehicle_id']}", headers=account["headers"],
+        files={"file": ("historico.csv", csv_text.encode())}
+    )
+
+
+def merge_types(client, account):
+    return client.post(
+        "/maintenance-types/merge", headers=account["headers"],
+        json={"source_ids": [account["types"][0]["id"]], "target_id": account["own_type"]["id"]}
+    )
+
+
+def type_write(method, key, **kwargs):
+    def write(client, account):
+        type_id = account["own_type"]["id"] if key == "own" else account["types"][key]["id"]
+        return getattr(client, method)(f"/maintenance-types/{type_id}", headers=account["headers"], **kwargs)
+    return write
+
+
+# (nome, escrita, a versão do veículo também sobe?)
+WRITES = [
+    ("vehicle create", api_write("post", "/vehicles", json={**VEHICLE, "license_plate": "VER0002"}), False),
+    ("vehicle update", api_write("put", "/vehicles/{vehicle_id}", json={**VEHICLE, "current_km": 95000}), True),
+    ("vehicle delete", api_write("delete", "/vehicles/{vehicle_id}"), None),
+    ("maintenance add", add_log, True),
+    ("maintenance update", api_write("put", "/maintenance-logs/{log_id}", json={"km_performed": 81000}), True),
+    ("maintenance delete", api_write("delete", "/maintenance-logs/{log_id}"), True),
+    ("type create", api_write(
+        "post", "/maintenance-types", json={"name": "Outro Tipo", "default_interval_km": 1000, "default_interval_months": 1}
+    ), False),
+    ("type update", type_write("put", 0, json={"default_interval_km": 7000}), True),
+    ("type delete", type_write("delete", "own"), False),
+    ("type merge", merge_types, True),
+    ("import", import_csv, True),
+    ("profile", api_write("put", "/me", json={"name": "Novo Nome"}), False),
+    ("password", api_write("put", "/me", json={"password": "outra-senha"}), False),
+]
+
+
+@pytest.mark.parametrize("write,bumps_vehicle", [w[1:] for w in WRITES], ids=[w[0] for w in WRITES])
+def test_write_bumps_versions_and_invalidates_etags(client, db, account, write, bumps_vehicle):
+    before = data_versions(db, account)
+    old_tags = etags(client, account)
+
+    response = write(client, account)
+    assert response.status_code == 200, response.text
+    if response.json().get("access_token"):
+        # Troca de senha invalida o token antigo
+        account["headers"] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    user_version, vehicle_version = data_versions(db, account)
+    assert user_version > before[0]
+    if bumps_vehicle:
+        assert vehicle_version > before[1]
+    elif bumps_vehicle is False:
+        assert vehicle_version == before[1]
+
+    for path, tag in old_tags.items():
+        if bumps_vehicle is None and "history" in path:
+            continue  # veículo removido: o histórico responde 404
+        if bumps_vehicle is False and "history" in path:
+            # Escrita que não mexe no veículo mantém o ETag do histórico
+            assert client.get(path, headers={**account["headers"], "If-None-Match": tag}).status_code == 304, path
+            continue
+        assert client.get(path, headers={**account["headers"], "If-None-Match": tag}).status_code == 200, path
@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import Request, Response
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+import models
+import sync
+
+# Versões de dados para GET condicional (ETag / If-None-Match -> 304).
+# users.data_version muda a cada escrita nos dados do usuário (veículos, tipos, manutenções);
+# vehicles.data_version muda a cada escrita que altera o histórico/análise daquele veículo.
+# As rotas de escrita chamam touch_* na mesma transação da alteração (o que também carimba as linhas
+# alteradas para o GET /sync); as de leitura comparam o ETag antes de executar as consultas pesadas.
+
+CACHE_HEADERS = {"Cache-Control": "private, no-cache"}  # o navegador guarda, mas sempre revalida
+
+
+def _next(column):
+    return func.coalesce(column, 0) + 1
+
+
+def touch_user(db: Session, user_id: int) -> int:
+    # Chamado por último, antes do commit: o flush garante que as alterações pendentes sejam carimbadas
+    db.flush()
+    db.execute(update(models.User).where(models.User.id == user_id).values(data_version=_next(models.User.data_version)))
+    version = db.query(models.User.data_version).filter(models.User.id == user_id).scalar()
+    sync.stamp_changes(db, user_id, version)
+    return version
+
+
+def touch_vehicles(db: Session, user_id: int, vehicle_ids: list = None) -> int:
+    # Versão dos veículos informados (None = toda a frota, ex.: tipo renomeado) + do usuário
+    db.flush()
+    # Só a versão de ETag: a linha do veículo em si não mudou para a sincronização
+    stmt = update(models.Vehicle).values(
+        data_version=_next(models.Vehicle.data_version),
+        sync_version=models.Vehicle.sync_version,
+        updated_at=models.Vehicle.updated_at
+    ).execution_options(synchronize_session=False)
+    if vehicle_ids is None:
+        stmt = stmt.where(models.Vehicle.owner_id == user_id)
+    else:
+        stmt = stmt.where(models.Vehicle.id.in_(vehicle_ids), models.Vehicle.owner_id == user_id)
+    db.execute(stmt)
+    return touch_user(db, user_id)
+
+
+def _day_suffix(daily: bool) -> str:
+    # Alertas e séries mensais também dependem da data atual, não só das escritas
+    return f".{datetime.utcnow():%Y%m%d}" if daily else ""
+
+
+def user_etag(db: Session, user_id: int, daily: bool = False) -> str:
+    version = db.query(models.User.data_version).filter(models.User.id == user_id).scalar()
+    return f'W/"u{user_id}.{version or 0}{_day_suffix(daily)}"'
+
+
+def vehicle_etag(db: Session, user_id: int, vehicle_id: int, daily: bool = False) -> Optional[str]:
+    # None se o veículo não existir ou não for do usuário (a rota segue e responde 404)
+    row = db.query(models.Vehicle.data_version)\
+        .filter(models.Vehicle.id == vehicle_id, models.Vehicle.owner_id == user_id).first()
+    if row is None:
+        return None
+    return f'W/"v{vehicle_id}.{row.data_version or 0}{_day_suffix(daily)}"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Comparação fraca: W/"x" e "x" representam a mesma versão
+    return "*" in candidates or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in candidates]
+
+
+def conditional(request: Request, response: Response, etag: Optional[str]) -> Optional[Response]:
+    # Resposta 304 se o cliente já tem esta versão; senão grava o ETag na resposta normal e retorna None
+    if etag is None:
+        return None
+    headers = {"ETag": etag, **CACHE_HEADERS}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None